@@ -0,0 +1,608 @@
+## Benchmarks for the data access and modeling paths in util.py
+#
+#   python benchmark.py <benchmark> [options]
+#
+# Benchmarks that need beer.db work on a temporary copy, so the database
+# the app is serving is never modified.
+import argparse
+import contextlib
+import os
+import pickle
+import shutil
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import util
+from migrate_db import migrate
+
+
+def timed(fn, *args, **kwargs):
+    # util's functions print progress; keep it out of the report
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+    return result, elapsed
+
+
+def traced(fn, *args, **kwargs):
+    # peak bytes allocated while fn runs (numpy and scipy buffers included)
+    tracemalloc.start()
+    try:
+        result, _ = timed(fn, *args, **kwargs)
+        return result, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def report(label, times):
+    times = 1000 * np.array(times)
+    print("{:<32} mean = {:8.2f} ms   median = {:8.2f} ms   p95 = {:8.2f} ms".format(
+        label, times.mean(), np.median(times), np.percentile(times, 95)))
+
+
+def copy_database(database_path, tmp_dir):
+    path = os.path.join(tmp_dir, 'beer.db')
+    shutil.copyfile(database_path, path)
+    return path
+
+
+def synthetic_ratings(n_users, n_beers, ratings_per_user, seed=12, n_tastes=0):
+    # skewed beer popularity, ratings on Untappd's quarter-star scale;
+    # with n_tastes, users mostly drink (and like) beers of their own taste group
+    rs = np.random.RandomState(seed)
+    n_ratings = n_users * ratings_per_user
+    popularity = rs.gamma(0.6, 1.0, n_beers)
+    users = np.repeat(np.arange(n_users), ratings_per_user)
+    if n_tastes:
+        user_taste = rs.randint(n_tastes, size=n_users)
+        beer_taste = rs.randint(n_tastes, size=n_beers)
+        taste_beers = [np.flatnonzero(beer_taste == taste) for taste in range(n_tastes)]
+        beers = rs.choice(n_beers, n_ratings, p=popularity / popularity.sum())
+        own = rs.rand(n_ratings) < 0.8
+        for taste in range(n_tastes):
+            rows = np.flatnonzero(own & (user_taste[users] == taste))
+            weights = popularity[taste_beers[taste]]
+            beers[rows] = rs.choice(taste_beers[taste], len(rows), p=weights / weights.sum())
+        bonus = np.where(user_taste[users] == beer_taste[beers], 0.5, -0.5)
+    else:
+        beers = rs.choice(n_beers, n_ratings, p=popularity / popularity.sum())
+        bonus = 0
+    ratings = np.clip(np.round((rs.normal(3.7, 0.6, n_ratings) + bonus) * 4) / 4, 0.25, 5.0)
+    return pd.DataFrame({'username': np.char.add('user', users.astype(str)),
+                         'beer_name': np.char.add('beer', beers.astype(str)),
+                         'user_rating': ratings})
+
+
+######################################################
+### Lookups
+######################################################
+def bench_lookups(args):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        database_path = copy_database(args.db, tmp_dir)
+        with sqlite3.connect(database_path) as conn:
+            users = [row[0] for row in conn.execute("SELECT DISTINCT username FROM prepped_data")]
+            beers = [row[0] for row in conn.execute("SELECT DISTINCT beer_name FROM prepped_data")]
+        rs = np.random.RandomState(args.seed)
+        users = rs.choice(users, min(args.samples, len(users)), replace=False)
+        # names containing quotes can't be used with the old string-formatted queries
+        beers = rs.choice([beer for beer in beers if "'" not in beer], min(args.samples, len(beers)), replace=False)
+
+        user_cols = ['username', 'beer_description', 'ABV', 'IBU', 'global_rating', 'user_rating']
+        beer_cols = ['ABV', 'IBU', 'global_rating']
+
+        print("Before: string-formatted queries against prepped_data")
+        user_times = [timed(util.import_table, database_path,
+                            "SELECT {} FROM prepped_data WHERE username = '{}'".format(', '.join(user_cols), user))[1]
+                      for user in users]
+        beer_times = [timed(util.import_table, database_path,
+                            "SELECT {} FROM prepped_data WHERE beer_name = '{}'".format(', '.join(beer_cols), beer),
+                            remove_dups=False)[1]
+                      for beer in beers]
+        report('per-user lookup', user_times)
+        report('per-beer lookup', beer_times)
+
+        print("\nMigrating...")
+        migrate(database_path)
+
+        print("\nAfter: parameterized queries against the normalized tables")
+        user_times = [timed(util.lookup_ratings, user_cols, username=user, database_path=database_path)[1]
+                      for user in users]
+        beer_times = [timed(util.lookup_ratings, beer_cols, beer_name=beer, remove_dups=False,
+                            database_path=database_path)[1]
+                      for beer in beers]
+        report('per-user lookup', user_times)
+        report('per-beer lookup', beer_times)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+######################################################
+### Neighbor index
+######################################################
+def bench_neighbors(args):
+    df = synthetic_ratings(args.users, args.beers, args.ratings_per_user, seed=args.seed)
+    ui_matrix, elapsed = timed(util.create_ui_matrix, df)
+    print("{:,d} users x {:,d} beers, {:,d} ratings (matrix built in {:.2f}s)".format(
+        ui_matrix.shape[0], ui_matrix.shape[1], ui_matrix.ratings.nnz, elapsed))
+
+    for chunk_size in [256, 1024]:
+        index, elapsed = timed(util.build_neighbor_index, ui_matrix, k=args.k, chunk_size=chunk_size)
+        print("k = {}, chunk = {:>5}: {:.2f}s, {:,.0f} users/s, index = {:.1f} MB".format(
+            args.k, chunk_size, elapsed, ui_matrix.shape[0] / elapsed, index.nbytes() / 1024**2))
+
+    users = np.random.RandomState(args.seed).choice(ui_matrix.users, args.samples, replace=False)
+    exact = [timed(util.calculate_cosine_similarity, user, ui_matrix)[1] for user in users]
+    lookup = [timed(index.neighborhood, user)[1] for user in users]
+    report('exact neighbors per user', exact)
+    report('index neighbors per user', lookup)
+
+
+######################################################
+### Approximate neighbors
+######################################################
+def bench_ann(args):
+    # LSH only helps when similar users exist, so the users get taste groups
+    df = synthetic_ratings(args.users, args.beers, args.ratings_per_user, seed=args.seed, n_tastes=50)
+    ui_matrix, elapsed = timed(util.create_ui_matrix, df)
+    print("{:,d} users x {:,d} beers, {:,d} ratings (matrix built in {:.2f}s)".format(
+        ui_matrix.shape[0], ui_matrix.shape[1], ui_matrix.ratings.nnz, elapsed))
+
+    users = np.random.RandomState(args.seed).choice(ui_matrix.users, args.samples, replace=False)
+    exact = [timed(util.calculate_cosine_similarity, user, ui_matrix)[1] for user in users]
+    report('exact', exact)
+
+    for n_tables, n_bits in [(8, 8), (16, 8), (32, 8), (32, 10)]:
+        index, elapsed = timed(util.LSHIndex, ui_matrix, n_tables=n_tables, n_bits=n_bits, seed=args.seed)
+        print("\n{} tables x {} bits: hashed in {:.2f}s, index = {:.1f} MB".format(
+            n_tables, n_bits, elapsed, index.nbytes() / 1024**2))
+        for n_probes in [0, 1, 2]:
+            recall, _ = timed(util.lsh_recall_at_k, index, users, k=args.k, n_probes=n_probes)
+            candidates = np.mean([len(index.candidates(ui_matrix.user_index[user], n_probes)) for user in users])
+            times = [timed(index.neighborhood, user, n_probes=n_probes)[1] for user in users]
+            report('probes = {}, recall@{} = {:.3f}'.format(n_probes, args.k, recall), times)
+            print("{:<32} {:,.0f} candidates per query".format('', candidates))
+
+
+######################################################
+### Collaborative filtering predictions
+######################################################
+def loop_predictions(df, user_of_interest, beers):
+    # the per-beer scan collaborative_filtering used before the grouped kernel
+    predictions = []
+    for beer in beers:
+        try:
+            predictions.append(df[(df.sort_values('nearest_neighbor_rank')['beer_name'] == beer) &
+                                  (df['username'] != user_of_interest)]['user_rating'].iloc[0])
+        except IndexError:
+            predictions.append(np.nan)
+    return np.array(predictions, dtype=float)
+
+
+def bench_cf(args):
+    df = synthetic_ratings(args.users, args.beers, args.ratings_per_user, seed=args.seed)
+    print("{:,d} users x {:,d} beers, {:,d} ratings".format(args.users, args.beers, len(df)))
+
+    users = np.random.RandomState(args.seed).choice(df['username'].unique(), args.samples, replace=False)
+    loop_times, kernel_times = [], []
+    for user in users:
+        ranked_df, _ = timed(util.COSINE_STEP, df, user)
+        beers = list(ranked_df[ranked_df['username'] == user]['beer_name'])
+        loop, elapsed = timed(loop_predictions, ranked_df, user, beers)
+        loop_times.append(elapsed)
+        kernel, elapsed = timed(util.closest_neighbor_ratings, ranked_df, user, beers)
+        kernel_times.append(elapsed)
+        assert np.allclose(loop, kernel.values.astype(float), rtol=0, atol=0, equal_nan=True), user
+    report('per-beer loop', loop_times)
+    report('grouped kernel', kernel_times)
+    print("identical predictions for all {} users, {:.0f}x faster".format(
+        len(users), np.mean(loop_times) / np.mean(kernel_times)))
+
+
+######################################################
+### k-NN catalog scoring
+######################################################
+def bench_knn(args):
+    df = synthetic_ratings(args.users, args.beers, args.ratings_per_user, seed=args.seed, n_tastes=50)
+    ui_matrix, elapsed = timed(util.create_ui_matrix, df)
+    print("{:,d} users x {:,d} beers, {:,d} ratings (matrix built in {:.2f}s)".format(
+        ui_matrix.shape[0], ui_matrix.shape[1], ui_matrix.ratings.nnz, elapsed))
+
+    users = np.random.RandomState(args.seed).choice(ui_matrix.users, args.samples, replace=False)
+    for k, min_support in [(args.k, 1), (args.k, 3), (4 * args.k, 3)]:
+        results = [timed(util.knn_scores, user, ui_matrix, k=k, min_support=min_support) for user in users]
+        scored = np.mean([scores['predicted_rating'].notna().sum() for scores, _ in results])
+        report('k = {}, min support = {}'.format(k, min_support), [elapsed for _, elapsed in results])
+        print("{:<32} {:,.0f} of {:,d} beers scored per user".format('', scored, ui_matrix.shape[1]))
+
+
+######################################################
+### ALS matrix factorization
+######################################################
+def bench_als(args):
+    df = synthetic_ratings(args.users, args.beers, args.ratings_per_user, seed=args.seed, n_tastes=50)
+    df = df.groupby(['username', 'beer_name'], as_index=False)['user_rating'].mean()
+    print("{:,d} users x {:,d} beers, {:,d} ratings".format(args.users, args.beers, len(df)))
+
+    # hold out 20% of the sampled users' ratings; everything else trains
+    rs = np.random.RandomState(args.seed)
+    users = rs.choice(df['username'].unique(), args.samples, replace=False)
+    held_out = df['username'].isin(users) & (rs.rand(len(df)) < 0.2)
+    train_df, test_df = df[~held_out], df[held_out]
+    ui_matrix = util.create_ui_matrix(train_df)
+
+    for n_jobs in sorted({1, os.cpu_count() or 1}):
+        model, elapsed = timed(util.train_als, ui_matrix, rank=args.rank, reg=args.reg,
+                               iterations=args.iterations, n_jobs=n_jobs)
+        print("ALS rank {}, {} iterations, {} thread(s): trained in {:.2f}s".format(
+            args.rank, args.iterations, n_jobs, elapsed))
+
+    als_errors, cf_errors, predict_times, cf_times = [], [], [], []
+    for user in users:
+        test = test_df[test_df['username'] == user]
+        if len(test) == 0:
+            continue
+        predictions, elapsed = timed(model.predict, user, list(test['beer_name']))
+        predict_times.append(elapsed)
+        als_errors += list(predictions - test['user_rating'].values)
+
+        ranked_df, elapsed = timed(util.COSINE_STEP, train_df, user)
+        predictions, cf_elapsed = timed(util.closest_neighbor_ratings, ranked_df, user, list(test['beer_name']))
+        cf_times.append(elapsed + cf_elapsed)
+        cf_errors += list((predictions.values - test['user_rating'].values)[predictions.notna().values])
+
+    report('ALS predict held-out beers', predict_times)
+    report('collaborative filtering', cf_times)
+    print("held-out MAE: ALS = {:.3f} ({:,d} ratings), collaborative filtering = {:.3f} ({:,d} ratings)".format(
+        np.abs(als_errors).mean(), len(als_errors), np.abs(cf_errors).mean(), len(cf_errors)))
+
+
+######################################################
+### Hybrid grid
+######################################################
+def synthetic_hybrid_frame(args):
+    # ratings plus per-beer ABV / IBU / global_rating, like the 'simple' features
+    df = synthetic_ratings(args.users, args.beers, args.ratings_per_user, seed=args.seed, n_tastes=50)
+    rs = np.random.RandomState(args.seed)
+    beers = pd.DataFrame({'beer_name': df['beer_name'].unique()})
+    beers['ABV'] = np.round(rs.gamma(6.0, 1.0, len(beers)), 1)
+    beers['IBU'] = np.round(rs.gamma(2.0, 20.0, len(beers)))
+    beers['global_rating'] = np.round(rs.normal(3.7, 0.3, len(beers)), 2)
+    return pd.merge(df, beers, on='beer_name')[['username', 'beer_name', 'ABV', 'IBU', 'global_rating', 'user_rating']]
+
+
+def frame_training_sets(df, user_of_interest, features, target):
+    # how run_hybrid cut each cell's training set out of the frame before the
+    # layout; the sets are returned so the slicing can't be skipped
+    sets = []
+    n_users_list = [5, 10, 15, 20, 30, 40, 50]
+    for min_ppu in [0, 50, 100, 250, 500]:
+        user_indices = df.username.value_counts()[df.username.value_counts() > min_ppu].index
+        sub_df = df[df['username'].isin(user_indices)]
+        n_users_list = [n_users for n_users in n_users_list if n_users < len(user_indices)]
+        for top_n in n_users_list:
+            top_n_nn = list(sub_df['nearest_neighbor_rank'].dropna().unique())[:top_n]
+            df_top_n = df[df['nearest_neighbor_rank'].isin(top_n_nn)]
+            X_train, y_train = df_top_n[features], np.array(df_top_n[target])
+            X_test = df[df['username'] == user_of_interest][features]
+            sets.append((X_train, y_train, X_test))
+    return sets
+
+
+def layout_training_sets(layout):
+    sets = []
+    n_users_list = [5, 10, 15, 20, 30, 40, 50]
+    for min_ppu in [0, 50, 100, 250, 500]:
+        n_users_list = [n_users for n_users in n_users_list if n_users < layout.n_users(min_ppu)]
+        sets.append(layout.training_sets(min_ppu, n_users_list))
+    return sets
+
+
+def bench_hybrid(args):
+    df = synthetic_hybrid_frame(args)
+    user = df['username'].value_counts().index[len(df['username'].unique()) // 2]
+    print("{:,d} users x {:,d} beers, {:,d} ratings, user = {}".format(
+        args.users, args.beers, len(df), user))
+
+    # splitting the grid's training sets, without fitting
+    features = ['ABV', 'IBU', 'global_rating']
+    ranked_df, _ = timed(util.COSINE_STEP, df.copy(), user)
+    frame_times = [timed(frame_training_sets, ranked_df, user, features, 'user_rating')[1] for _ in range(5)]
+    layout, elapsed = timed(util.HybridLayout, ranked_df, user, features, 'user_rating')
+    layout_times = [timed(layout_training_sets, layout)[1] for _ in range(5)]
+    report('split: filter the frame', frame_times)
+    report('split: layout views', layout_times)
+    print("{:<32} {:8.2f} ms to build the layout once".format('', 1000 * elapsed))
+    first = timed(util.get_hybrid_layout, df.copy(), user, features, 'user_rating', cache_key='bench')[1]
+    again = timed(util.get_hybrid_layout, df.copy(), user, features, 'user_rating', cache_key='bench')[1]
+    print("ranking + layout: {:.2f} ms first build, {:.2f} ms for a repeated build".format(1000 * first, 1000 * again))
+
+    baseline = None
+    for n_jobs in args.jobs:
+        (models, maes, quarters, halves), elapsed = timed(util.run_hybrid, df.copy(), user, 'user_rating', n_jobs=n_jobs)
+        if baseline is None:
+            baseline, baseline_elapsed = maes, elapsed
+        print("{:>2} worker(s): {:7.2f}s ({:.1f}x), {} cells, same MAEs as {} worker(s): {}".format(
+            n_jobs, elapsed, baseline_elapsed / elapsed, sum(1 for model in models if model != 0),
+            args.jobs[0], maes == baseline))
+
+
+######################################################
+################## cbf model search ##################
+######################################################
+def bench_cbf(args):
+    # each "Build Model" click: cbf on one user's count-vectorized ratings
+    df = util.count_vectorizer(util.load_ratings(['username', 'beer_description', 'ABV', 'IBU', 'global_rating',
+                                                  'user_rating'], database_path=args.db), 'beer_description',
+                               sparse_output=True)
+    users = df['username'].value_counts()
+    users = np.random.RandomState(args.seed).choice(users[users >= 50].index, min(args.samples, 5), replace=False)
+    print("{} users, {} features".format(len(users), df.shape[1] - 2))
+
+    for algorithm in ['Lasso', 'Ridge', 'ElasticNet']:
+        grid_times, path_times, same = [], [], 0
+        for user in users:
+            user_df = df[df['username'] == user].drop(['username'], axis=1)
+            (_, grid_params, grid_mae, _, _), elapsed = timed(util.cbf, user_df, algorithm, 'user_rating',
+                                                              remove_all_outliers=True, search='grid')
+            grid_times.append(elapsed)
+            (_, path_params, path_mae, _, _), elapsed = timed(util.cbf, user_df, algorithm, 'user_rating',
+                                                              remove_all_outliers=True, search='path')
+            path_times.append(elapsed)
+            same += path_params == grid_params and np.isclose(path_mae, grid_mae)
+        report('{}: grid search'.format(algorithm), grid_times)
+        report('{}: paths'.format(algorithm), path_times)
+        print("{:<32} {:.0f}x faster, same params and MAE for {} of {} users".format(
+            '', np.mean(grid_times) / np.mean(path_times), same, len(users)))
+
+
+######################################################
+################ sparse text features ################
+######################################################
+def synthetic_descriptions(n_beers, vocab, seed=12):
+    # 3 to 12 words per beer from a Zipf-like vocabulary of vocab words
+    rs = np.random.RandomState(seed)
+    words = np.char.add('w', np.arange(vocab).astype(str))
+    weights = 1 / np.arange(1, vocab + 1)
+    return pd.Series([' '.join(rs.choice(words, rs.randint(3, 13), p=weights / weights.sum()))
+                      for _ in range(n_beers)])
+
+
+def synthetic_described_frame(args):
+    # the hybrid frame plus a description of 3 to 12 words per beer, drawn
+    # from a Zipf-like vocabulary of args.vocab words
+    df = synthetic_hybrid_frame(args)
+    beers = df['beer_name'].unique()
+    descriptions = synthetic_descriptions(len(beers), args.vocab, seed=args.seed)
+    df['beer_description'] = df['beer_name'].map(dict(zip(beers, descriptions)))
+    return df
+
+
+def sparse_count_vectorizer(df, vectoring_col):
+    return util.count_vectorizer(df, vectoring_col, sparse_output=True)
+
+
+def bench_features(args):
+    if args.vocab:
+        df = synthetic_described_frame(args)
+        source = "{:,d} synthetic ratings, {:,d}-word vocabulary".format(len(df), args.vocab)
+    else:
+        df = util.load_ratings(['username', 'user_rating', 'beer_name', 'beer_description', 'ABV', 'IBU',
+                                'global_rating'], database_path=args.db)
+        source = "{:,d} ratings in {}".format(len(df), args.db)
+    users = df['username'].value_counts()
+    user = users.index[len(users) // 2]
+    users = np.random.RandomState(args.seed).choice(users[users >= 20].index, min(args.samples, 5), replace=False)
+
+    for label, vectorizer in [('dense', util.count_vectorizer), ('sparse', sparse_count_vectorizer)]:
+        features, elapsed = timed(vectorizer, df, 'beer_description')
+        _, peak = traced(vectorizer, df, 'beer_description')
+        if label == 'dense':
+            print("{}: {:,d} rows x {:,d} features".format(source, len(features), features.shape[1] - 3))
+        print("{:<7} vectorize: {:8.2f} s   peak {:8.1f} MB".format(label, elapsed, peak / 1024**2))
+
+        cbf_times, cbf_peak = [], 0
+        for username in users:
+            cbf_df = features[features['username'] == username].drop(['username', 'beer_name'], axis=1)
+            cbf_times.append(timed(util.cbf, cbf_df, 'Lasso', 'user_rating', remove_all_outliers=True)[1])
+            cbf_peak = max(cbf_peak, traced(util.cbf, cbf_df, 'Lasso', 'user_rating', remove_all_outliers=True)[1])
+        print("{:<7} cbf:       {:8.2f} s   peak {:8.1f} MB   (mean of {} users)".format(
+            label, np.mean(cbf_times), cbf_peak / 1024**2, len(users)))
+
+        (_, maes, _, _), elapsed = timed(util.run_hybrid, features, user, 'user_rating')
+        _, peak = traced(util.run_hybrid, features, user, 'user_rating')
+        print("{:<7} run_hybrid:{:8.2f} s   peak {:8.1f} MB   best MAE {:.4f}".format(
+            label, elapsed, peak / 1024**2, min(mae for mae in maes if mae > 0)))
+        del features
+
+
+######################################################
+############### hashed text features #################
+######################################################
+def bench_hashing(args):
+    # fit + transform over the ratings' descriptions, then encoding a few
+    # beers to score them, at each catalog size; the vocabulary grows with it
+    encoders = [('count-vect', {}), ('tfidf-vect', {}), ('hash-vect', {'idf': False}), ('hash-vect', {'idf': True})]
+    for n_beers in args.catalog_sizes:
+        descriptions = synthetic_descriptions(n_beers, max(args.vocab, n_beers // 2), seed=args.seed)
+        rows = descriptions.repeat(args.ratings_per_beer).reset_index(drop=True)
+        beers = np.random.RandomState(args.seed).choice(n_beers, 10, replace=False)
+        print("{:,d} beers, {:,d} rating rows".format(n_beers, len(rows)))
+
+        for feature_selection, params in encoders:
+            def fit():
+                encoder = util.DescriptionEncoder(feature_selection, **params)
+                # hash-vect's idf comes from the catalog, the vectorizers fit the rows
+                encoder.fit(descriptions if feature_selection == 'hash-vect' else rows)
+                return encoder, encoder.encode(rows)
+            (encoder, X), elapsed = timed(fit)
+            _, peak = traced(fit)
+            times = [timed(encoder.encode, descriptions[beers])[1] for _ in range(args.samples)]
+            label = feature_selection + (' + idf' if params.get('idf') else '')
+            print("  {:<17} fit {:7.2f} s   peak {:8.1f} MB   {:>7,d} columns   encoder {:8.1f} KB   "
+                  "score 10 beers {:6.2f} ms".format(label, elapsed, peak / 1024**2, X.shape[1],
+                                                     len(pickle.dumps(encoder)) / 1024, 1000 * np.median(times)))
+
+    # and what their columns cost cbf and run_hybrid, on the ratings in --db
+    df, catalog, users, user = encoder_fit_data(args)
+    encoders = [('count-vect', util.DescriptionEncoder('count-vect').fit(df['beer_description'])),
+                ('hash-vect', util.DescriptionEncoder('hash-vect').fit(catalog)),
+                ('hash-vect + idf', util.DescriptionEncoder('hash-vect', idf=True).fit(catalog))]
+    bench_encoder_fits(df, encoders, users, user)
+
+
+def encoder_fit_data(args):
+    # the ratings in --db, the catalog's descriptions, up to 5 users for cbf
+    # and one for run_hybrid
+    df = util.load_ratings(['username', 'user_rating', 'beer_name', 'beer_description', 'ABV', 'IBU',
+                            'global_rating'], database_path=args.db)
+    catalog = util.get_beer_features(args.db).descriptions
+    # ties broken by name, so the same seed picks the same users in every run
+    users = df['username'].value_counts().sort_index().sort_values(ascending=False, kind='mergesort')
+    user = users.index[len(users) // 2]
+    users = np.random.RandomState(args.seed).choice(users[users >= 20].index, min(args.samples, 5), replace=False)
+    print("{:,d} ratings, {:,d} beers in {}".format(len(df), len(catalog), args.db))
+    return df, catalog, users, user
+
+
+def bench_encoder_fits(df, encoders, users, user):
+    for label, encoder in encoders:
+        features = encoder.transform(df, 'beer_description')
+        cbf_times, cbf_maes = [], []
+        for username in users:
+            cbf_df = features[features['username'] == username].drop(['username', 'beer_name'], axis=1)
+            (_, _, mae, _, _), elapsed = timed(util.cbf, cbf_df, 'Lasso', 'user_rating', remove_all_outliers=True)
+            cbf_times.append(elapsed)
+            cbf_maes.append(mae)
+        (_, maes, _, _), elapsed = timed(util.run_hybrid, features, user, 'user_rating')
+        print("{:<15} {:>6,d} columns   cbf {:6.2f} s, MAE {:.4f} (mean of {} users)   "
+              "run_hybrid {:7.2f} s, best MAE {:.4f}".format(
+                  label, len(encoder.columns()), np.mean(cbf_times), np.mean(cbf_maes), len(users),
+                  elapsed, min(mae for mae in maes if mae > 0)))
+
+
+######################################################
+############## low-rank description svd ##############
+######################################################
+def bench_embeddings(args):
+    # cbf and run_hybrid fit time and MAE on the raw vectorizer columns
+    # against svd-vect embeddings of each size
+    df, catalog, users, user = encoder_fit_data(args)
+    encoders = [('count-vect', util.DescriptionEncoder('count-vect').fit(df['beer_description'])),
+                ('tfidf-vect', util.DescriptionEncoder('tfidf-vect').fit(df['beer_description']))]
+    built = set()
+    for n_components in args.components:
+        encoder, elapsed = timed(util.DescriptionEncoder('svd-vect', n_components=n_components).fit, catalog)
+        # fit caps the components at the catalog's terms and distinct descriptions
+        fitted = encoder.svd.n_components
+        print("svd-vect {:>3}: {} components, basis built in {:.2f}s, {:.1%} of the tf-idf variance".format(
+            n_components, fitted, elapsed, encoder.svd.explained_variance_ratio_.sum()))
+        if fitted not in built:
+            built.add(fitted)
+            encoders.append(('svd-vect {}'.format(fitted), encoder))
+    bench_encoder_fits(df, encoders, users, user)
+
+
+######################################################
+################ warm-started hybrid #################
+######################################################
+def bench_warm(args):
+    df = synthetic_hybrid_frame(args)
+    user = df['username'].value_counts().index[len(df['username'].unique()) // 2]
+    print("{:,d} users x {:,d} beers, {:,d} ratings, user = {}".format(
+        args.users, args.beers, len(df), user))
+
+    # build the ranked layout once so only the fitting is timed
+    util.run_hybrid(df.copy(), user, 'user_rating', n_jobs=1, cache_key='bench')
+    (models, maes, _, _), elapsed = timed(util.run_hybrid, df.copy(), user, 'user_rating', n_jobs=1,
+                                          cache_key='bench')
+    (warm_models, warm_maes, _, _), warm_elapsed = timed(util.run_hybrid, df.copy(), user, 'user_rating',
+                                                         cache_key='bench', warm_start=True)
+    cells = [i for i, model in enumerate(models) if model != 0]
+    best = min(cells, key=lambda i: maes[i])
+    warm_best = min(cells, key=lambda i: warm_maes[i])
+    print("LassoCV per cell:    {:7.2f}s for {} cells".format(elapsed, len(cells)))
+    print("warm-started paths:  {:7.2f}s ({:.1f}x)".format(warm_elapsed, elapsed / warm_elapsed))
+    print("same alpha in {} of {} cells, largest MAE difference {:.2e}".format(
+        sum(1 for i in cells if np.isclose(models[i].alpha_, warm_models[i].alpha_)), len(cells),
+        max(abs(maes[i] - warm_maes[i]) for i in cells)))
+    print("best cell: {} (MAE {:.4f}) vs {} (MAE {:.4f})".format(best, maes[best], warm_best, warm_maes[warm_best]))
+
+
+######################################################
+################ successive halving ##################
+######################################################
+def best_cell(maes):
+    cells = [i for i, mae in enumerate(maes) if mae > 0]
+    return min(cells, key=lambda i: maes[i]) if cells else None
+
+
+def bench_halving(args):
+    df = synthetic_hybrid_frame(args)
+    user = df['username'].value_counts().index[len(df['username'].unique()) // 2]
+    print("{:,d} users x {:,d} beers, {:,d} ratings, user = {}".format(
+        args.users, args.beers, len(df), user))
+
+    # build the ranked layout once so only the search is timed
+    util.get_hybrid_layout(df.copy(), user, ['ABV', 'IBU', 'global_rating'], 'user_rating', cache_key='bench')
+    (_, maes, _, _), elapsed = timed(util.run_hybrid, df.copy(), user, 'user_rating', n_jobs=1, cache_key='bench')
+    grid_best = best_cell(maes)
+    print("grid:    {:7.2f}s, {} cells, best cell {} (MAE {:.4f})".format(
+        elapsed, sum(1 for mae in maes if mae > 0), grid_best, maes[grid_best]))
+
+    budgets = [None] + ([args.budget] if args.budget else [elapsed / 8, elapsed / 4])
+    for budget in budgets:
+        (_, halving_maes, _, _), halving_elapsed = timed(util.run_hybrid, df.copy(), user, 'user_rating', n_jobs=1,
+                                                         cache_key='bench', search='halving', budget=budget)
+        best = best_cell(halving_maes)
+        print("halving: {:7.2f}s ({:.1f}x), budget {}, best cell {} (MAE {:.4f}), grid's pick: {}".format(
+            halving_elapsed, elapsed / halving_elapsed, 'none' if budget is None else '{:.2f}s'.format(budget),
+            best, halving_maes[best], best == grid_best and halving_maes[best] == maes[grid_best]))
+
+
+benchmarks = {
+    'als': bench_als,
+    'ann': bench_ann,
+    'cbf': bench_cbf,
+    'cf': bench_cf,
+    'embeddings': bench_embeddings,
+    'features': bench_features,
+    'halving': bench_halving,
+    'hashing': bench_hashing,
+    'hybrid': bench_hybrid,
+    'knn': bench_knn,
+    'lookups': bench_lookups,
+    'neighbors': bench_neighbors,
+    'warm': bench_warm,
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='BeerMe benchmarks')
+    parser.add_argument('benchmark', choices=sorted(benchmarks))
+    parser.add_argument('--db', default=util.db_path, help='path to beer.db')
+    parser.add_argument('--samples', type=int, default=50, help='number of users / beers to sample')
+    parser.add_argument('--seed', type=int, default=12)
+    parser.add_argument('--users', type=int, default=100000, help='synthetic users')
+    parser.add_argument('--beers', type=int, default=20000, help='synthetic beers')
+    parser.add_argument('--ratings-per-user', type=int, default=50, help='synthetic ratings per user')
+    parser.add_argument('--k', type=int, default=50, help='neighbors per user')
+    parser.add_argument('--rank', type=int, default=32, help='ALS latent factors')
+    parser.add_argument('--reg', type=float, default=0.1, help='ALS regularization')
+    parser.add_argument('--iterations', type=int, default=10, help='ALS iterations')
+    parser.add_argument('--jobs', type=int, nargs='+', default=[1, 2, 4], help='worker counts to compare')
+    parser.add_argument('--budget', type=float, default=None, help='halving time budget in seconds')
+    parser.add_argument('--vocab', type=int, default=0,
+                        help='synthetic description vocabulary (features benchmark; 0 uses beer.db)')
+    parser.add_argument('--catalog-sizes', type=int, nargs='+', default=[1000, 10000, 50000],
+                        help='synthetic catalog sizes (hashing benchmark)')
+    parser.add_argument('--ratings-per-beer', type=int, default=5, help='synthetic rating rows per beer (hashing)')
+    parser.add_argument('--components', type=int, nargs='+', default=[32, 64, 128],
+                        help='svd-vect embedding sizes to compare (embeddings benchmark)')
+    args = parser.parse_args()
+    benchmarks[args.benchmark](args)
@@ -0,0 +1,30 @@
+## Build the low-rank description basis used by the 'svd-vect' feature selection
+#
+#   python build_description_basis.py [--db data/beer.db] [--components 64]
+#
+# The basis is tied to the version of beer.db it was built from; the app
+# rebuilds one in memory once the data changes.
+import argparse
+import time
+
+from util import *
+
+
+def build(database_path=db_path, path=description_basis_path, n_components=svd_components):
+    start = time.time()
+    encoder = build_description_basis(database_path, n_components=n_components)
+    elapsed = time.time() - start
+    atomic_write(path, pickle.dumps(encoder, protocol=pickle.HIGHEST_PROTOCOL))
+    print("Projected {:,d} terms onto {} components in {:.2f}s, {:.1%} of the tf-idf variance -> {}".format(
+        len(encoder.vect.vocabulary_), encoder.svd.n_components, elapsed,
+        encoder.svd.explained_variance_ratio_.sum(), path))
+    return encoder
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the svd-vect description basis')
+    parser.add_argument('--db', default=db_path, help='path to beer.db')
+    parser.add_argument('--out', default=description_basis_path, help='where to write the basis')
+    parser.add_argument('--components', type=int, default=svd_components, help='embedding dimensions per beer')
+    args = parser.parse_args()
+    build(args.db, args.out, n_components=args.components)
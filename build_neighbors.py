@@ -0,0 +1,67 @@
+## Precompute the top-K neighbor index used by collaborative filtering
+#
+#   python build_neighbors.py [--db data/beer.db] [--k 50] [--chunk-size N]
+#   python build_neighbors.py --items [--k 50]
+#
+# The index is tied to the version of beer.db it was built from; the app
+# ignores it (and falls back to exact similarities) once the data changes.
+# --items builds the top-K similar beers per beer for item-based filtering
+# instead, which the app rebuilds in memory when it is stale.
+import argparse
+import time
+
+from util import *
+
+
+def build(database_path=db_path, path=neighbor_index_path, k=50, chunk_size=None):
+    start = time.time()
+    version = data_version(database_path)
+    df = load_ratings(['user_rating', 'beer_name', 'username'], remove_dups=False,
+                      database_path=database_path)
+    ui_matrix = create_ui_matrix(df)
+    print("Loaded {:,d} users x {:,d} beers in {:.2f}s".format(
+        ui_matrix.shape[0], ui_matrix.shape[1], time.time() - start))
+
+    start = time.time()
+    index = build_neighbor_index(ui_matrix, k=k, chunk_size=chunk_size, version=version, verbose=True)
+    elapsed = time.time() - start
+    index.save(path)
+    print("Built top-{} neighbors in {:.2f}s ({:,.0f} users/s), {:.1f} MB -> {}".format(
+        index.k, elapsed, len(index.users) / max(elapsed, 1e-9), index.nbytes() / 1024**2, path))
+    return index
+
+
+def build_items(database_path=db_path, path=item_neighbors_path, n=50, chunk_size=None):
+    start = time.time()
+    version = data_version(database_path)
+    df = load_ratings(['user_rating', 'beer_name', 'username'], remove_dups=False,
+                      database_path=database_path)
+    ui_matrix = create_ui_matrix(df)
+    print("Loaded {:,d} users x {:,d} beers in {:.2f}s".format(
+        ui_matrix.shape[0], ui_matrix.shape[1], time.time() - start))
+
+    start = time.time()
+    item_neighbors = build_item_neighbors(ui_matrix, n=n, chunk_size=chunk_size, version=version, verbose=True)
+    elapsed = time.time() - start
+    item_neighbors.save(path)
+    n_beers = len(item_neighbors.beers)
+    print("Built top-{} similar beers in {:.2f}s ({:,.0f} beers/s) -> {}".format(
+        n, elapsed, n_beers / max(elapsed, 1e-9), path))
+    print("{:,d} similarities, {:.1f} MB as float32 sparse arrays (a dense float64 table would be {:.1f} MB)".format(
+        item_neighbors.similarities.nnz, item_neighbors.nbytes() / 1024**2, 8 * n_beers**2 / 1024**2))
+    return item_neighbors
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the collaborative filtering neighbor index')
+    parser.add_argument('--db', default=db_path, help='path to beer.db')
+    parser.add_argument('--items', action='store_true', help='build the item-item table instead')
+    parser.add_argument('--out', default=None, help='where to write the index')
+    parser.add_argument('--k', type=int, default=50, help='neighbors kept per user (or beer)')
+    parser.add_argument('--chunk-size', type=int, default=None,
+                        help='users (or beers) per similarity block (default: sized to ~128 MB)')
+    args = parser.parse_args()
+    if args.items:
+        build_items(args.db, args.out or item_neighbors_path, n=args.k, chunk_size=args.chunk_size)
+    else:
+        build(args.db, args.out or neighbor_index_path, k=args.k, chunk_size=args.chunk_size)
@@ -5,6 +5,7 @@ import pickle
 import dash_core_components as dcc
 import dash_html_components as html 
 from dash.dependencies import Input, Output, State
+from flask import jsonify
 import numpy as np
 
 from app import app, server
@@ -79,6 +80,22 @@ def display_page(pathname):
         return existing_user.layout
 
 
+# runtime counters for this worker
+@server.route('/stats')
+def stats():
+    return jsonify({'connections': connection_stats(), 'model_store': get_model_store().stats(),
+                    'training': get_training_queue().stats(), 'pipeline': pipeline_stats()})
+
+
+# progress of a training job, as shown by the tabs
+@server.route('/jobs/<job_id>')
+def job_status(job_id):
+    status = get_training_queue().status(job_id)
+    if status is None:
+        return jsonify({'error': 'unknown job'}), 404
+    return jsonify(status)
+
+
 ## run
 if __name__ == '__main__':
     server.run(debug=True)
\ No newline at end of file
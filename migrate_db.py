@@ -0,0 +1,137 @@
+## Build the normalized users / beers / ratings tables from prepped_data
+#
+#   python migrate_db.py [--db data/beer.db]
+#
+# prepped_data is left in place. The migration can be re-run at any time;
+# it drops and rebuilds the normalized tables in a single transaction.
+#
+# The app reads per-user / per-beer slices from ratings_view and everything
+# else from prepped_data, so the two have to hold the same rows. The
+# migration refuses to run when they can't: a beer with more than one
+# description / ABV / IBU, or a row without a username or beer_name.
+import argparse
+import sqlite3
+import sys
+import time
+
+from util import db_path
+
+# per-beer attributes move to `beers`, per-rating values stay on `ratings`
+beer_columns = ['beer_description', 'ABV', 'IBU']
+rating_columns = ['global_rating', 'user_rating']
+
+
+def column_types(conn, table):
+    return {row[1]: row[2] for row in conn.execute("PRAGMA table_info({})".format(table))}
+
+
+def unmigratable_rows(conn):
+    # (beers with conflicting attributes, rows without a username or beer_name)
+    # DISTINCT treats NULLs as equal, so a missing ABV next to a known one counts
+    conflicts = conn.execute("""SELECT COUNT(*) FROM (
+                                    SELECT beer_name FROM (SELECT DISTINCT beer_name, {} FROM prepped_data
+                                                           WHERE beer_name IS NOT NULL)
+                                    GROUP BY beer_name HAVING COUNT(*) > 1)""".format(
+                                        ', '.join(beer_columns))).fetchone()[0]
+    skipped = conn.execute("""SELECT COUNT(*) FROM prepped_data
+                              WHERE username IS NULL OR beer_name IS NULL""").fetchone()[0]
+    return conflicts, skipped
+
+
+def migrate(database_path=db_path):
+    start = time.time()
+    conn = sqlite3.connect(database_path, isolation_level=None)
+    types = column_types(conn, 'prepped_data')
+
+    conflicts, skipped = unmigratable_rows(conn)
+    if conflicts or skipped:
+        conn.close()
+        problems = []
+        if conflicts:
+            problems.append("{:,d} beers have more than one description/ABV/IBU".format(conflicts))
+        if skipped:
+            problems.append("{:,d} rows have no username or beer_name".format(skipped))
+        raise ValueError("prepped_data can't be normalized without changing what the app reads: {}; "
+                         "fix those rows and run the migration again".format('; '.join(problems)))
+
+    def col_defs(columns):
+        return ', '.join('{} {}'.format(col, types.get(col, '')).strip() for col in columns)
+
+    conn.execute("BEGIN")
+    for statement in ["DROP VIEW IF EXISTS ratings_view",
+                      "DROP TABLE IF EXISTS ratings",
+                      "DROP TABLE IF EXISTS beers",
+                      "DROP TABLE IF EXISTS users"]:
+        conn.execute(statement)
+
+    conn.execute("""CREATE TABLE users (
+                        user_id INTEGER PRIMARY KEY,
+                        username TEXT NOT NULL UNIQUE)""")
+    conn.execute("""CREATE TABLE beers (
+                        beer_id INTEGER PRIMARY KEY,
+                        beer_name TEXT NOT NULL UNIQUE,
+                        {})""".format(col_defs(beer_columns)))
+    conn.execute("""CREATE TABLE ratings (
+                        rating_id INTEGER PRIMARY KEY,
+                        user_id INTEGER NOT NULL REFERENCES users(user_id),
+                        beer_id INTEGER NOT NULL REFERENCES beers(beer_id),
+                        {})""".format(col_defs(rating_columns)))
+
+    conn.execute("""INSERT INTO users (username)
+                    SELECT DISTINCT username FROM prepped_data
+                    WHERE username IS NOT NULL ORDER BY username""")
+
+    # every row of a beer has the same attributes (checked above); take its first
+    conn.execute("""INSERT INTO beers (beer_name, {cols})
+                    SELECT p.beer_name, {p_cols} FROM prepped_data p
+                    JOIN (SELECT MIN(rowid) AS first_row FROM prepped_data
+                          WHERE beer_name IS NOT NULL GROUP BY beer_name) f
+                      ON p.rowid = f.first_row
+                    ORDER BY p.beer_name""".format(
+                        cols=', '.join(beer_columns),
+                        p_cols=', '.join('p.' + col for col in beer_columns)))
+
+    # keep prepped_data's rowid so rows come back in the original order
+    conn.execute("""INSERT INTO ratings (rating_id, user_id, beer_id, {cols})
+                    SELECT p.rowid, u.user_id, b.beer_id, {p_cols} FROM prepped_data p
+                    JOIN users u ON u.username = p.username
+                    JOIN beers b ON b.beer_name = p.beer_name
+                    ORDER BY p.rowid""".format(
+                        cols=', '.join(rating_columns),
+                        p_cols=', '.join('p.' + col for col in rating_columns)))
+
+    # covering indexes for the per-user and per-beer lookups
+    conn.execute("""CREATE INDEX ratings_by_user
+                    ON ratings (user_id, beer_id, {})""".format(', '.join(rating_columns)))
+    conn.execute("""CREATE INDEX ratings_by_beer
+                    ON ratings (beer_id, user_id, {})""".format(', '.join(rating_columns)))
+
+    conn.execute("""CREATE VIEW ratings_view AS
+                    SELECT r.rating_id, u.username, b.beer_name, {b_cols}, {r_cols}
+                    FROM ratings r
+                    JOIN users u ON u.user_id = r.user_id
+                    JOIN beers b ON b.beer_id = r.beer_id""".format(
+                        b_cols=', '.join('b.' + col for col in beer_columns),
+                        r_cols=', '.join('r.' + col for col in rating_columns)))
+    conn.execute("COMMIT")
+    conn.execute("ANALYZE")
+    # lets the app's read-only connections read while the database is written
+    conn.execute("PRAGMA journal_mode = WAL")
+
+    counts = {table: conn.execute("SELECT COUNT(*) FROM {}".format(table)).fetchone()[0]
+              for table in ['prepped_data', 'users', 'beers', 'ratings']}
+    conn.close()
+
+    print("Migrated {:,d} prepped_data rows in {:.2f}s".format(counts['prepped_data'], time.time() - start))
+    print("users = {:,d}, beers = {:,d}, ratings = {:,d}".format(counts['users'], counts['beers'], counts['ratings']))
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the normalized ratings tables in beer.db')
+    parser.add_argument('--db', default=db_path, help='path to beer.db')
+    args = parser.parse_args()
+    try:
+        migrate(args.db)
+    except ValueError as error:
+        sys.exit(str(error))
@@ -12,6 +12,8 @@ from util import *
 layout = html.Div(className = 'container my-4', children =[
 
     dcc.Store(id="memory"),
+    dcc.Store(id='model-job-collabfilt'),
+    dcc.Interval(id='model-job-interval-collabfilt', interval=1000, disabled=True),
     
     # username section
     html.Div(className='card', children=[
@@ -88,6 +90,24 @@ layout = html.Div(className = 'container my-4', children =[
         ]),
     ]),
 
+    # suggestion section
+    html.Div(className='card', children = [
+        html.Div(className='card-body', children = [
+            html.H2(className='card-title text-center', children = "Suggest a Beer"),
+            html.Div(className='card-text text-center m-3', children = [
+                    """
+                    Let us suggest a new beer for you, based on what users like you loved!
+                    """
+            ]),
+            html.Div(className='row justify-content-center', children=[
+                html.Button('Suggest', id='suggestion-button-collabfilt', className='btn btn-outline-primary')
+            ]),
+            html.Div(className='row justify-content-center my-3', children=[
+                html.Div(id='suggestion-results-collabfilt')
+            ]),
+        ]),
+    ]),
+
 ])
 # end container
 
@@ -106,21 +126,37 @@ def display_beer_loader(n_clicks, value):
         return {'display': 'none'}
 
 
-@app.callback(Output('model-results-collabfilt', 'children'),
+@app.callback(Output('model-job-collabfilt', 'data'),
                 [Input('model-button-collabfilt', 'n_clicks')],
                 [State('username-selection-dropdown-collabfilt', 'value')])
 def build_model(n_clicks, user_of_interest):
 
     if n_clicks != None:
-        
-        print("Running...")
-       
-        query = "SELECT user_rating, beer_name, username FROM prepped_data"
-        df = import_table(db_path, query, remove_dups=False)
-        mae, quarter, half = collaborative_filtering(df, user_of_interest)
+        # training runs on the job queue; show_model_job polls it until it's done
+        return {'id': get_training_queue().submit('collab-filt', user_of_interest)}
+
+@app.callback([Output('model-results-collabfilt', 'children'),
+               Output('model-job-interval-collabfilt', 'disabled')],
+                [Input('model-job-collabfilt', 'data'),
+                 Input('model-job-interval-collabfilt', 'n_intervals')])
+def show_model_job(job, n_intervals):
+
+    if job != None:
+        status = get_training_queue().status(job['id'])
+        if status == None:
+            return html.Div("We lost track of that model, please build it again",
+                            style={'font-size':'large', 'font-weight':'bold'}), True
+        elif status['state'] in ['queued', 'running']:
+            return html.Div(job_progress(status), style={'font-size':'large', 'font-weight':'bold'}), False
+        elif status['state'] == 'failed':
+            return html.Div("Something went wrong building your model ({})".format(status['error']),
+                            style={'font-size':'large', 'font-weight':'bold'}), True
+
+        result = status['result']
+        mae, quarter, half = result['mae'], result['quarter'], result['half']
 
         # structure html and return 
-        children = [html.Div("We have created a predictive model based on your taste preferences".format(quarter, half, mae),
+        children = [html.Div("We have created a predictive model based on your taste preferences",
                             style={'font-size':'large', 'font-weight':'bold'}),
                     html.Br(),
                     html.Div("Full analysis below:", style={'text-align':'center', 'font-weight':'bold'}),
@@ -128,8 +164,9 @@ def build_model(n_clicks, user_of_interest):
                     html.Div("Accuracy within 0.50 stars: {:.2f}%".format(half), style={'text-align':'center', 'font-size':'small'}),
                     html.Div("Mean Absolute Error (MAE): {:.2f}".format(mae), style={'text-align':'center', 'font-size':'small'})]
         ret_html = html.Div(children=children)
+        return ret_html, True
 
-        return ret_html
+    return None, True
 
 @app.callback(Output('prediction-results-collabfilt', 'children'),
                 [Input('prediction-button-collabfilt', 'n_clicks')],
@@ -141,10 +178,9 @@ def predict_beer_rating(n_clicks, user_of_interest, beer):
 
         print("Running...")
 
-        query = "SELECT user_rating, beer_name, username FROM prepped_data"
-        df = import_table(db_path, query, remove_dups=False)
-        df = COSINE_STEP(df, user_of_interest)
-        prediction = df[ (df.sort_values('nearest_neighbor_rank')['beer_name'] == beer) & (df['username']!=user_of_interest) ].iloc[0]['user_rating']
+        df = load_ratings(['user_rating', 'beer_name', 'username'], remove_dups=False)
+        df = rank_neighbors(df, user_of_interest, [beer], neighbor_index=get_neighbor_index())
+        prediction = closest_neighbor_ratings(df, user_of_interest, [beer]).iloc[0]
 
         ret_html = html.Div("We predict that your rating for this beer will be {:.2f}".format(float(prediction)),
                              style={'font-size':'large', 'font-weight':'bold'})
@@ -161,17 +197,11 @@ def rank_beers(n_clicks, user_of_interest, beers):
 
         print("Running...")
 
-        query = "SELECT user_rating, beer_name, username FROM prepped_data"
-        df = import_table(db_path, query, remove_dups=False)
-        df = COSINE_STEP(df, user_of_interest)
+        df = load_ratings(['user_rating', 'beer_name', 'username'], remove_dups=False)
+        df = rank_neighbors(df, user_of_interest, beers, neighbor_index=get_neighbor_index())
 
-        d = {"beer_name":[], "predictions":[]}
-        for beer in beers:
-            prediction = df[ (df.sort_values('nearest_neighbor_rank')['beer_name'] == beer) & (df['username']!=user_of_interest) ].iloc[0]['user_rating']
-            d['beer_name'].append(beer)
-            d['predictions'].append(prediction)
-
-        beer_df = pd.DataFrame.from_dict(d)
+        predictions = closest_neighbor_ratings(df, user_of_interest, beers)
+        beer_df = pd.DataFrame({"beer_name": beers, "predictions": predictions.values})
         beer_df.sort_values('predictions', inplace=True, ascending=False)
         top_beer = beer_df.iloc[0,0]
     
@@ -188,3 +218,33 @@ def rank_beers(n_clicks, user_of_interest, beers):
 
         ret_html = html.Div(children=children)
         return ret_html
+
+
+@app.callback(Output('suggestion-results-collabfilt', 'children'),
+                [Input('suggestion-button-collabfilt', 'n_clicks')],
+                [State('username-selection-dropdown-collabfilt', 'value')])
+def suggest_beers(n_clicks, user_of_interest):
+
+    if n_clicks != None:
+
+        print("Running...")
+
+        # score the whole catalog from the user's 50 closest neighbors, only
+        # trusting beers at least 3 of them have rated
+        ui_matrix = get_ui_matrix()
+        beer_df = knn_scores(user_of_interest, ui_matrix, k=50, min_support=3, neighbor_index=get_neighbor_index())
+        rated = ui_matrix.beers[ui_matrix.ratings[ui_matrix.user_index[user_of_interest]].indices]
+        beer_df = beer_df[~beer_df['beer_name'].isin(rated)].dropna()
+        beer_df = beer_df.sort_values('predicted_rating', ascending=False).iloc[0:10]
+
+        if len(beer_df) == 0:
+            return html.Div("Not enough similar users to suggest a new beer yet",
+                            style={'font-size':'large', 'font-weight':'bold'})
+
+        ind = np.random.randint(0, len(beer_df))
+        prediction = min(max(beer_df.iloc[ind,]['predicted_rating'], 0.0), 5.0)
+        beer_name = beer_df.iloc[ind,]['beer_name']
+
+        ret_html = html.Div("We think your next one should be {} (rating = {:.2f})".format(beer_name, prediction),
+                             style={'font-size':'large', 'font-weight':'bold'})
+        return ret_html
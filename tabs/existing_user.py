@@ -3,7 +3,6 @@ import dash_core_components as dcc
 import dash_html_components as html 
 import dash_bootstrap_components as dbc
 from dash.dependencies import Input, Output, State
-import pickle
 import numpy as np
 
 from app import app
@@ -14,6 +13,8 @@ layout = html.Div(className = 'row', children =[
     dcc.Store(id="session", storage_type='session',
                 data=beer_options()
             ),
+    dcc.Store(id='model-job-exisiting-user'),
+    dcc.Interval(id='model-job-interval-exisiting-user', interval=1000, disabled=True),
     
     # username section
     html.Div(className='container-outlined padded', style={'background':'white'}, children=[
@@ -31,6 +32,8 @@ layout = html.Div(className = 'row', children =[
                     options=[
                         {'label': 'Content Based Filtering', 'value': 'cbf'},
                         {'label': 'Collaborative Filtering', 'value': 'collab-filt'},
+                        {'label': 'Item-Based Collaborative Filtering', 'value': 'item-cf'},
+                        {'label': 'Matrix Factorization (ALS)', 'value': 'als'},
                         {'label': 'Hybrid', 'value': 'hybrid'}
                     ],
                     value='cbf'
@@ -101,7 +104,9 @@ def technique_options(value):
                             options = [{'label': 'Simple', 'value': 'simple'},
                                         {'label': 'Categorical Encoding of Beer Description', 'value': 'cat-encoding'},
                                         {'label': 'Count Vectorizer of Beer Description', 'value': 'count-vect'},
-                                        {'label': 'TFIDF Vectorizer of Beer Description', 'value': 'tfidf-vect'}],
+                                        {'label': 'TFIDF Vectorizer of Beer Description', 'value': 'tfidf-vect'},
+                                        {'label': 'Hashed Tokens of Beer Description', 'value': 'hash-vect'},
+                                        {'label': 'SVD Embedding of Beer Description', 'value': 'svd-vect'}],
                             multi = False
                         )
                 ]),
@@ -137,7 +142,9 @@ def technique_options(value):
                             options = [{'label': 'Simple', 'value': 'simple'},
                                         {'label': 'Categorical Encoding of Beer Description', 'value': 'cat-encoding'},
                                         {'label': 'Count Vectorizer of Beer Description', 'value': 'count-vect'},
-                                        {'label': 'TFIDF Vectorizer of Beer Description', 'value': 'tfidf-vect'}],
+                                        {'label': 'TFIDF Vectorizer of Beer Description', 'value': 'tfidf-vect'},
+                                        {'label': 'Hashed Tokens of Beer Description', 'value': 'hash-vect'},
+                                        {'label': 'SVD Embedding of Beer Description', 'value': 'svd-vect'}],
                             multi = False
                         )
                 ]),
@@ -216,7 +223,7 @@ def technique_options(value):
 #         print(ret_html)
 #         return ret_html
 
-@app.callback(Output('model-results-exisiting-user', 'children'),
+@app.callback(Output('model-job-exisiting-user', 'data'),
                 [Input('model-button-exisiting-user', 'n_clicks')],
                 [State('username-selection-dropdown-exisiting-user', 'value'),
                  State('technique-dropdown', 'value'),
@@ -225,112 +232,43 @@ def technique_options(value):
 def build_model(n_clicks, user_of_interest, technique, feature_selection, alg):
 
     if n_clicks != None:
+        # training runs on the job queue; show_model_job polls it until it's done
+        return {'id': get_training_queue().submit(technique, user_of_interest, feature_selection, alg)}
+
+@app.callback([Output('model-results-exisiting-user', 'children'),
+               Output('model-job-interval-exisiting-user', 'disabled')],
+                [Input('model-job-exisiting-user', 'data'),
+                 Input('model-job-interval-exisiting-user', 'n_intervals')])
+def show_model_job(job, n_intervals):
+
+    if job != None:
+        status = get_training_queue().status(job['id'])
+        if status == None:
+            return html.Div("We lost track of that model, please build it again",
+                            style={'font-size':'large', 'font-weight':'bold'}), True
+        elif status['state'] in ['queued', 'running']:
+            return html.Div(job_progress(status), style={'font-size':'large', 'font-weight':'bold'}), False
+        elif status['state'] == 'failed':
+            return html.Div("Something went wrong building your model ({})".format(status['error']),
+                            style={'font-size':'large', 'font-weight':'bold'}), True
+
+        result = status['result']
+        mae, quarter, half = result['mae'], result['quarter'], result['half']
+
+        # structure html and return 
+        children = [html.Div("We have created a predictive model based on your taste preferences",
+                            style={'font-size':'large', 'font-weight':'bold'}),
+                    html.Br(),
+                    html.Div("Full analysis below:", style={'text-align':'center', 'font-weight':'bold'}),
+                    html.Div("Accuracy within 0.25 stars: {:.2f}%".format(quarter), style={'text-align':'center', 'font-size':'small'}),
+                    html.Div("Accuracy within 0.50 stars: {:.2f}%".format(half), style={'text-align':'center', 'font-size':'small'}),
+                    html.Div("Mean Absolute Error (MAE): {:.2f}".format(mae), style={'text-align':'center', 'font-size':'small'})]
+        if 'best_params' in result:
+            children.append(html.Div("Best Parameters: {}".format(result['best_params']), style={'text-align':'center', 'font-size':'small'}))
+        ret_html = html.Div(children=children)
+        return ret_html, True
 
-        print(technique)
-        
-        if technique == 'cbf':
-        
-            # feature prep
-            if feature_selection == 'simple':
-                df = import_table(db_path, query = "SELECT username, beer_description, ABV, IBU, global_rating, user_rating FROM prepped_data WHERE username = '{}'".format(user_of_interest))
-                user_df = df[df['username']==user_of_interest].drop(['username', 'beer_description'], axis=1, inplace=False)
-            elif feature_selection == 'cat-encoding':
-                df = import_table(db_path, query = "SELECT username, beer_description, ABV, IBU, global_rating, user_rating FROM prepped_data")
-                df = cat_encoding(df, 'beer_description')
-                user_df = df[df['username'] == user_of_interest]
-                user_df.drop(['username'], axis=1, inplace=True)
-            elif feature_selection == 'count-vect':
-                df = import_table(db_path, query = "SELECT username, beer_description, ABV, IBU, global_rating, user_rating FROM prepped_data")
-                df = count_vectorizer(df, 'beer_description')
-                user_df = df[df['username'] == user_of_interest]
-                user_df.drop(['username'], axis=1, inplace=True)
-            elif feature_selection == 'tfidf-vect':
-                df = import_table(db_path, query = "SELECT username, beer_description, ABV, IBU, global_rating, user_rating FROM prepped_data")
-                df = tfidf_vectorizer(df, 'beer_description')
-                user_df = df[df['username'] == user_of_interest]
-                user_df.drop(['username'], axis=1, inplace=True)
-
-            model, best_params, mae, quarter, half = cbf(user_df, alg, 'user_rating', impute_na_mean=True, remove_all_outliers=True)
-
-            d={}
-            d['model'] = model
-            d['feature_selection'] = feature_selection
-
-            with open('exisiting-user-model.pkl', 'wb') as file:
-                pickle.dump(d, file)
-            
-            # structure html and return 
-            children = [html.Div("We have created a predictive model based on your taste preferences".format(quarter, half, mae),
-                                style={'font-size':'large', 'font-weight':'bold'}),
-                        html.Br(),
-                        html.Div("Full analysis below:", style={'text-align':'center', 'font-weight':'bold'}),
-                        html.Div("Accuracy within 0.25 stars: {:.2f}%".format(quarter), style={'text-align':'center', 'font-size':'small'}),
-                        html.Div("Accuracy within 0.50 stars: {:.2f}%".format(half), style={'text-align':'center', 'font-size':'small'}),
-                        html.Div("Mean Absolute Error (MAE): {:.2f}".format(mae), style={'text-align':'center', 'font-size':'small'}),
-                        html.Div("Best Parameters: {}".format(best_params), style={'text-align':'center', 'font-size':'small'})]
-            ret_html = html.Div(children=children)
-
-        elif technique=='collab-filt':
-            print("HERE")
-            query = "SELECT user_rating, beer_name, username FROM prepped_data"
-            df = import_table(db_path, query, remove_dups=False)
-            mae, quarter, half = collaborative_filtering(df, user_of_interest)
-            print("HEEERRREE")
-            
-            # structure html and return 
-            children = [html.Div("We have created a predictive model based on your taste preferences".format(quarter, half, mae),
-                                style={'font-size':'large', 'font-weight':'bold'}),
-                        html.Br(),
-                        html.Div("Full analysis below:", style={'text-align':'center', 'font-weight':'bold'}),
-                        html.Div("Accuracy within 0.25 stars: {:.2f}%".format(quarter), style={'text-align':'center', 'font-size':'small'}),
-                        html.Div("Accuracy within 0.50 stars: {:.2f}%".format(half), style={'text-align':'center', 'font-size':'small'}),
-                        html.Div("Mean Absolute Error (MAE): {:.2f}".format(mae), style={'text-align':'center', 'font-size':'small'})]
-            ret_html = html.Div(children=children)
-
-        else:
-            df = import_table(db_path, query = "SELECT username, beer_name, beer_description, ABV, IBU, global_rating, user_rating FROM prepped_data")
-    
-            # feature prep
-            if feature_selection == 'simple':
-                hybrid_df = df.drop(['beer_description'], axis=1, inplace=False)
-            
-            elif feature_selection == 'cat-encoding':
-                df = import_table(db_path, query = "SELECT username, user_rating, beer_name, beer_description, ABV, IBU, global_rating FROM prepped_data")
-                hybrid_df = cat_encoding(df, 'beer_description')
-            elif feature_selection == 'count-vect':
-                df = import_table(db_path, query = "SELECT username, user_rating, beer_name, beer_description, ABV, IBU, global_rating FROM prepped_data")
-                hybrid_df = count_vectorizer(df, 'beer_description')
-            elif feature_selection == 'tfidf-vect':
-                df = import_table(db_path, query = "SELECT username, user_rating, beer_name, beer_description, ABV, IBU, global_rating FROM prepped_data")
-                hybrid_df = count_vectorizer(df, 'beer_description')
-
-            model_list, mae_list, quarter_list, half_list = run_hybrid(hybrid_df, user_of_interest, 'user_rating')
-
-            mae = min(i for i in mae_list if i > 0)
-            ind = mae_list.index(mae)
-
-            model = model_list[ind]
-            quarter = quarter_list[ind]
-            half = half_list[ind]
-
-            d={}
-            d['model'] = model
-            d['feature_selection'] = feature_selection
-
-            with open('hybrid-model.pkl', 'wb') as file:
-                pickle.dump(d, file)
-
-            # structure html and return 
-            children = [html.Div("We have created a predictive model based on your taste preferences".format(quarter, half, mae),
-                                style={'font-size':'large', 'font-weight':'bold'}),
-                        html.Br(),
-                        html.Div("Full analysis below:", style={'text-align':'center', 'font-weight':'bold'}),
-                        html.Div("Accuracy within 0.25 stars: {:.2f}%".format(quarter), style={'text-align':'center', 'font-size':'small'}),
-                        html.Div("Accuracy within 0.50 stars: {:.2f}%".format(half), style={'text-align':'center', 'font-size':'small'}),
-                        html.Div("Mean Absolute Error (MAE): {:.2f}".format(mae), style={'text-align':'center', 'font-size':'small'})]
-            ret_html = html.Div(children=children)
-        
-        return ret_html
+    return None, True
 
 @app.callback(Output('explanation-container', 'style'),
                 [Input('model-results-exisiting-user', 'children')])
@@ -342,50 +280,31 @@ def display_explanation_container(children):
 
 @app.callback(Output('prediction-results-exisiting-user', 'children'),
                 [Input('prediction-button-exisiting-user', 'n_clicks')],
-                [State('beer-selection-dropdown-exisiting-user', 'value')])
-def predict_beer_rating(n_clicks, beer):
+                [State('beer-selection-dropdown-exisiting-user', 'value'),
+                 State('username-selection-dropdown-exisiting-user', 'value'),
+                 State('technique-dropdown', 'value'),
+                 State('feature-selection-dropdown-exisiting-user', 'value')])
+def predict_beer_rating(n_clicks, beer, user_of_interest, technique, feature_selection):
 
     if n_clicks != None:
-        with open('exisiting-user-model.pkl', 'rb') as file:
-            d = pickle.load(file)
-            model = d['model']
-            feature_selection = d['feature_selection']
+        d = get_model_store().get(model_key(user_of_interest, technique, feature_selection))
+        if d is None or 'encoder' not in d:
+            return html.Div("Build a model for this user first", style={'font-size':'large', 'font-weight':'bold'})
+        model = d['model']
+        feature_selection = d['feature_selection']
     
     
-        if feature_selection == 'simple':
-            query = "SELECT ABV, IBU, global_rating FROM prepped_data WHERE beer_name = '{}'".format(beer)
-            beer_df = import_table(db_path, query, remove_dups=False)
-            beer_df['global_rating'] = beer_df['global_rating'].mean()
-            beer_df = beer_df[~beer_df.duplicated()]
-            prediction = model.predict(beer_df)
-
-        elif feature_selection == 'cat-encoding':
-            df = import_table(db_path, query = "SELECT beer_name, beer_description, ABV, IBU, global_rating FROM prepped_data")
-            df = cat_encoding(df, 'beer_description')
-            beer_df = df[df['beer_name']==beer].drop('beer_name', axis=1)
-            beer_df['global_rating'] = beer_df['global_rating'].mean()
-            beer_df = beer_df[~beer_df.duplicated()]
-            prediction = model.predict(beer_df)
-
-        elif feature_selection == 'count-vect':
-            df = import_table(db_path, query = "SELECT beer_name, beer_description, ABV, IBU, global_rating FROM prepped_data")
-            df = count_vectorizer(df, 'beer_description')
-            beer_df = df[df['beer_name']==beer].drop('beer_name', axis=1)
-            beer_df['global_rating'] = beer_df['global_rating'].mean()
-            beer_df = beer_df[~beer_df.duplicated()]
-            prediction = model.predict(beer_df)
-           
-        elif feature_selection == 'tfidf-vect':
-            df = import_table(db_path, query = "SELECT beer_name, beer_description, ABV, IBU, global_rating FROM prepped_data")
-            df = tfidf_vectorizer(df, 'beer_description')
-            beer_df = df[df['beer_name']==beer].drop('beer_name', axis=1)
-            beer_df['global_rating'] = beer_df['global_rating'].mean()
-            beer_df = beer_df[~beer_df.duplicated()]
-            prediction = model.predict(beer_df)
-            if prediction > 5.0:
-                prediction = 5.0
-            elif prediction < 0.0:
-                prediction = 0.0
+        if feature_selection == 'simple' or feature_selection in description_feature_selections:
+            # this beer's row of the per-beer feature table
+            _, prediction = score_beers(model, d['encoder'], [beer])
+            if feature_selection == 'tfidf-vect':
+                if prediction > 5.0:
+                    prediction = 5.0
+                elif prediction < 0.0:
+                    prediction = 0.0
+
+        elif feature_selection in ['item-cf', 'als']:
+            prediction = model.reindex([beer]).values
         
         ret_html = html.Div("We predict that your rating for this beer will be {:.2f}".format(prediction[0]),
                              style={'font-size':'large', 'font-weight':'bold'})
@@ -394,64 +313,27 @@ def predict_beer_rating(n_clicks, beer):
 
 @app.callback(Output('ranking-results-exisiting-user', 'children'),
                 [Input('ranking-button-exisiting-user', 'n_clicks')],
-                [State('ranking-beer-selection-dropdown-exisiting-user', 'value')])
-def rank_beers(n_clicks, beers):
+                [State('ranking-beer-selection-dropdown-exisiting-user', 'value'),
+                 State('username-selection-dropdown-exisiting-user', 'value'),
+                 State('technique-dropdown', 'value'),
+                 State('feature-selection-dropdown-exisiting-user', 'value')])
+def rank_beers(n_clicks, beers, user_of_interest, technique, feature_selection):
 
     if n_clicks != None:
-        with open('exisiting-user-model.pkl', 'rb') as file:
-            d = pickle.load(file)
-            model = d['model']
-            feature_selection = d['feature_selection']
+        d = get_model_store().get(model_key(user_of_interest, technique, feature_selection))
+        if d is None or 'encoder' not in d:
+            return html.Div("Build a model for this user first", style={'font-size':'large', 'font-weight':'bold'})
+        model = d['model']
+        feature_selection = d['feature_selection']
     
     
         drop_cols =['username', 'beer_name', 'brewery']
-        if feature_selection == 'simple':
-            query = "SELECT beer_name, ABV, IBU, global_rating FROM prepped_data WHERE beer_name in {}".format(tuple(beers))
-            beer_df = import_table(db_path, query, remove_dups=False)
-
-            beer_df['global_rating'] = beer_df.groupby("beer_name").transform(lambda x: x.fillna(x.mean()))['global_rating']
-            beer_df = beer_df[~beer_df.duplicated('beer_name')]
-            
-            predictions = model.predict(beer_df.drop('beer_name', axis=1))
-            beer_df['predictions'] = predictions
-
-        elif feature_selection == 'cat-encoding':
-            df = import_table(db_path, query = "SELECT beer_name, beer_description, ABV, IBU, global_rating FROM prepped_data")
-            df = cat_encoding(df, 'beer_description')
-
-            beer_df = df[df['beer_name'].isin(beers)]
-            beer_df['global_rating'] = beer_df['global_rating'].mean()
-            beer_df = beer_df[~beer_df.duplicated()]
-
-            predictions = model.predict(beer_df.drop('beer_name', axis=1))
-            beer_df['predictions'] = predictions
-
-        elif feature_selection == 'count-vect':
-            df = import_table(db_path, query = "SELECT beer_name, beer_description, ABV, IBU, global_rating FROM prepped_data")
-            df = count_vectorizer(df, 'beer_description')
-
-            beer_df = df[df['beer_name'].isin(beers)]
-            beer_df['global_rating'] = beer_df['global_rating'].mean()
-            beer_df = beer_df[~beer_df.duplicated()]
-
-            predictions = model.predict(beer_df.drop('beer_name', axis=1))
-            beer_df['predictions'] = predictions
-           
-        elif feature_selection == 'tfidf-vect':
-            df = import_table(db_path, query = "SELECT beer_name, beer_description, ABV, IBU, global_rating FROM prepped_data")
-            df = tfidf_vectorizer(df, 'beer_description')
-
-            beer_df = df[df['beer_name'].isin(beers)]
-            beer_df['global_rating'] = beer_df['global_rating'].mean()
-            beer_df = beer_df[~beer_df.duplicated()]
-
-            predictions = model.predict(beer_df.drop('beer_name', axis=1))
-            for prediction in predictions:
-                if prediction > 5.0:
-                    prediction = 5.0
-                elif prediction < 0.0:
-                    prediction = 0.0
-            beer_df['predictions'] = predictions
+        if feature_selection == 'simple' or feature_selection in description_feature_selections:
+            names, predictions = score_beers(model, d['encoder'], beers)
+            beer_df = pd.DataFrame({'beer_name': names, 'predictions': predictions})
+
+        elif feature_selection in ['item-cf', 'als']:
+            beer_df = pd.DataFrame({'beer_name': beers, 'predictions': model.reindex(beers).values})
 
         beer_df.sort_values('predictions', inplace=True, ascending=False)
         top_beer = beer_df.iloc[0,0]
@@ -471,53 +353,30 @@ def rank_beers(n_clicks, beers):
         return ret_html
 
 @app.callback(Output('suggestion-results-exisiting-user', 'children'),
-                [Input('suggestion-button-exisiting-user', 'n_clicks')])
-def suggest_beers(n_clicks):
-
-     if n_clicks != None:
-        with open('exisiting-user-model.pkl', 'rb') as file:
-            d = pickle.load(file)
-            model = d['model']
-            feature_selection = d['feature_selection']
+                [Input('suggestion-button-exisiting-user', 'n_clicks')],
+                [State('username-selection-dropdown-exisiting-user', 'value'),
+                 State('technique-dropdown', 'value'),
+                 State('feature-selection-dropdown-exisiting-user', 'value')])
+def suggest_beers(n_clicks, user_of_interest, technique, feature_selection):
+
+    if n_clicks != None:
+        d = get_model_store().get(model_key(user_of_interest, technique, feature_selection))
+        if d is None or 'encoder' not in d:
+            return html.Div("Build a model for this user first", style={'font-size':'large', 'font-weight':'bold'})
+        model = d['model']
+        feature_selection = d['feature_selection']
     
     
-        if feature_selection == 'simple':
-            query = "SELECT beer_name, ABV, IBU, global_rating FROM prepped_data"
-            beer_df = import_table(db_path, query, remove_dups=False)
-            beer_df = beer_df.groupby('beer_name').mean().reset_index()
-            beer_df = beer_df[~beer_df.duplicated()]
-            beer_list = beer_df['beer_name']
-            beer_df.drop('beer_name', axis=1, inplace=True)
-            predictions = model.predict(beer_df)
-
-        elif feature_selection == 'cat-encoding':
-            df = import_table(db_path, query = "SELECT beer_name, beer_description, ABV, IBU, global_rating FROM prepped_data")
-            descriptions = df[['beer_name', 'beer_description']]
-            df = df.groupby('beer_name').mean().reset_index()
-            df = pd.merge(df, descriptions, on='beer_name')
-            beer_df = cat_encoding(df, 'beer_description')
-            beer_list = beer_df['beer_name']
-            beer_df = beer_df.drop('beer_name', axis=1)
-            beer_df = beer_df[~beer_df.duplicated()]
-            predictions = model.predict(beer_df)
-
-        elif feature_selection == 'count-vect':
-            df = import_table(db_path, query = "SELECT beer_name, beer_description, ABV, IBU, global_rating FROM prepped_data")
-            df = count_vectorizer(df, 'beer_description')
-            beer_df = df.groupby('beer_name').mean().reset_index()
-            beer_list = beer_df['beer_name']
-            beer_df = beer_df.drop('beer_name', axis=1)
-            beer_df = beer_df[~beer_df.duplicated()]
-            predictions = model.predict(beer_df)
-           
-        elif feature_selection == 'tfidf-vect':
-            df = import_table(db_path, query = "SELECT beer_name, beer_description, ABV, IBU, global_rating FROM prepped_data")
-            df = tfidf_vectorizer(df, 'beer_description')
-            beer_df = df.groupby('beer_name').mean().reset_index()
-            beer_list = beer_df['beer_name']
-            beer_df = beer_df.drop('beer_name', axis=1)
-            beer_df = beer_df[~beer_df.duplicated()]
-            predictions = model.predict(beer_df)
+        if feature_selection == 'simple' or feature_selection in description_feature_selections:
+            # every beer's row of the per-beer feature table
+            beer_list, predictions = score_beers(model, d['encoder'])
+            beer_df = pd.DataFrame(index=range(len(beer_list)))
+
+        elif feature_selection in ['item-cf', 'als']:
+            scores = model.dropna()
+            beer_df = pd.DataFrame(index=range(len(scores)))
+            beer_list = scores.index
+            predictions = scores.values
 
         beer_df['predictions'] = predictions
         beer_df['beer_name'] = beer_list
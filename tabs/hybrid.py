@@ -3,7 +3,6 @@ import dash_core_components as dcc
 import dash_html_components as html 
 import dash_bootstrap_components as dbc
 from dash.dependencies import Input, Output, State
-import pickle
 import numpy as np
 
 from app import app
@@ -12,6 +11,8 @@ from util import *
 layout = html.Div(className = 'container my-4', children =[
 
     dcc.Store(id="memory"),
+    dcc.Store(id='model-job-hybrid'),
+    dcc.Interval(id='model-job-interval-hybrid', interval=1000, disabled=True),
     
     # username section
     html.Div(className='card', children=[
@@ -32,7 +33,9 @@ layout = html.Div(className = 'container my-4', children =[
                     options = [{'label': 'Simple', 'value': 'simple'},
                                 {'label': 'Categorical Encoding of Beer Description', 'value': 'cat-encoding'},
                                 {'label': 'Count Vectorizer of Beer Description', 'value': 'count-vect'},
-                                {'label': 'TFIDF Vectorizer of Beer Description', 'value': 'tfidf-vect'}],
+                                {'label': 'TFIDF Vectorizer of Beer Description', 'value': 'tfidf-vect'},
+                                {'label': 'Hashed Tokens of Beer Description', 'value': 'hash-vect'},
+                                {'label': 'SVD Embedding of Beer Description', 'value': 'svd-vect'}],
                     multi = False
                 )
         ]),
@@ -137,48 +140,40 @@ def display_beer_loader(n_clicks, value):
         return {'display': 'none'}
 
 
-@app.callback(Output('model-results-hybrid', 'children'),
+@app.callback(Output('model-job-hybrid', 'data'),
                 [Input('model-button-hybrid', 'n_clicks')],
                 [State('username-selection-dropdown-hybrid', 'value'),
                  State('feature-selection-dropdown-hybrid', 'value')])
 def build_model(n_clicks, user_of_interest, feature_selection):
 
     if n_clicks != None:
-       
-        df = import_table(db_path, query = "SELECT username, beer_name, beer_description, ABV, IBU, global_rating, user_rating FROM prepped_data")
-    
-        # feature prep
-        if feature_selection == 'simple':
-            hybrid_df = df.drop(['beer_description'], axis=1, inplace=False)
-           
-        elif feature_selection == 'cat-encoding':
-            df = import_table(db_path, query = "SELECT username, user_rating, beer_name, beer_description, ABV, IBU, global_rating FROM prepped_data")
-            hybrid_df = cat_encoding(df, 'beer_description')
-        elif feature_selection == 'count-vect':
-            df = import_table(db_path, query = "SELECT username, user_rating, beer_name, beer_description, ABV, IBU, global_rating FROM prepped_data")
-            hybrid_df = count_vectorizer(df, 'beer_description')
-        elif feature_selection == 'tfidf-vect':
-            df = import_table(db_path, query = "SELECT username, user_rating, beer_name, beer_description, ABV, IBU, global_rating FROM prepped_data")
-            hybrid_df = count_vectorizer(df, 'beer_description')
-
-        model_list, mae_list, quarter_list, half_list = run_hybrid(hybrid_df, user_of_interest, 'user_rating')
-
-        mae = min(i for i in mae_list if i > 0)
-        ind = mae_list.index(mae)
-
-        model = model_list[ind]
-        quarter = quarter_list[ind]
-        half = half_list[ind]
-
-        d={}
-        d['model'] = model
-        d['feature_selection'] = feature_selection
-
-        with open('hybrid-model.pkl', 'wb') as file:
-            pickle.dump(d, file)
+        # training runs on the job queue; show_model_job polls it until it's done
+        return {'id': get_training_queue().submit('hybrid', user_of_interest, feature_selection)}
+
+@app.callback([Output('model-results-hybrid', 'children'),
+               Output('model-job-interval-hybrid', 'disabled')],
+                [Input('model-job-hybrid', 'data'),
+                 Input('model-job-interval-hybrid', 'n_intervals')])
+def show_model_job(job, n_intervals):
+
+    if job != None:
+        status = get_training_queue().status(job['id'])
+        if status == None:
+            return html.Div("We lost track of that model, please build it again",
+                            style={'font-size':'large', 'font-weight':'bold'}), True
+        elif status['state'] in ['queued', 'running']:
+            return html.Div(job_progress(status), style={'font-size':'large', 'font-weight':'bold'}), False
+        elif status['state'] == 'failed':
+            return html.Div("Something went wrong building your model ({})".format(status['error']),
+                            style={'font-size':'large', 'font-weight':'bold'}), True
+
+        result = status['result']
+        if 'message' in result:
+            return html.Div(result['message'], style={'font-size':'large', 'font-weight':'bold'}), True
+        mae, quarter, half = result['mae'], result['quarter'], result['half']
 
         # structure html and return 
-        children = [html.Div("We have created a predictive model based on your taste preferences".format(quarter, half, mae),
+        children = [html.Div("We have created a predictive model based on your taste preferences",
                             style={'font-size':'large', 'font-weight':'bold'}),
                     html.Br(),
                     html.Div("Full analysis below:", style={'text-align':'center', 'font-weight':'bold'}),
@@ -186,50 +181,28 @@ def build_model(n_clicks, user_of_interest, feature_selection):
                     html.Div("Accuracy within 0.50 stars: {:.2f}%".format(half), style={'text-align':'center', 'font-size':'small'}),
                     html.Div("Mean Absolute Error (MAE): {:.2f}".format(mae), style={'text-align':'center', 'font-size':'small'})]
         ret_html = html.Div(children=children)
-        return ret_html
+        return ret_html, True
+
+    return None, True
 
 @app.callback(Output('prediction-results-hybrid', 'children'),
                 [Input('prediction-button-hybrid', 'n_clicks')],
-                [State('beer-selection-dropdown-hybrid', 'value')])
-def predict_beer_rating(n_clicks, beer):
+                [State('beer-selection-dropdown-hybrid', 'value'),
+                 State('username-selection-dropdown-hybrid', 'value'),
+                 State('feature-selection-dropdown-hybrid', 'value')])
+def predict_beer_rating(n_clicks, beer, user_of_interest, feature_selection):
 
     if n_clicks != None:
-        with open('hybrid-model.pkl', 'rb') as file:
-            d = pickle.load(file)
-            model = d['model']
-            feature_selection = d['feature_selection']
+        d = get_model_store().get(model_key(user_of_interest, 'hybrid', feature_selection))
+        if d is None or 'encoder' not in d:
+            return html.Div("Build a model for this user first", style={'font-size':'large', 'font-weight':'bold'})
+        model = d['model']
+        feature_selection = d['feature_selection']
     
     
-        if feature_selection == 'simple':
-            query = "SELECT ABV, IBU, global_rating FROM prepped_data WHERE beer_name = '{}'".format(beer)
-            beer_df = import_table(db_path, query, remove_dups=False)
-            beer_df['global_rating'] = beer_df['global_rating'].mean()
-            beer_df = beer_df[~beer_df.duplicated()]
-            prediction = model.predict(beer_df)
-
-        elif feature_selection == 'cat-encoding':
-            df = import_table(db_path, query = "SELECT beer_name, beer_description, ABV, IBU, global_rating FROM prepped_data")
-            df = cat_encoding(df, 'beer_description')
-            beer_df = df[df['beer_name']==beer].drop('beer_name', axis=1)
-            beer_df['global_rating'] = beer_df['global_rating'].mean()
-            beer_df = beer_df[~beer_df.duplicated()]
-            prediction = model.predict(beer_df)
-
-        elif feature_selection == 'count-vect':
-            df = import_table(db_path, query = "SELECT beer_name, beer_description, ABV, IBU, global_rating FROM prepped_data")
-            df = count_vectorizer(df, 'beer_description')
-            beer_df = df[df['beer_name']==beer].drop('beer_name', axis=1)
-            beer_df['global_rating'] = beer_df['global_rating'].mean()
-            beer_df = beer_df[~beer_df.duplicated()]
-            prediction = model.predict(beer_df)
-           
-        elif feature_selection == 'tfidf-vect':
-            df = import_table(db_path, query = "SELECT beer_name, beer_description, ABV, IBU, global_rating FROM prepped_data")
-            df = tfidf_vectorizer(df, 'beer_description')
-            beer_df = df[df['beer_name']==beer].drop('beer_name', axis=1)
-            beer_df['global_rating'] = beer_df['global_rating'].mean()
-            beer_df = beer_df[~beer_df.duplicated()]
-            prediction = model.predict(beer_df)
+        if feature_selection == 'simple' or feature_selection in description_feature_selections:
+            # this beer's row of the per-beer feature table
+            _, prediction = score_beers(model, d['encoder'], [beer])
 
         
         ret_html = html.Div("We predict that your rating for this beer will be {:.2f}".format(prediction[0]),
@@ -239,59 +212,23 @@ def predict_beer_rating(n_clicks, beer):
 
 @app.callback(Output('ranking-results-hybrid', 'children'),
                 [Input('ranking-button-hybrid', 'n_clicks')],
-                [State('ranking-beer-selection-dropdown-hybrid', 'value')])
-def rank_beers(n_clicks, beers):
+                [State('ranking-beer-selection-dropdown-hybrid', 'value'),
+                 State('username-selection-dropdown-hybrid', 'value'),
+                 State('feature-selection-dropdown-hybrid', 'value')])
+def rank_beers(n_clicks, beers, user_of_interest, feature_selection):
 
     if n_clicks != None:
-        with open('hybrid-model.pkl', 'rb') as file:
-            d = pickle.load(file)
-            model = d['model']
-            feature_selection = d['feature_selection']
+        d = get_model_store().get(model_key(user_of_interest, 'hybrid', feature_selection))
+        if d is None or 'encoder' not in d:
+            return html.Div("Build a model for this user first", style={'font-size':'large', 'font-weight':'bold'})
+        model = d['model']
+        feature_selection = d['feature_selection']
     
     
         drop_cols =['username', 'beer_name', 'brewery']
-        if feature_selection == 'simple':
-            query = "SELECT beer_name, ABV, IBU, global_rating FROM prepped_data WHERE beer_name in {}".format(tuple(beers))
-            beer_df = import_table(db_path, query, remove_dups=False)
-
-            beer_df['global_rating'] = beer_df.groupby("beer_name").transform(lambda x: x.fillna(x.mean()))['global_rating']
-            beer_df = beer_df[~beer_df.duplicated('beer_name')]
-            
-            predictions = model.predict(beer_df.drop('beer_name', axis=1))
-            beer_df['predictions'] = predictions
-
-        elif feature_selection == 'cat-encoding':
-            df = import_table(db_path, query = "SELECT beer_name, beer_description, ABV, IBU, global_rating FROM prepped_data")
-            df = cat_encoding(df, 'beer_description')
-
-            beer_df = df[df['beer_name'].isin(beers)]
-            beer_df['global_rating'] = beer_df['global_rating'].mean()
-            beer_df = beer_df[~beer_df.duplicated()]
-
-            predictions = model.predict(beer_df.drop('beer_name', axis=1))
-            beer_df['predictions'] = predictions
-
-        elif feature_selection == 'count-vect':
-            df = import_table(db_path, query = "SELECT beer_name, beer_description, ABV, IBU, global_rating FROM prepped_data")
-            df = count_vectorizer(df, 'beer_description')
-
-            beer_df = df[df['beer_name'].isin(beers)]
-            beer_df['global_rating'] = beer_df['global_rating'].mean()
-            beer_df = beer_df[~beer_df.duplicated()]
-
-            predictions = model.predict(beer_df.drop('beer_name', axis=1))
-            beer_df['predictions'] = predictions
-           
-        elif feature_selection == 'tfidf-vect':
-            df = import_table(db_path, query = "SELECT beer_name, beer_description, ABV, IBU, global_rating FROM prepped_data")
-            df = tfidf_vectorizer(df, 'beer_description')
-
-            beer_df = df[df['beer_name'].isin(beers)]
-            beer_df['global_rating'] = beer_df['global_rating'].mean()
-            beer_df = beer_df[~beer_df.duplicated()]
-
-            predictions = model.predict(beer_df.drop('beer_name', axis=1))
-            beer_df['predictions'] = predictions
+        if feature_selection == 'simple' or feature_selection in description_feature_selections:
+            names, predictions = score_beers(model, d['encoder'], beers)
+            beer_df = pd.DataFrame({'beer_name': names, 'predictions': predictions})
 
         beer_df.sort_values('predictions', inplace=True, ascending=False)
         top_beer = beer_df.iloc[0,0]
@@ -311,50 +248,22 @@ def rank_beers(n_clicks, beers):
         return ret_html
 
 @app.callback(Output('suggestion-results-hybrid', 'children'),
-                [Input('suggestion-button-hybrid', 'n_clicks')])
-def suggest_beers(n_clicks):
+                [Input('suggestion-button-hybrid', 'n_clicks')],
+                [State('username-selection-dropdown-hybrid', 'value'),
+                 State('feature-selection-dropdown-hybrid', 'value')])
+def suggest_beers(n_clicks, user_of_interest, feature_selection):
     if n_clicks != None:
-        with open('hybrid-model.pkl', 'rb') as file:
-            d = pickle.load(file)
-            model = d['model']
-            feature_selection = d['feature_selection']
-
-
-        if feature_selection == 'simple':
-            query = "SELECT beer_name, ABV, IBU, global_rating FROM prepped_data"
-            beer_df = import_table(db_path, query, remove_dups=False)
-            beer_df = beer_df.groupby('beer_name').mean().reset_index()
-            beer_df = beer_df[~beer_df.duplicated()]
-            beer_list = beer_df['beer_name']
-            beer_df.drop('beer_name', axis=1, inplace=True)
-            predictions = model.predict(beer_df)
-
-        elif feature_selection == 'cat-encoding':
-            df = import_table(db_path, query = "SELECT beer_name, beer_description, ABV, IBU, global_rating FROM prepped_data")
-            df = df.groupby('beer_name').mean().reset_index()
-            beer_df = cat_encoding(df, 'beer_description')
-            beer_list = beer_df['beer_name']
-            beer_df = beer_df.drop('beer_name', axis=1)
-            beer_df = beer_df[~beer_df.duplicated()]
-            predictions = model.predict(beer_df)
-
-        elif feature_selection == 'count-vect':
-            df = import_table(db_path, query = "SELECT beer_name, beer_description, ABV, IBU, global_rating FROM prepped_data")
-            df = count_vectorizer(df, 'beer_description')
-            beer_df = df.groupby('beer_name').mean().reset_index()
-            beer_list = beer_df['beer_name']
-            beer_df = beer_df.drop('beer_name', axis=1)
-            beer_df = beer_df[~beer_df.duplicated()]
-            predictions = model.predict(beer_df)
-            
-        elif feature_selection == 'tfidf-vect':
-            df = import_table(db_path, query = "SELECT beer_name, beer_description, ABV, IBU, global_rating FROM prepped_data")
-            df = tfidf_vectorizer(df, 'beer_description')
-            beer_df = df.groupby('beer_name').mean().reset_index()
-            beer_list = beer_df['beer_name']
-            beer_df = beer_df.drop('beer_name', axis=1)
-            beer_df = beer_df[~beer_df.duplicated()]
-            predictions = model.predict(beer_df)
+        d = get_model_store().get(model_key(user_of_interest, 'hybrid', feature_selection))
+        if d is None or 'encoder' not in d:
+            return html.Div("Build a model for this user first", style={'font-size':'large', 'font-weight':'bold'})
+        model = d['model']
+        feature_selection = d['feature_selection']
+
+
+        if feature_selection == 'simple' or feature_selection in description_feature_selections:
+            # every beer's row of the per-beer feature table
+            beer_list, predictions = score_beers(model, d['encoder'])
+            beer_df = pd.DataFrame(index=range(len(beer_list)))
 
         beer_df['predictions'] = predictions
         beer_df['beer_name'] = beer_list
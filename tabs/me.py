@@ -81,9 +81,9 @@ def display_beer_loader(n_clicks, value):
         features = ['ABV', 'IBU', 'global_rating']
 
         query = """SELECT * FROM user_extract 
-                    WHERE beer_name IN {}""".format(tuple(value))
+                    WHERE beer_name IN ({})""".format(', '.join(['?'] * len(value)))
 
-        df = import_table('data/beer.db', query=query)
+        df = import_table(db_path, query=query, params=value)
         df = df[~df.duplicated()]
         df = impute_na(df, features=features)
 
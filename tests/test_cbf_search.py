@@ -0,0 +1,56 @@
+# cbf's path search against the GridSearchCV it replaced
+import numpy as np
+import pandas as pd
+import pytest
+
+import util
+
+STYLES = ['american pale ale', 'imperial stout', 'hefeweizen', 'baltic porter', 'german pilsner', 'gose']
+
+
+@pytest.fixture(scope='module')
+def user_ratings():
+    # one user's 150 ratings, liking some styles more than others
+    rs = np.random.RandomState(12)
+    n_rows = 150
+    df = pd.DataFrame({'beer_description': rs.choice(STYLES, n_rows),
+                       'ABV': np.round(rs.gamma(6.0, 1.0, n_rows), 1),
+                       'IBU': np.round(rs.gamma(2.0, 20.0, n_rows)),
+                       'global_rating': np.round(rs.normal(3.7, 0.3, n_rows), 2)})
+    taste = dict(zip(STYLES, rs.normal(0, 0.4, len(STYLES))))
+    rating = (0.9 * df['global_rating'] + 0.04 * df['ABV'] - 0.003 * df['IBU']
+              + df['beer_description'].map(taste) + rs.normal(0, 0.3, n_rows))
+    df['user_rating'] = np.clip(np.round(rating * 4) / 4, 0.25, 5.0)
+    return df
+
+
+def cbf_frame(ratings, feature_selection):
+    if feature_selection == 'simple':
+        return ratings.drop('beer_description', axis=1)
+    return util.count_vectorizer(ratings, 'beer_description', sparse_output=feature_selection.endswith('sparse'))
+
+
+@pytest.mark.parametrize('algorithm', ['Lasso', 'Ridge', 'ElasticNet'])
+@pytest.mark.parametrize('feature_selection', ['simple', 'count-vect', 'count-vect sparse'])
+def test_path_search_matches_grid(user_ratings, algorithm, feature_selection):
+    user_df = cbf_frame(user_ratings, feature_selection)
+    _, grid_params, grid_mae, grid_quarter, grid_half = util.cbf(user_df, algorithm, 'user_rating', search='grid')
+    _, path_params, path_mae, path_quarter, path_half = util.cbf(user_df, algorithm, 'user_rating', search='path')
+    assert path_params == grid_params
+    assert path_mae == pytest.approx(grid_mae, rel=1e-9)
+    assert (path_quarter, path_half) == (grid_quarter, grid_half)
+
+
+@pytest.mark.parametrize('algorithm', ['Lasso', 'Ridge', 'ElasticNet'])
+def test_hash_vect_fit_drops_only_empty_buckets(user_ratings, algorithm):
+    # most buckets are empty for one user; cbf fits without them and widens
+    # the coefficients back to the encoder's width
+    encoder = util.DescriptionEncoder('hash-vect', n_buckets=64, ngrams=1, idf=False)
+    user_df = encoder.fit(user_ratings['beer_description']).transform(user_ratings, 'beer_description')
+    assert len(util.used_columns(user_df.X)) < 64
+    model, params, mae, _, _ = util.cbf(user_df, algorithm, 'user_rating')
+    dense_model, dense_params, dense_mae, _, _ = util.cbf(user_df.to_frame(), algorithm, 'user_rating')
+    assert model.coef_.shape == (3 + 64,)
+    assert params == dense_params
+    assert mae == pytest.approx(dense_mae, rel=1e-9)
+    np.testing.assert_allclose(model.coef_, dense_model.coef_, atol=1e-10)
@@ -0,0 +1,67 @@
+# the grouped closest-neighbor kernel against the per-beer scan it replaced
+import numpy as np
+import pandas as pd
+import pytest
+
+import util
+
+USERS = ['user{:02d}'.format(u) for u in range(0, 30, 3)]
+
+
+@pytest.fixture(scope='module')
+def ratings():
+    # 30 users rating 8-25 of 50 beers, a few twice; beer50 to beer59 are
+    # rated by a single user each, so nobody else can predict them
+    rs = np.random.RandomState(7)
+    rows = []
+    for u in range(30):
+        username = 'user{:02d}'.format(u)
+        for beer in rs.choice(50, rs.randint(8, 26), replace=False):
+            for _ in range(1 + (rs.rand() < 0.1)):
+                rows.append((username, 'beer{:02d}'.format(beer), rs.randint(1, 21) / 4))
+        if u % 3 == 0:
+            rows.append((username, 'beer{:02d}'.format(50 + u // 3), rs.randint(1, 21) / 4))
+    return pd.DataFrame(rows, columns=['username', 'beer_name', 'user_rating'])
+
+
+def loop_predictions(df, user_of_interest, beers):
+    predictions = []
+    for beer in beers:
+        try:
+            predictions.append(df[(df.sort_values('nearest_neighbor_rank')['beer_name'] == beer) &
+                                  (df['username'] != user_of_interest)]['user_rating'].iloc[0])
+        except IndexError:
+            predictions.append(np.nan)
+    return np.array(predictions, dtype=float)
+
+
+def loop_collaborative_filtering(df, user_of_interest):
+    # collaborative_filtering's evaluation as it was, one scan per beer
+    df = util.COSINE_STEP(df, user_of_interest)
+    error_list = []
+    for beer in df[df['username'] == user_of_interest]['beer_name']:
+        try:
+            estimated_rating = df[(df.sort_values('nearest_neighbor_rank')['beer_name'] == beer) &
+                                  (df['username'] != user_of_interest)]['user_rating'].iloc[0]
+            user_rating = df[(df['username'] == user_of_interest) &
+                             (df['beer_name'] == beer)]['user_rating'].iloc[0].astype(float)
+            error_list.append(estimated_rating - user_rating)
+        except IndexError:
+            pass
+    errors = np.absolute(error_list)
+    return errors.mean(), 100 * np.sum(errors < 0.25) / len(errors), 100 * np.sum(errors < 0.50) / len(errors)
+
+
+@pytest.mark.parametrize('user', USERS)
+def test_closest_neighbor_ratings_match_loop(ratings, user):
+    ranked_df = util.COSINE_STEP(ratings.copy(), user)
+    beers = list(ranked_df[ranked_df['username'] == user]['beer_name']) + ['beer59', 'not a beer']
+    kernel = util.closest_neighbor_ratings(ranked_df, user, beers)
+    assert list(kernel.index) == beers
+    np.testing.assert_array_equal(kernel.values.astype(float), loop_predictions(ranked_df, user, beers))
+
+
+@pytest.mark.parametrize('user', USERS)
+def test_collaborative_filtering_matches_loop(ratings, user):
+    expected = loop_collaborative_filtering(ratings.copy(), user)
+    assert util.collaborative_filtering(ratings.copy(), user) == expected
@@ -0,0 +1,106 @@
+# run_hybrid's process pool fits the same cells as the in-process loop
+import numpy as np
+import pytest
+from scipy import sparse
+
+import util
+
+
+@pytest.fixture(scope='module')
+def groups():
+    # one dense and one sparse min_ppu group, the sparse one a few 0/1 term
+    # columns next to three numeric ones
+    rs = np.random.RandomState(11)
+    n_rows = 240
+    numeric = rs.normal(size=(n_rows, 3))
+    terms = sparse.random(n_rows, 12, density=0.2, format='csr', random_state=rs, data_rvs=np.ones)
+    coef = rs.normal(size=15)
+    X_sparse = sparse.hstack([sparse.csr_matrix(numeric), terms]).tocsr()
+    y = X_sparse.dot(coef) + rs.normal(0, 0.5, n_rows)
+    return [(numeric, numeric.dot(coef[:3]) + rs.normal(0, 0.5, n_rows)), (X_sparse, y)]
+
+
+@pytest.fixture(scope='module')
+def test_rows(groups):
+    X_test = groups[1][0][-40:].toarray()
+    return X_test, groups[1][1][-40:]
+
+
+@pytest.mark.parametrize('group', [0, 1])
+def test_pool_matches_loop(groups, test_rows, group):
+    X_test, y_test = test_rows
+    if group == 0:
+        X_test = X_test[:, :3]
+    cells = [(group, 60), (group, 120), (group, 200)]
+    serial = util.fit_hybrid_cells(groups, cells, X_test, y_test, n_jobs=1)
+    pooled = util.fit_hybrid_cells(groups, cells, X_test, y_test, n_jobs=2)
+    for (model, mae, quarter, half), (pooled_model, pooled_mae, pooled_quarter, pooled_half) in zip(serial, pooled):
+        np.testing.assert_array_equal(pooled_model.coef_, model.coef_)
+        assert pooled_model.intercept_ == model.intercept_
+        assert pooled_model.alpha_ == model.alpha_
+        assert (pooled_mae, pooled_quarter, pooled_half) == (mae, quarter, half)
+
+
+def test_pool_reads_sparse_groups_sparse(groups, test_rows, monkeypatch):
+    # with the dense shortcut off, workers fit straight on the memory-mapped CSR
+    monkeypatch.setattr(util, 'hybrid_dense_cell_bytes', 0)
+    X_test, y_test = test_rows
+    cells = [(1, 100), (1, 200)]
+    serial = util.fit_hybrid_cells(groups, cells, X_test, y_test, n_jobs=1)
+    pooled = util.fit_hybrid_cells(groups, cells, X_test, y_test, n_jobs=2)
+    for (model, mae, _, _), (pooled_model, pooled_mae, _, _) in zip(serial, pooled):
+        np.testing.assert_allclose(pooled_model.coef_, model.coef_, rtol=1e-12, atol=1e-12)
+        assert pooled_mae == pytest.approx(mae, rel=1e-12)
+
+
+class Clock:
+    # stands in for the time module: every reading moves it on a little,
+    # and every cell fitted takes a second
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        self.now += 0.001
+        return self.now
+
+
+RUNG0_MAES = [0.9, 0.5, 0.7, 0.3, 0.8, 0.6, 0.4, 0.95, 0.85]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # nine cells; each rung's fit of cell k is tagged with its step, scores
+    # RUNG0_MAES[k] on the first rung and a little better on every later one
+    clock = Clock()
+    order = []
+
+    def fit_rung(groups, cells, step, cv, n_alphas, X_test, y_test, n_jobs=1):
+        results = []
+        for _, k in cells:
+            clock.now += 1
+            order.append((step, k))
+            results.append(((step, k), RUNG0_MAES[k] - 0.01 * (step != 9), 0, 0))
+        return results
+
+    monkeypatch.setattr(util, 'time', clock)
+    monkeypatch.setattr(util, 'fit_hybrid_rung', fit_rung)
+    clock.order = order
+    return clock
+
+
+def test_spent_budget_still_fits_first_cell(clock):
+    results = util.search_hybrid_cells(None, [(0, k) for k in range(9)], None, None, budget=0)
+    assert clock.order == [(9, 0)]
+    assert results[0] == ((9, 0), 0.9, 0, 0)
+    assert all(result == (0, 0, 0, 0) for result in results[1:])
+
+
+def test_cut_rung_keeps_previous_results(clock):
+    # the first rung fits all nine cells, the second only its first cell
+    results = util.search_hybrid_cells(None, [(0, k) for k in range(9)], None, None, budget=9.5)
+    # survivors go best first
+    assert clock.order[9:] == [(3, 3)]
+    assert results[3] == ((3, 3), 0.29, 0, 0)
+    assert results[6] == ((9, 6), 0.4, 0, 0)
+    assert results[1] == ((9, 1), 0.5, 0, 0)
+    assert all(results[k] == (0, 0, 0, 0) for k in [0, 2, 4, 5, 7, 8])
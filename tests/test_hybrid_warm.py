@@ -0,0 +1,66 @@
+# run_hybrid's warm-started cells against the per-cell LassoCV they replace
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.linear_model import LassoCV
+
+import util
+
+STYLES = ['american pale ale', 'imperial stout', 'hefeweizen', 'baltic porter', 'german pilsner', 'gose']
+
+
+@pytest.fixture(scope='module')
+def ratings():
+    # 60 users rating 20 to 120 of 120 beers, so the min_ppu 0, 50 and 100
+    # groups all have cells. Half the users like the first three styles
+    rs = np.random.RandomState(12)
+    n_beers = 120
+    beers = pd.DataFrame({'beer_name': ['beer{}'.format(i) for i in range(n_beers)],
+                          'beer_description': rs.choice(STYLES, n_beers),
+                          'ABV': np.round(rs.gamma(6.0, 1.0, n_beers), 1),
+                          'IBU': np.round(rs.gamma(2.0, 20.0, n_beers)),
+                          'global_rating': np.round(rs.normal(3.7, 0.3, n_beers), 2)})
+    frames = []
+    for user in range(60):
+        rated = beers.iloc[rs.choice(n_beers, rs.randint(20, 121), replace=False)].copy()
+        liked = rated['beer_description'].isin(STYLES[:3]) == (user % 2 == 0)
+        rating = (0.8 * rated['global_rating'] + 0.05 * rated['ABV'] - 0.004 * rated['IBU']
+                  + np.where(liked, 0.5, -0.5) + rs.normal(0, 0.4, len(rated)))
+        rated['user_rating'] = np.clip(np.round(rating * 4) / 4, 0.25, 5.0)
+        rated['username'] = 'user{}'.format(user)
+        frames.append(rated)
+    return pd.concat(frames, ignore_index=True)
+
+
+def hybrid_frame(ratings, feature_selection):
+    if feature_selection == 'simple':
+        return ratings.drop('beer_description', axis=1)
+    return util.count_vectorizer(ratings, 'beer_description', sparse_output=feature_selection.endswith('sparse'))
+
+
+def fitted_cells(models):
+    return [i for i, model in enumerate(models) if model != 0]
+
+
+@pytest.mark.parametrize('feature_selection', ['simple', 'count-vect', 'count-vect sparse'])
+def test_warm_start_matches_lassocv(ratings, feature_selection):
+    models, maes, _, _ = util.run_hybrid(hybrid_frame(ratings, feature_selection), 'user0', 'user_rating', n_jobs=1,
+                                         warm_start=False)
+    warm_models, warm_maes, _, _ = util.run_hybrid(hybrid_frame(ratings, feature_selection), 'user0', 'user_rating',
+                                                   warm_start=True)
+    cells = fitted_cells(models)
+    assert len(cells) > 10
+    assert fitted_cells(warm_models) == cells
+    for i in cells:
+        assert not isinstance(warm_models[i], LassoCV)
+        assert warm_models[i].alpha_ == pytest.approx(models[i].alpha_, rel=1e-6)
+        # the terms of one style are collinear, so the two solvers can stop at
+        # different optimal coefficients within coordinate descent's tolerance
+        assert warm_maes[i] == pytest.approx(maes[i], abs=1e-4)
+
+
+def test_warm_start_falls_back_for_wide_features(ratings, monkeypatch):
+    monkeypatch.setattr(util, 'hybrid_warm_max_features', 2)
+    models, _, _, _ = util.run_hybrid(hybrid_frame(ratings, 'simple'), 'user0', 'user_rating', n_jobs=1,
+                                      warm_start=True)
+    assert all(isinstance(models[i], LassoCV) for i in fitted_cells(models))
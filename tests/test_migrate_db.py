@@ -0,0 +1,59 @@
+# migrate_db.py keeps ratings_view and prepped_data in agreement
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import util
+from migrate_db import migrate
+
+
+def build_database(path, rows):
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("CREATE TABLE prepped_data ({})".format(', '.join(util.snapshot_columns)))
+        conn.executemany("INSERT INTO prepped_data VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.close()
+    return path
+
+
+def table_names(path):
+    conn = sqlite3.connect(path)
+    names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master")}
+    conn.close()
+    return names
+
+
+@pytest.fixture
+def catalog_db(tmp_path):
+    # more beers than SQLite takes ? parameters in one statement
+    rows = [(username, 'beer{:04d}'.format(i), ['stout', 'porter', 'gose'][i % 3], 4.0 + i % 7, 10.0 * (i % 5),
+             3.5, 2.0 + (i * 7 + len(username)) % 6 / 2)
+            for i in range(1500) for username in ['ann', 'bob']]
+    return build_database(str(tmp_path / 'beer.db'), rows)
+
+
+@pytest.mark.parametrize('problem', ['conflict', 'no username'])
+def test_migration_refuses_rows_it_would_change(tmp_path, problem):
+    rows = [('ann', 'Weiss', 'hefeweizen', 5.2, 14.0, 3.9, 4.0)]
+    if problem == 'conflict':
+        rows.append(('bob', 'Weiss', 'hefeweizen', 5.4, 14.0, 3.9, 3.5))
+    else:
+        rows.append((None, 'Weiss', 'hefeweizen', 5.2, 14.0, 3.9, 3.5))
+    path = build_database(str(tmp_path / 'beer.db'), rows)
+    with pytest.raises(ValueError):
+        migrate(path)
+    assert 'ratings_view' not in table_names(path)
+
+
+def test_long_beer_lists_match_snapshot(catalog_db):
+    columns = ['username', 'beer_name', 'ABV', 'user_rating']
+    beer_names = ['beer{:04d}'.format(i) for i in reversed(range(1500))] * 2
+    expected = util.get_snapshot(catalog_db).rows(columns, beer_names=beer_names).reset_index(drop=True)
+    assert len(expected) == 3000
+
+    unmigrated = util.lookup_ratings(columns, beer_names=beer_names, database_path=catalog_db)
+    pd.testing.assert_frame_equal(unmigrated.reset_index(drop=True), expected)
+    migrate(catalog_db)
+    migrated = util.lookup_ratings(columns, beer_names=beer_names, database_path=catalog_db)
+    pd.testing.assert_frame_equal(migrated.reset_index(drop=True), expected)
@@ -0,0 +1,73 @@
+# ModelStore's in-memory LRU in front of the pickles on disk
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+import util
+
+
+def record(value):
+    # about 8 KB pickled
+    return {'model': np.full(1000, float(value)), 'feature_selection': 'simple', 'encoder': None}
+
+
+def key(username):
+    return (username, 'cbf', 'simple', 'v1')
+
+
+RECORD_BYTES = len(pickle.dumps(record(0), protocol=pickle.HIGHEST_PROTOCOL))
+
+
+@pytest.fixture
+def store(tmp_path):
+    # room for two records
+    return util.ModelStore(str(tmp_path), max_bytes=2 * RECORD_BYTES + RECORD_BYTES // 2)
+
+
+def test_unchanged_file_is_a_hit(store):
+    store.put(key('ann'), record(1))
+    first = store.get(key('ann'))
+    assert store.get(key('ann')) is first
+    assert store.stats()['hits'] == 2
+    assert store.stats()['misses'] == 0
+
+
+def test_rewritten_file_is_read_again(store, tmp_path):
+    store.put(key('ann'), record(1))
+    assert store.get(key('ann'))['model'][0] == 1
+    # another process (a training job, train_cbf.py) saves over it
+    util.ModelStore(str(tmp_path)).save(key('ann'), record(2))
+    path = store.path(key('ann'))
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    assert store.get(key('ann'))['model'][0] == 2
+    assert store.stats()['misses'] == 1
+    assert store.get(key('ann'))['model'][0] == 2
+    assert store.stats()['hits'] == 2
+
+
+def test_least_recently_used_is_evicted(store):
+    store.put(key('ann'), record(1))
+    store.put(key('bob'), record(2))
+    store.get(key('ann'))
+    store.put(key('cat'), record(3))
+    stats = store.stats()
+    assert (stats['entries'], stats['evictions']) == (2, 1)
+    assert stats['bytes'] <= stats['max_bytes']
+
+    # ann was used after bob, so bob went; it still loads from disk
+    store.get(key('ann'))
+    assert store.stats()['misses'] == 0
+    assert store.get(key('bob'))['model'][0] == 2
+    assert store.stats()['misses'] == 1
+
+
+def test_record_over_the_budget_is_not_cached(tmp_path):
+    store = util.ModelStore(str(tmp_path), max_bytes=RECORD_BYTES - 1)
+    store.put(key('ann'), record(1))
+    assert store.stats()['entries'] == 0
+    assert store.get(key('ann'))['model'][0] == 1
+    assert store.stats()['bytes'] == 0
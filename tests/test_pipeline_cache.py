@@ -0,0 +1,51 @@
+# feature_frame's memoized encodings in the two-tier pipeline cache
+import os
+
+import pytest
+
+import util
+
+DB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'beer.db')
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    # an empty cache in place of data/pipeline-cache, and no catalog
+    # encoders left over from other tests
+    cache = util.PipelineCache(str(tmp_path))
+    monkeypatch.setitem(util._pipeline_caches, util.pipeline_cache_path, cache)
+    monkeypatch.setattr(util, '_catalog_encoders', {})
+    return cache
+
+
+def lookups(cache):
+    counters = cache.stats()['steps']['features']
+    return counters['memory'], counters['disk'], counters['miss']
+
+
+def test_identical_call_hits_memory(cache):
+    features, encoder = util.cbf_feature_frame('hash-vect', database_path=DB)
+    assert lookups(cache) == (0, 0, 1)
+    cached, cached_encoder = util.cbf_feature_frame('hash-vect', database_path=DB)
+    assert lookups(cache) == (1, 0, 1)
+    assert cached_encoder.schema_key() == encoder.schema_key()
+    assert (cached.X != features.X).nnz == 0
+
+
+def test_new_worker_hits_disk(cache, tmp_path, monkeypatch):
+    util.cbf_feature_frame('hash-vect', database_path=DB)
+    worker = util.PipelineCache(str(tmp_path))
+    monkeypatch.setitem(util._pipeline_caches, util.pipeline_cache_path, worker)
+    util.cbf_feature_frame('hash-vect', database_path=DB)
+    assert lookups(worker) == (0, 1, 0)
+
+
+def test_changed_encoder_schema_misses(cache, monkeypatch):
+    features, _ = util.cbf_feature_frame('hash-vect', database_path=DB)
+    # as a worker restarted with another HASH_BUCKETS would see it
+    monkeypatch.setattr(util, 'hash_buckets', 64)
+    monkeypatch.setattr(util, '_catalog_encoders', {})
+    narrow, encoder = util.cbf_feature_frame('hash-vect', database_path=DB)
+    assert lookups(cache) == (0, 0, 2)
+    assert features.X.shape[1] == 2**12
+    assert narrow.X.shape[1] == len(encoder.columns()) == 64
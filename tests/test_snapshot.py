@@ -0,0 +1,59 @@
+# get_snapshot reloads prepped_data when the database file changes
+import os
+import sqlite3
+
+import pytest
+
+import util
+
+
+def write_ratings(path, rows):
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS prepped_data ({})".format(', '.join(util.snapshot_columns)))
+        conn.executemany("INSERT INTO prepped_data VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.close()
+
+
+def rating(username, beer_name, user_rating):
+    return (username, beer_name, 'hefeweizen', 5.2, 14.0, 3.9, user_rating)
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / 'beer.db')
+    write_ratings(path, [rating('ann', 'Weiss', 4.0), rating('bob', 'Weiss', 3.5)])
+    return path
+
+
+def test_unchanged_file_reuses_snapshot(database):
+    assert util.get_snapshot(database) is util.get_snapshot(database)
+
+
+def test_changed_mtime_reloads(database):
+    snapshot = util.get_snapshot(database)
+    stat = os.stat(database)
+    conn = sqlite3.connect(database)
+    with conn:
+        conn.execute("UPDATE prepped_data SET user_rating = 1.0 WHERE username = 'ann'")
+    conn.close()
+    # the row is rewritten in place, so only the mtime tells them apart
+    assert os.stat(database).st_size == stat.st_size
+    os.utime(database, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    reloaded = util.get_snapshot(database)
+    assert reloaded is not snapshot
+    assert reloaded.rows(['user_rating'], username='ann')['user_rating'].tolist() == [1.0]
+
+
+def test_changed_size_reloads(database):
+    snapshot = util.get_snapshot(database)
+    stat = os.stat(database)
+    write_ratings(database, [rating('user{}'.format(i), 'Porter', 3.0) for i in range(500)])
+    # a copy restored with its old mtime still differs in size
+    os.utime(database, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert os.stat(database).st_size != stat.st_size
+
+    reloaded = util.get_snapshot(database)
+    assert reloaded is not snapshot
+    assert len(reloaded) == 502
@@ -0,0 +1,59 @@
+# TrainingQueue gets past a process pool whose worker died
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+import util
+
+
+class Pool:
+    # stands in for ProcessPoolExecutor; a broken one refuses new jobs
+    def __init__(self, max_workers):
+        self.futures = []
+        self.broken = False
+        self.shut_down = False
+
+    def submit(self, fn, args):
+        if self.broken:
+            raise BrokenProcessPool("A child process terminated abruptly")
+        self.futures.append(Future())
+        return self.futures[-1]
+
+    def shutdown(self, wait=True):
+        self.shut_down = True
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    pools = []
+    monkeypatch.setattr(util, 'ProcessPoolExecutor', lambda max_workers: pools.append(Pool(max_workers)) or pools[-1])
+    queue = util.TrainingQueue(max_workers=1, root=str(tmp_path / 'jobs'), store_root=str(tmp_path / 'models'))
+    queue.pools = pools
+    return queue
+
+
+def test_broken_pool_is_replaced(queue):
+    lost = queue.submit('cbf', 'ann', 'simple')
+    queue.pools[0].broken = True
+    job = queue.submit('cbf', 'bob', 'simple')
+
+    assert len(queue.pools) == 2 and queue.pools[0].shut_down
+    assert len(queue.pools[1].futures) == 1
+    assert queue.status(lost)['state'] == 'failed'
+    assert queue.status(lost)['error'].startswith('BrokenProcessPool')
+    assert queue.status(job)['state'] == 'queued'
+    assert queue.stats() == {'submitted': 2, 'done': 0, 'failed': 1, 'pending': 1, 'max_workers': 1}
+
+
+def test_late_failure_is_counted_once(queue):
+    lost = queue.submit('cbf', 'ann', 'simple')
+    queue.pools[0].broken = True
+    queue.submit('cbf', 'bob', 'simple')
+    # the old pool gets round to failing its futures as well
+    queue.pools[0].futures[0].set_exception(BrokenProcessPool("A child process terminated abruptly"))
+    assert queue.stats()['failed'] == 1
+
+    queue.pools[1].futures[0].set_result('done')
+    assert queue.stats() == {'submitted': 2, 'done': 1, 'failed': 1, 'pending': 0, 'max_workers': 1}
+    assert queue.status(lost)['state'] == 'failed'
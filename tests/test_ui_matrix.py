@@ -0,0 +1,52 @@
+# the sparse user-item matrix against the dense pivot_table it replaced
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.metrics.pairwise import cosine_similarity
+
+import util
+
+
+@pytest.fixture(scope='module')
+def ratings():
+    # 40 users rating 5-30 of 60 beers, some of them more than once
+    rs = np.random.RandomState(4)
+    rows = []
+    for u in range(40):
+        for beer in rs.choice(60, rs.randint(5, 31), replace=False):
+            for _ in range(1 + (rs.rand() < 0.1)):
+                rows.append(('user{:02d}'.format(u), 'beer{:02d}'.format(beer), rs.randint(1, 21) / 4))
+    return pd.DataFrame(rows, columns=['username', 'beer_name', 'user_rating'])
+
+
+def dense_ui_matrix(df, fill_method):
+    # create_ui_matrix as it was, with user_mean's fill actually applied
+    pivot = pd.pivot_table(data=df, values='user_rating', index='username', columns='beer_name', aggfunc='mean')
+    if fill_method == 0:
+        return pivot.fillna(0)
+    if fill_method == 'item_mean':
+        return pivot.fillna(pivot.mean(axis=0), axis=0)
+    return pivot.apply(lambda row: row.fillna(row.mean()), axis=1)
+
+
+@pytest.mark.parametrize('fill_method', [0, 'item_mean', 'user_mean'])
+def test_cosine_matches_dense_pivot(ratings, fill_method):
+    dense = dense_ui_matrix(ratings, fill_method)
+    expected = cosine_similarity(dense.values)
+
+    ui_matrix = util.create_ui_matrix(ratings, fill_method=fill_method)
+    assert list(ui_matrix.users) == list(dense.index)
+    assert list(ui_matrix.beers) == list(dense.columns)
+    norms = ui_matrix.row_norms()
+    np.testing.assert_allclose(norms, np.linalg.norm(dense.values, axis=1), rtol=1e-14)
+    for i in range(len(ui_matrix.users)):
+        np.testing.assert_allclose(util.cosine_similarities(ui_matrix, i), expected[i], rtol=0, atol=1e-14)
+
+
+def test_similarity_frame_matches_dense_pivot(ratings):
+    dense = dense_ui_matrix(ratings, 0)
+    sim = cosine_similarity(dense.loc[['user07']], dense.drop('user07'))[0]
+    sim_df = util.calculate_cosine_similarity('user07', util.create_ui_matrix(ratings))
+    expected = pd.Series(sim, index=dense.drop('user07').index)
+    np.testing.assert_allclose(sim_df['sim_score'].values, expected[sim_df['username']].values, rtol=0, atol=1e-14)
+    assert sim_df['sim_score'].is_monotonic_decreasing
@@ -0,0 +1,41 @@
+## Train the ALS matrix factorization model used by the 'als' technique
+#
+#   python train_als.py [--db data/beer.db] [--rank 32] [--reg 0.1] [--iterations 10] [--jobs N]
+#
+# The model is tied to the version of beer.db it was trained on; the app
+# retrains one in memory once the data changes.
+import argparse
+import time
+
+from util import *
+
+
+def train(database_path=db_path, path=als_model_path, rank=32, reg=0.1, iterations=10, n_jobs=None):
+    start = time.time()
+    version = data_version(database_path)
+    df = load_ratings(['user_rating', 'beer_name', 'username'], remove_dups=False,
+                      database_path=database_path)
+    ui_matrix = create_ui_matrix(df)
+    print("Loaded {:,d} users x {:,d} beers, {:,d} ratings in {:.2f}s".format(
+        ui_matrix.shape[0], ui_matrix.shape[1], ui_matrix.ratings.nnz, time.time() - start))
+
+    start = time.time()
+    model = train_als(ui_matrix, rank=rank, reg=reg, iterations=iterations, n_jobs=n_jobs,
+                      version=version, verbose=True)
+    elapsed = time.time() - start
+    model.save(path)
+    print("Trained rank {} factors in {:.2f}s, {:.1f} MB -> {}".format(
+        model.rank, elapsed, model.nbytes() / 1024**2, path))
+    return model
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train the ALS matrix factorization model')
+    parser.add_argument('--db', default=db_path, help='path to beer.db')
+    parser.add_argument('--out', default=als_model_path, help='where to write the model')
+    parser.add_argument('--rank', type=int, default=32, help='latent factors per user / beer')
+    parser.add_argument('--reg', type=float, default=0.1, help='regularization, scaled by rating count')
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--jobs', type=int, default=None, help='threads for the blocked solves (default: all cores)')
+    args = parser.parse_args()
+    train(args.db, args.out, rank=args.rank, reg=args.reg, iterations=args.iterations, n_jobs=args.jobs)
@@ -0,0 +1,129 @@
+## Train content-based (cbf) models for every user into the model store
+#
+#   python train_cbf.py [--db data/beer.db] [--store data/models] [--features simple]
+#                       [--algorithm Lasso] [--min-ratings 20] [--jobs N]
+#
+# Models are stored under the data version they were trained on. Users who
+# already have a model for this version are skipped, so an interrupted run
+# picks up where it stopped when started again.
+import argparse
+import contextlib
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from util import *
+
+
+def train_user(args):
+    # runs in a worker process: fit one user's slice and write it to the store
+    store_root, key, user_df, algorithm, encoder = args
+    start = time.time()
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            model, best_params, mae, quarter, half = cbf(user_df, algorithm, 'user_rating',
+                                                         impute_na_mean=True, remove_all_outliers=True)
+    except Exception as e:
+        return key[0], time.time() - start, '{}: {}'.format(type(e).__name__, e)
+    elapsed = time.time() - start
+    ModelStore(store_root).save(key, {'model': model, 'feature_selection': key[2], 'encoder': encoder, 'algorithm': algorithm,
+                                      'best_params': best_params, 'mae': mae, 'quarter': quarter,
+                                      'half': half, 'train_seconds': elapsed})
+    return key[0], elapsed, None
+
+
+def user_slices(df, usernames):
+    # one user's rows at a time, so workers never see the whole table
+    rows = df['username'].groupby(df['username']).indices
+    for username in usernames:
+        yield username, df.take(rows[username]).drop(['username'], axis=1)
+
+
+def format_seconds(seconds):
+    return '{:d}m{:02d}s'.format(int(seconds) // 60, int(seconds) % 60)
+
+
+def print_histogram(times, width=40):
+    # log-spaced bins, since most users fit in milliseconds and a few take seconds
+    times = np.asarray(times)
+    bins = np.logspace(np.log10(times.min()), np.log10(times.max()), 11) if times.max() > times.min() else 1
+    counts, edges = np.histogram(times, bins=bins)
+    print("Per-user training time (p50 = {:.0f} ms, p95 = {:.0f} ms, max = {:.0f} ms)".format(
+        1000 * np.median(times), 1000 * np.percentile(times, 95), 1000 * times.max()))
+    for count, low, high in zip(counts, edges[:-1], edges[1:]):
+        print("  {:8.0f} - {:8.0f} ms | {:<{width}} {:,d}".format(
+            1000 * low, 1000 * high, '#' * int(np.ceil(width * count / counts.max())), count, width=width))
+
+
+def train(database_path=db_path, store_root=model_store_path, feature_selection='simple', algorithm='Lasso',
+          min_ratings=20, n_jobs=None, progress_every=5.0):
+    start = time.time()
+    version = data_version(database_path)
+    store = ModelStore(store_root)
+    df, encoder = cbf_feature_frame(feature_selection, database_path=database_path)
+
+    counts = df['username'].value_counts()
+    eligible = counts[counts >= min_ratings].index
+    done = store.usernames('cbf', feature_selection, version)
+    # largest users first, so the pool doesn't end on one long fit
+    pending = [username for username in eligible if username not in done]
+    print("Loaded {:,d} ratings in {:.2f}s: {:,d} users with >= {} ratings, {:,d} already stored, {:,d} to train".format(
+        len(df), time.time() - start, len(eligible), min_ratings, len(eligible) - len(pending), len(pending)))
+    if not pending:
+        return []
+
+    n_jobs = n_jobs or os.cpu_count()
+    times, failures = [], []
+    start = last_report = time.time()
+    slices = user_slices(df, pending)
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        # a few slices per worker in flight; the rest wait in the generator
+        running = set()
+        while True:
+            for username, user_df in slices:
+                running.add(pool.submit(train_user, (store_root, (username, 'cbf', feature_selection, version),
+                                                     user_df, algorithm, encoder)))
+                if len(running) >= 2 * n_jobs:
+                    break
+            if not running:
+                break
+            finished, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                username, elapsed, error = future.result()
+                if error is None:
+                    times.append(elapsed)
+                else:
+                    failures.append((username, error))
+
+            if time.time() - last_report >= progress_every or not running:
+                last_report = time.time()
+                n_done = len(times) + len(failures)
+                rate = n_done / (last_report - start)
+                print("{:,d} / {:,d} users ({:.0f}%), {:.1f} users/s, {} elapsed, ETA {}, {:,d} failed".format(
+                    n_done, len(pending), 100 * n_done / len(pending), rate, format_seconds(last_report - start),
+                    format_seconds((len(pending) - n_done) / rate), len(failures)))
+
+    print("Trained {:,d} {} models ({}) in {} -> {}".format(
+        len(times), algorithm, feature_selection, format_seconds(time.time() - start),
+        store.directory('cbf', feature_selection, version)))
+    for username, error in failures[:10]:
+        print("  failed: {} ({})".format(username, error))
+    if len(failures) > 10:
+        print("  ... and {:,d} more failures".format(len(failures) - 10))
+    if times:
+        print_histogram(times)
+    return times
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train per-user cbf models into the model store')
+    parser.add_argument('--db', default=db_path, help='path to beer.db')
+    parser.add_argument('--store', default=model_store_path, help='model store directory')
+    parser.add_argument('--features', default='simple', choices=['simple'] + description_feature_selections,
+                        help='feature selection, as in the Existing User tab')
+    parser.add_argument('--algorithm', default='Lasso', choices=['Lasso', 'Ridge', 'ElasticNet'])
+    parser.add_argument('--min-ratings', type=int, default=20, help='skip users with fewer ratings')
+    parser.add_argument('--jobs', type=int, default=None, help='worker processes (default: all cores)')
+    args = parser.parse_args()
+    train(args.db, args.store, feature_selection=args.features, algorithm=args.algorithm,
+          min_ratings=args.min_ratings, n_jobs=args.jobs)
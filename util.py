@@ -1,15 +1,32 @@
 import pandas as pd
 import sqlite3
 import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import atexit
+import pickle
+import uuid
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import quote, unquote
+from urllib.request import pathname2url
 
 db_path = 'data/beer.db'
 
 def username_options(database_path=db_path):
 
-    query = "SELECT DISTINCT username FROM prepped_data ORDER BY username"
+    if has_normalized_schema(database_path):
+        query = "SELECT username FROM users ORDER BY username"
+    else:
+        query = "SELECT DISTINCT username FROM prepped_data ORDER BY username"
     
-    with sqlite3.connect(database_path) as conn:
-        usernames = list(pd.read_sql(query, conn)['username'])
+    usernames = list(read_sql(query, database_path)['username'])
 
     username_options = [{'label': username, 'value': username} for username in usernames]
 
@@ -17,9 +34,11 @@ def username_options(database_path=db_path):
 
 
 def beer_options(database_path=db_path):
-    query = "SELECT DISTINCT beer_name FROM prepped_data ORDER BY beer_name"
-    with sqlite3.connect(database_path) as conn:
-        beers = list(pd.read_sql(query,conn)['beer_name'])
+    if has_normalized_schema(database_path):
+        query = "SELECT beer_name FROM beers ORDER BY beer_name"
+    else:
+        query = "SELECT DISTINCT beer_name FROM prepped_data ORDER BY beer_name"
+    beers = list(read_sql(query, database_path)['beer_name'])
     beer_options = [{'label': beer, 'value': beer} for beer in beers]
     return beer_options
 
@@ -32,30 +51,454 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import sqlite3
+from scipy import sparse
 from sklearn.preprocessing import StandardScaler
-from functools import reduce
 
-def pipeline_func(data, fns):
-    return reduce(lambda a, x: x(a), fns, data)
+# pipeline_func runs fns over data in order. Steps named with Step are timed,
+# and when the run has a key their results are memoized in the pipeline
+# cache under a fingerprint of the key, every step up to them and their
+# params, so a run picks up after the last step already cached. Cached
+# results are shared between runs; treat them as read-only
+pipeline_cache_path = 'data/pipeline-cache'
+pipeline_cache_bytes = int(os.environ.get('PIPELINE_CACHE_MB', 512)) * 1024**2
+pipeline_disk_bytes = int(os.environ.get('PIPELINE_DISK_MB', 2048)) * 1024**2
+
+class Step:
+    """A named pipeline step, fn(data, **params).
+
+    memoize=False still fingerprints the step, so later steps can be
+    memoized, but never stores its own result (a cheap read of the
+    in-memory snapshot, say).
+    """
+
+    def __init__(self, name, fn, memoize=True, **params):
+        self.name = name
+        self.fn = fn
+        self.memoize = memoize
+        self.params = params
+
+    def __call__(self, data):
+        return self.fn(data, **self.params)
+
+    def fingerprint(self, upstream):
+        # upstream: the fingerprint of this step's input
+        params = json.dumps(self.params, sort_keys=True, default=repr)
+        return hashlib.sha1('\0'.join([upstream, self.name, params]).encode()).hexdigest()
+
+class PipelineCache:
+    """Step results in two tiers: an in-memory LRU bounded by max_bytes
+    (each result's pickled size), and pickles under root bounded by
+    max_disk_bytes, the least recently used removed first.
+
+    The disk tier is shared by every worker, so a result computed by one is
+    read by the others instead of being recomputed. Results bigger than a
+    tier skip it, and results that can't be pickled aren't cached.
+    """
+
+    def __init__(self, root=pipeline_cache_path, max_bytes=pipeline_cache_bytes,
+                 max_disk_bytes=pipeline_disk_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # fingerprint -> (result, nbytes)
+        self._bytes = 0
+        self._steps = {}  # step name -> counters
+
+    def path(self, fingerprint):
+        return os.path.join(self.root, fingerprint + '.pkl')
+
+    def _remember(self, fingerprint, result, nbytes):
+        with self._lock:
+            if fingerprint in self._memory:
+                self._bytes -= self._memory.pop(fingerprint)[1]
+            if nbytes > self.max_bytes:
+                return
+            self._memory[fingerprint] = (result, nbytes)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._memory.popitem(last=False)
+                self._bytes -= evicted
+
+    def get(self, fingerprint):
+        # (tier, result); tier is 'memory', 'disk' or None for a miss
+        with self._lock:
+            if fingerprint in self._memory:
+                self._memory.move_to_end(fingerprint)
+                return 'memory', self._memory[fingerprint][0]
+        path = self.path(fingerprint)
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+            os.utime(path)  # recently used, for _trim_disk
+        except FileNotFoundError:
+            return None, None
+        result = pickle.loads(data)
+        self._remember(fingerprint, result, len(data))
+        return 'disk', result
+
+    def put(self, fingerprint, result):
+        try:
+            data = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return
+        self._remember(fingerprint, result, len(data))
+        if len(data) <= self.max_disk_bytes:
+            atomic_write(self.path(fingerprint), data)
+            self._trim_disk()
+
+    def _trim_disk(self):
+        entries = []
+        for name in os.listdir(self.root):
+            if name.endswith('.pkl'):
+                try:
+                    stat = os.stat(os.path.join(self.root, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.root, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def record(self, step, outcome, seconds=0.0):
+        # outcome: 'memory' / 'disk' (hits), 'miss', or 'uncached' for
+        # steps run outside a keyed run or not memoized
+        with self._lock:
+            counters = self._steps.setdefault(step, {'memory': 0, 'disk': 0, 'miss': 0, 'uncached': 0,
+                                                     'seconds': 0.0})
+            counters[outcome] += 1
+            counters['seconds'] += seconds
+
+    def stats(self):
+        with self._lock:
+            steps = {}
+            for step, counters in self._steps.items():
+                hits = counters['memory'] + counters['disk']
+                lookups = hits + counters['miss']
+                runs = counters['miss'] + counters['uncached']
+                steps[step] = dict(counters, hit_rate=hits / lookups if lookups else None,
+                                   mean_seconds=counters['seconds'] / runs if runs else None)
+            return {'steps': steps, 'entries': len(self._memory), 'bytes': self._bytes,
+                    'max_bytes': self.max_bytes}
+
+
+_pipeline_caches = {}
+
+def get_pipeline_cache(root=pipeline_cache_path):
+    # one cache, and so one memory tier, per directory in this worker
+    if root not in _pipeline_caches:
+        _pipeline_caches[root] = PipelineCache(root)
+    return _pipeline_caches[root]
+
+def pipeline_stats():
+    return get_pipeline_cache().stats()
+
+def pipeline_func(data, fns, key=None, cache=None):
+    # fns: Steps or plain callables. A plain callable ends memoization: it
+    # and the steps after it always run
+    cache = get_pipeline_cache() if cache is None else cache
+    fingerprints = []
+    upstream = None if key is None else hashlib.sha1(json.dumps(key, default=repr).encode()).hexdigest()
+    for fn in fns:
+        upstream = fn.fingerprint(upstream) if upstream is not None and isinstance(fn, Step) else None
+        fingerprints.append(upstream)
+
+    # resume after the last memoized step that is cached
+    start = 0
+    for i in reversed(range(len(fns))):
+        if fingerprints[i] is not None and fns[i].memoize:
+            tier, result = cache.get(fingerprints[i])
+            if tier is not None:
+                cache.record(fns[i].name, tier)
+                data, start = result, i + 1
+                break
+
+    for fn, fingerprint in zip(fns[start:], fingerprints[start:]):
+        started = time.time()
+        data = fn(data)
+        if isinstance(fn, Step):
+            memoized = fingerprint is not None and fn.memoize
+            cache.record(fn.name, 'miss' if memoized else 'uncached', time.time() - started)
+            if memoized:
+                cache.put(fingerprint, data)
+    return data
 
 
 #############################################   
 # 1. Import, Clean, EDA
 #############################################     
 
+# pooled, read-only sqlite connections shared by every reader
+sqlite_pragmas = {'mmap_size': 256 * 1024**2,
+                  'cache_size': -64 * 1024,  # KiB
+                  'temp_store': 'MEMORY',
+                  'query_only': 1}
+
+class ConnectionPool:
+    """One read-only connection per thread and database file.
+
+    Connections are reopened when the database file changes and closed
+    when the process exits.
+    """
+
+    def __init__(self, pragmas=sqlite_pragmas):
+        self.pragmas = pragmas
+        self._lock = threading.Lock()
+        self._reset()
+        self._stats = {'opened': 0, 'reused': 0, 'closed': 0, 'queries': 0, 'query_seconds': 0.0}
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._local = threading.local()
+        self._open_conns = set()
+
+    def _count(self, key, value=1):
+        with self._lock:
+            self._stats[key] += value
+
+    def _open(self, database_path):
+        uri = 'file:{}?mode=ro'.format(pathname2url(os.path.abspath(database_path)))
+        # connections stay on their own thread, but close_all() may run on another
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        for pragma, value in self.pragmas.items():
+            conn.execute("PRAGMA {} = {}".format(pragma, value))
+        with self._lock:
+            self._open_conns.add(conn)
+            self._stats['opened'] += 1
+        return conn
+
+    def _close(self, conn):
+        with self._lock:
+            if conn not in self._open_conns:
+                return
+            self._open_conns.remove(conn)
+            self._stats['closed'] += 1
+        conn.close()
+
+    @contextmanager
+    def connection(self, database_path=db_path):
+        # connections opened before a fork (gunicorn --preload) belong to the parent
+        if self._pid != os.getpid():
+            with self._lock:
+                self._reset()
+        conns = self._local.__dict__.setdefault('conns', {})
+        version = data_version(database_path)
+        conn, conn_version = conns.get(database_path, (None, None))
+        if conn is not None and conn_version == version and conn in self._open_conns:
+            self._count('reused')
+        else:
+            if conn is not None:
+                self._close(conn)
+            conn = self._open(database_path)
+            conns[database_path] = (conn, version)
+        yield conn
+
+    def read_sql(self, query, database_path=db_path, params=None):
+        with self.connection(database_path) as conn:
+            start = time.perf_counter()
+            df = pd.read_sql(query, conn, params=params)
+            self._count('queries')
+            self._count('query_seconds', time.perf_counter() - start)
+        return df
+
+    def close_all(self):
+        with self._lock:
+            conns, self._open_conns = self._open_conns, set()
+            self._stats['closed'] += len(conns)
+        for conn in conns:
+            conn.close()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+connection_pool = ConnectionPool()
+atexit.register(connection_pool.close_all)
+
+def read_sql(query, database_path=db_path, params=None):
+    return connection_pool.read_sql(query, database_path, params=params)
+
+def connection_stats():
+    return connection_pool.stats()
+
 # @TODO - rename this function
 def import_table(db_path, 
                  query = "SELECT * FROM user_extract",
-                 remove_dups=True):
+                 remove_dups=True,
+                 params=None):
     
-    conn = sqlite3.connect(db_path)
-    df = pd.read_sql(query, conn)
+    df = read_sql(query, db_path, params=params)
     
     if remove_dups==True:
         df = df[~df.duplicated()]
-    
+
     return(df)
 
+
+# in-memory snapshot of prepped_data, loaded once per worker
+snapshot_columns = ['username', 'beer_name', 'beer_description', 'ABV', 'IBU',
+                    'global_rating', 'user_rating']
+
+def data_version(database_path=db_path):
+    # the -wal file changes before the main db file does on a WAL database;
+    # readers create it empty, so only a non-empty one counts as a change
+    version = []
+    for path in [database_path, database_path + '-wal']:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            if path == database_path or stat.st_size > 0:
+                version.append('{}-{}'.format(stat.st_mtime_ns, stat.st_size))
+    return '_'.join(version)
+
+
+class RatingsSnapshot:
+    """Read-only copy of prepped_data held in memory.
+
+    Accessors always hand back a new frame, so callers are free to mutate
+    what they get without touching the snapshot.
+    """
+
+    def __init__(self, df, version):
+        self.version = version
+        self._df = df.reset_index(drop=True)
+        self._user_rows = self._df.groupby('username').indices
+        self._beer_rows = self._df.groupby('beer_name').indices
+        self._keep_masks = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._df)
+
+    def _keep_mask(self, columns):
+        key = tuple(columns)
+        with self._lock:
+            if key not in self._keep_masks:
+                self._keep_masks[key] = ~self._df.duplicated(list(columns)).values
+            return self._keep_masks[key]
+
+    def usernames(self):
+        return sorted(self._user_rows)
+
+    def beer_names(self):
+        return sorted(self._beer_rows)
+
+    def rows(self, columns, username=None, beer_name=None, beer_names=None, remove_dups=True):
+        columns = list(columns)
+        empty = np.array([], dtype=np.int64)
+
+        if username is not None:
+            key, positions = 'username', self._user_rows.get(username, empty)
+        elif beer_name is not None:
+            key, positions = 'beer_name', self._beer_rows.get(beer_name, empty)
+        elif beer_names is not None:
+            key = 'beer_name'
+            positions = [self._beer_rows.get(beer, empty) for beer in set(beer_names)]
+            positions = np.unique(np.concatenate(positions + [empty]))
+        else:
+            key, positions = None, None
+
+        # dropping duplicates over the whole table is only the same as
+        # dropping them within the slice when the slice key is projected
+        if remove_dups and (key is None or key in columns):
+            keep = self._keep_mask(columns)
+            positions = np.flatnonzero(keep) if positions is None else positions[keep[positions]]
+            remove_dups = False
+
+        if positions is None:
+            df = self._df[columns]
+        else:
+            df = self._df.iloc[positions, self._df.columns.get_indexer(columns)]
+
+        if remove_dups:
+            df = df[~df.duplicated()]
+
+        return df
+
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+def get_snapshot(database_path=db_path):
+    version = data_version(database_path)
+    snapshot = _snapshots.get(database_path)
+    if snapshot is None or snapshot.version != version:
+        with _snapshots_lock:
+            snapshot = _snapshots.get(database_path)
+            if snapshot is None or snapshot.version != version:
+                query = "SELECT {} FROM prepped_data".format(', '.join(snapshot_columns))
+                df = import_table(database_path, query, remove_dups=False)
+                snapshot = RatingsSnapshot(df, version)
+                _snapshots[database_path] = snapshot
+    return snapshot
+
+def has_normalized_schema(database_path=db_path):
+    # users / beers / ratings are built from prepped_data by migrate_db.py
+    query = "SELECT name FROM sqlite_master WHERE type = 'view' AND name = 'ratings_view'"
+    with connection_pool.connection(database_path) as conn:
+        return conn.execute(query).fetchone() is not None
+
+# the most ? parameters a statement may have before SQLite 3.32 (32,766 after)
+sqlite_max_params = 999
+
+def lookup_ratings(columns, username=None, beer_name=None, beer_names=None,
+                   remove_dups=True, database_path=db_path):
+    # parameterized per-user / per-beer query, index-backed once migrated
+    if has_normalized_schema(database_path):
+        table, order = 'ratings_view', 'rating_id'
+    else:
+        table, order = 'prepped_data', 'rowid'
+
+    if username is not None:
+        where, params = "username = ?", [username]
+    elif beer_name is not None:
+        where, params = "beer_name = ?", [beer_name]
+    elif beer_names is not None:
+        beer_names = list(dict.fromkeys(beer_names))
+        if len(beer_names) > sqlite_max_params:
+            return lookup_many_beers(columns, beer_names, table, order, remove_dups, database_path)
+        where, params = "beer_name IN ({})".format(', '.join(['?'] * len(beer_names))), beer_names
+    else:
+        where, params = "1", []
+
+    query = "SELECT {} FROM {} WHERE {} ORDER BY {}".format(', '.join(columns), table, where, order)
+    return import_table(database_path, query, remove_dups=remove_dups, params=params)
+
+def lookup_many_beers(columns, beer_names, table, order, remove_dups, database_path):
+    # an IN list longer than SQLite allows, read in chunks and merged back
+    # into table order
+    frames = []
+    for i in range(0, len(beer_names), sqlite_max_params):
+        chunk = beer_names[i:i + sqlite_max_params]
+        query = "SELECT {} AS row_order, {} FROM {} WHERE beer_name IN ({})".format(
+            order, ', '.join(columns), table, ', '.join(['?'] * len(chunk)))
+        frames.append(read_sql(query, database_path, params=chunk))
+    df = pd.concat(frames, ignore_index=True).sort_values('row_order', kind='mergesort')
+    df = df.drop('row_order', axis=1).reset_index(drop=True)
+    if remove_dups:
+        df = df[~df.duplicated()]
+    return df
+
+def load_ratings(columns, username=None, beer_name=None, beer_names=None,
+                 remove_dups=True, database_path=db_path):
+    # slices go to the database until this worker has loaded the snapshot,
+    # so a cold worker doesn't read the whole table to score one beer
+    is_slice = username is not None or beer_name is not None or beer_names is not None
+    snapshot = _snapshots.get(database_path)
+    if is_slice and (snapshot is None or snapshot.version != data_version(database_path)):
+        return lookup_ratings(columns, username=username, beer_name=beer_name, beer_names=beer_names,
+                              remove_dups=remove_dups, database_path=database_path)
+
+    snapshot = get_snapshot(database_path)
+    return snapshot.rows(columns, username=username, beer_name=beer_name,
+                         beer_names=beer_names, remove_dups=remove_dups)
+
 def remove_outliers(df, features):
     for feature in features:
         q1 = df[feature].quantile(.25)
@@ -134,33 +577,135 @@ def impute_na(df, features, impute_method = 'mean'):
 ######################################################     
 ### 2. Cosine Similarity / Nearest Neighbors
 ######################################################     
+class UserItemMatrix:
+    """Sparse users x beers matrix of (mean) user ratings.
+
+    Missing ratings are filled without materializing the fill: the filled
+    matrix is kept as ``outer(row_offset, col_offset) + residual`` where
+    `residual` is nonzero only where a rating exists, and every product is
+    taken against that form. With fill_method=0 both offsets are zero and
+    the residual is the ratings matrix itself.
+    """
+
+    def __init__(self, ratings, users, beers, fill_method=0):
+        self.ratings = ratings
+        self.users = np.asarray(users)
+        self.beers = np.asarray(beers)
+        self.user_index = {user: i for i, user in enumerate(self.users)}
+        self.beer_index = {beer: j for j, beer in enumerate(self.beers)}
+        self.fill_method = fill_method
+
+        n_users, n_beers = ratings.shape
+        counts = np.diff(ratings.indptr)
+        entry_rows = np.repeat(np.arange(n_users), counts)
+        residual = ratings.copy() if fill_method != 0 else ratings
+
+        if fill_method == 0:
+            self.row_offset = np.zeros(n_users)
+            self.col_offset = np.zeros(n_beers)
+        elif fill_method == 'item_mean':
+            item_counts = np.bincount(ratings.indices, minlength=n_beers)
+            item_sums = np.bincount(ratings.indices, weights=ratings.data, minlength=n_beers)
+            self.row_offset = np.ones(n_users)
+            self.col_offset = item_sums / np.maximum(item_counts, 1)
+            residual.data = ratings.data - self.col_offset[ratings.indices]
+        elif fill_method == 'user_mean':
+            user_sums = np.bincount(entry_rows, weights=ratings.data, minlength=n_users)
+            self.row_offset = user_sums / np.maximum(counts, 1)
+            self.col_offset = np.ones(n_beers)
+            residual.data = ratings.data - self.row_offset[entry_rows]
+        else:
+            raise ValueError("Please checkout 'fill_method' value")
+
+        self.residual = residual
+        self._col_offset_sq = self.col_offset.dot(self.col_offset)
+        self._residual_dot_offset = residual.dot(self.col_offset)
+        self._residual_t = None
+        self._norms = None
+
+    @property
+    def shape(self):
+        return self.ratings.shape
+
+    def row_norms(self):
+        if self._norms is None:
+            a, g = self.row_offset, self._residual_dot_offset
+            residual_sq = np.asarray(self.residual.multiply(self.residual).sum(axis=1)).ravel()
+            self._norms = np.sqrt(np.maximum(a**2 * self._col_offset_sq + 2 * a * g + residual_sq, 0))
+        return self._norms
+
+    def gram(self, rows):
+        # dot products of the given (filled) user rows with every user row,
+        # returned as a dense len(rows) x n_users block
+        rows = np.asarray(rows)
+        if self._residual_t is None:
+            self._residual_t = self.residual.T.tocsr()
+        block = self.residual[rows].dot(self._residual_t).toarray()
+        if self.fill_method != 0:
+            a, g = self.row_offset, self._residual_dot_offset
+            block += np.outer(a[rows] * self._col_offset_sq + g[rows], a) + np.outer(a[rows], g)
+        return block
+
+    def row_dots(self, row, rows):
+        # dot products of one (filled) user row with the given user rows only
+        rows = np.asarray(rows)
+        dots = self.residual[rows].dot(self.residual[row].T).toarray().ravel()
+        if self.fill_method != 0:
+            a, g = self.row_offset, self._residual_dot_offset
+            dots += a[rows] * (a[row] * self._col_offset_sq + g[row]) + g[rows] * a[row]
+        return dots
+
+    def project(self, planes, rows=None):
+        # (filled) user rows times a dense n_beers x m matrix
+        residual = self.residual if rows is None else self.residual[rows]
+        a = self.row_offset if rows is None else self.row_offset[np.atleast_1d(rows)]
+        projected = np.asarray(residual.dot(planes))
+        if self.fill_method != 0:
+            projected += np.outer(a, self.col_offset.dot(planes))
+        return projected
+
+
 def create_ui_matrix(df, fill_method=0):
     # Create User-Item Matrix 
-    data = df
-    values = 'user_rating'
-    index = 'username'
-    columns = 'beer_name'
-    agg_func = 'mean'
-    
-    if fill_method == 'item_mean':
-        ui_matrix = pd.pivot_table(data=data, values=values, index=index, 
-                                   columns=columns, aggfunc=agg_func)
-        ui_matrix = ui_matrix.fillna(ui_matrix.mean(axis=0), axis=0)
-    
-    elif fill_method == 'user_mean':
-        ui_matrix = pd.pivot_table(data=data, values=values, index=index, 
-                                   columns=columns, aggfunc=agg_func)
-        ui_matrix.apply(lambda row: row.fillna(row.mean()), axis=1)
-    
-    elif fill_method == 0:
-        ui_matrix = pd.pivot_table(data=data, values=values, index=index, 
-                                   columns=columns, aggfunc=agg_func, fill_value=0)
-    else:
+    if fill_method not in [0, 'item_mean', 'user_mean']:
         raise ValueError("Please checkout 'fill_method' value")
-    
-    ui_matrix.columns = list(ui_matrix.columns)
-    
-    return(ui_matrix)
+
+    ratings = df[['username', 'beer_name', 'user_rating']].dropna()
+    user_codes, users = pd.factorize(ratings['username'], sort=True)
+    beer_codes, beers = pd.factorize(ratings['beer_name'], sort=True)
+    n_users, n_beers = len(users), len(beers)
+
+    # average repeat ratings of the same beer in one vectorized pass
+    keys, inverse = np.unique(user_codes.astype(np.int64) * n_beers + beer_codes, return_inverse=True)
+    sums = np.bincount(inverse, weights=ratings['user_rating'].values.astype(float))
+    counts = np.bincount(inverse)
+    ui_matrix = sparse.csr_matrix((sums / counts, (keys // n_beers, keys % n_beers)),
+                                  shape=(n_users, n_beers))
+
+    return UserItemMatrix(ui_matrix, users, beers, fill_method=fill_method)
+
+
+_ui_matrices = {}
+
+def get_ui_matrix(fill_method=0, database_path=db_path):
+    # the full ratings matrix, built once per data version
+    version = data_version(database_path)
+    key = (database_path, fill_method)
+    cached = _ui_matrices.get(key)
+    if cached is None or cached[0] != version:
+        df = load_ratings(['username', 'beer_name', 'user_rating'], remove_dups=False,
+                          database_path=database_path)
+        cached = (version, create_ui_matrix(df, fill_method=fill_method))
+        _ui_matrices[key] = cached
+    return cached[1]
+
+
+def cosine_similarities(ui_matrix, row):
+    # one user's cosine similarity with every user;
+    # zero rows have zero similarity to everything, as in sklearn
+    norms = ui_matrix.row_norms()
+    norms = np.where(norms == 0, 1.0, norms)
+    return ui_matrix.gram([row])[0] / (norms * norms[row])
 
 
 # c. Calculate Cosine Similarity
@@ -168,20 +713,206 @@ def calculate_cosine_similarity(user_of_reference, ui_matrix):
 
     # Calculate Cosine Similarity 
     print("User of Reference for Cosine Sim = {}".format(user_of_reference))
+
+    if user_of_reference not in ui_matrix.user_index:
+        raise ValueError("{} has no ratings".format(user_of_reference))
+    i = ui_matrix.user_index[user_of_reference]
+
+    sim = cosine_similarities(ui_matrix, i)
+    others = np.arange(len(sim)) != i
     
-    from sklearn.metrics.pairwise import cosine_similarity
-    X = ui_matrix[ui_matrix.index == user_of_reference]
-    Y = ui_matrix[ui_matrix.index != user_of_reference]
-    
-    sim = cosine_similarity(X,Y)[0].tolist()
-    names = Y.index
-    
-    sim_df = pd.DataFrame({'username':names, 'sim_score':sim})
+    sim_df = pd.DataFrame({'username': ui_matrix.users[others], 'sim_score': sim[others]})
     sim_df = sim_df.sort_values(by='sim_score', ascending=False)
     
     return(sim_df)
 
 
+# precomputed top-K neighbors for every user
+neighbor_index_path = 'data/neighbor-index.npz'
+
+class NeighborIndex:
+    """Top-K most similar users for every user.
+
+    `neighbors` holds row positions into `users` (-1 pads users with fewer
+    than K others) and `scores` the matching cosine similarities, both
+    n_users x K and sorted by decreasing similarity.
+    """
+
+    def __init__(self, users, neighbors, scores, version=None):
+        self.users = np.asarray(users)
+        self.neighbors = np.asarray(neighbors, dtype=np.int32)
+        self.scores = np.asarray(scores, dtype=np.float32)
+        self.version = version
+        self.user_index = {user: i for i, user in enumerate(self.users)}
+
+    @property
+    def k(self):
+        return self.neighbors.shape[1]
+
+    def __contains__(self, username):
+        return username in self.user_index
+
+    def neighborhood(self, username):
+        i = self.user_index[username]
+        neighbors = self.neighbors[i]
+        valid = neighbors >= 0
+        return pd.DataFrame({'username': self.users[neighbors[valid]],
+                             'sim_score': self.scores[i][valid].astype(float)})
+
+    def nbytes(self):
+        return self.neighbors.nbytes + self.scores.nbytes
+
+    def save(self, path=neighbor_index_path):
+        np.savez(path, users=self.users.astype(str), neighbors=self.neighbors, scores=self.scores,
+                 version=np.array(self.version or ''))
+
+    @classmethod
+    def load(cls, path=neighbor_index_path):
+        with np.load(path) as arrays:
+            return cls(arrays['users'], arrays['neighbors'], arrays['scores'],
+                       version=str(arrays['version']) or None)
+
+
+def top_k_columns(block, k):
+    # indices and values of the k largest entries in each row, sorted
+    top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+    values = np.take_along_axis(block, top, axis=1)
+    order = np.argsort(-values, axis=1, kind='mergesort')
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(values, order, axis=1)
+
+def build_neighbor_index(ui_matrix, k=50, chunk_size=None, max_block_bytes=128 * 1024**2,
+                         version=None, verbose=False):
+    n_users = ui_matrix.shape[0]
+    k = max(0, min(k, n_users - 1))
+    if chunk_size is None:
+        # each chunk is a dense chunk_size x n_users block of float64 similarities
+        chunk_size = max(1, int(max_block_bytes // (8 * max(n_users, 1))))
+
+    norms = ui_matrix.row_norms()
+    norms = np.where(norms == 0, 1.0, norms)
+    neighbors = np.full((n_users, k), -1, dtype=np.int32)
+    scores = np.zeros((n_users, k), dtype=np.float32)
+
+    start_time = time.time()
+    for start in range(0, n_users, chunk_size):
+        rows = np.arange(start, min(start + chunk_size, n_users))
+        block = ui_matrix.gram(rows)
+        block /= norms[rows][:, None] * norms[None, :]
+        block[np.arange(len(rows)), rows] = -np.inf  # a user is not their own neighbor
+        if k > 0:
+            top, values = top_k_columns(block, k)
+            neighbors[rows] = top
+            scores[rows] = values
+        if verbose:
+            done = rows[-1] + 1
+            elapsed = time.time() - start_time
+            print("{:,d} / {:,d} users, {:,.0f} users/s".format(done, n_users, done / max(elapsed, 1e-9)))
+
+    return NeighborIndex(ui_matrix.users, neighbors, scores, version=version)
+
+
+_neighbor_indexes = {}
+
+def get_neighbor_index(path=neighbor_index_path, database_path=db_path):
+    # the index is only used while it matches the data it was built from
+    if not os.path.exists(path):
+        return None
+    version = data_version(database_path)
+    index = _neighbor_indexes.get(path)
+    if index is None or index.version != version:
+        index = NeighborIndex.load(path)
+        if index.version != version:
+            return None
+        _neighbor_indexes[path] = index
+    return index
+
+
+class LSHIndex:
+    """Random-projection LSH over the filled user rows, for approximate
+    neighbor search.
+
+    Each of `n_tables` tables buckets users by the signs of `n_bits` random
+    projections of their row. Users sharing a bucket with the query in any
+    table are candidates, and only the candidates are ranked, by their
+    exact cosine similarity. More tables raise recall, more bits shrink the
+    buckets; `n_probes` also searches the buckets reached by flipping the
+    query's n least certain bits in each table.
+    """
+
+    def __init__(self, ui_matrix, n_tables=16, n_bits=8, n_probes=1, seed=12, version=None):
+        self.ui_matrix = ui_matrix
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self.n_probes = n_probes
+        self.version = version
+
+        rs = np.random.RandomState(seed)
+        self.planes = rs.standard_normal((ui_matrix.shape[1], n_tables * n_bits)).astype(np.float32)
+        self._weights = np.left_shift(1, np.arange(n_bits, dtype=np.int64))
+        self.codes = self.hash(ui_matrix.project(self.planes))
+        # users sorted by bucket in each table, so a bucket is one slice
+        self._order = np.argsort(self.codes, axis=0, kind='mergesort')
+        self._sorted_codes = np.take_along_axis(self.codes, self._order, axis=0)
+
+    def hash(self, projected):
+        bits = (projected > 0).reshape(len(projected), self.n_tables, self.n_bits)
+        return bits.dot(self._weights)
+
+    def __contains__(self, username):
+        return username in self.ui_matrix.user_index
+
+    def nbytes(self):
+        return self.planes.nbytes + self.codes.nbytes + self._order.nbytes + self._sorted_codes.nbytes
+
+    def candidates(self, row, n_probes=None):
+        n_probes = self.n_probes if n_probes is None else n_probes
+        projected = self.ui_matrix.project(self.planes, rows=[row])[0].reshape(self.n_tables, self.n_bits)
+        found = []
+        for t in range(self.n_tables):
+            code = self.codes[row, t]
+            flips = np.argsort(np.abs(projected[t]))[:n_probes]
+            for probe in [code] + [code ^ self._weights[b] for b in flips]:
+                start = np.searchsorted(self._sorted_codes[:, t], probe, side='left')
+                end = np.searchsorted(self._sorted_codes[:, t], probe, side='right')
+                found.append(self._order[start:end, t])
+        found = np.unique(np.concatenate(found))
+        return found[found != row]
+
+    def neighborhood(self, username, n_probes=None):
+        i = self.ui_matrix.user_index[username]
+        rows = self.candidates(i, n_probes=n_probes)
+        norms = self.ui_matrix.row_norms()
+        norms = np.where(norms == 0, 1.0, norms)
+        sim = self.ui_matrix.row_dots(i, rows) / (norms[rows] * norms[i])
+        sim_df = pd.DataFrame({'username': self.ui_matrix.users[rows], 'sim_score': sim})
+        sim_df = sim_df.sort_values(by='sim_score', ascending=False)
+        return sim_df
+
+
+_lsh_indexes = {}
+
+def get_lsh_index(n_tables=16, n_bits=8, seed=12, database_path=db_path):
+    # hashed once per data version and settings; n_probes is chosen per query
+    version = data_version(database_path)
+    key = (database_path, n_tables, n_bits, seed)
+    index = _lsh_indexes.get(key)
+    if index is None or index.version != version:
+        index = LSHIndex(get_ui_matrix(database_path=database_path), n_tables=n_tables, n_bits=n_bits, seed=seed,
+                         version=version)
+        _lsh_indexes[key] = index
+    return index
+
+
+def lsh_recall_at_k(lsh_index, users, k=50, n_probes=None):
+    # share of each user's exact top K that the LSH neighborhood also ranks in its top K
+    recalls = []
+    for user in users:
+        exact = calculate_cosine_similarity(user, lsh_index.ui_matrix)['username'][:k]
+        approx = lsh_index.neighborhood(user, n_probes=n_probes)['username'][:k]
+        recalls.append(len(set(exact) & set(approx)) / max(len(exact), 1))
+    return np.mean(recalls)
+
+
 def calculate_nearest_neighbors(sim_df):
     # add neighbor rank to df
     neighbor_rank = sim_df.reset_index(drop=True)
@@ -199,12 +930,205 @@ def merge_nearest_neighobr_rank(df, neighbor_rank):
     return(df)
 
 
-def COSINE_STEP(df, user_of_reference):
-    ui_matrix = create_ui_matrix(df)
-    sim_df = calculate_cosine_similarity(user_of_reference, ui_matrix)
+def COSINE_STEP(df, user_of_reference, neighbor_index=None, ann_index=None, n_probes=None):
+    # with a neighbor index only the top K users get a rank, with an LSH
+    # index only the candidates it finds; the rest are NaN
+    if isinstance(df, SparseFrame):
+        return df.map_rows(lambda frame: COSINE_STEP(frame, user_of_reference, neighbor_index=neighbor_index,
+                                                     ann_index=ann_index, n_probes=n_probes))
+    if neighbor_index is not None and user_of_reference in neighbor_index:
+        sim_df = neighbor_index.neighborhood(user_of_reference)
+    elif ann_index is not None and user_of_reference in ann_index:
+        sim_df = ann_index.neighborhood(user_of_reference, n_probes=n_probes)
+    else:
+        ui_matrix = create_ui_matrix(df)
+        sim_df = calculate_cosine_similarity(user_of_reference, ui_matrix)
     neighbor_rank = calculate_nearest_neighbors(sim_df)
     df = merge_nearest_neighobr_rank(df, neighbor_rank)
     return df
+
+def neighborhood_covers(df, user_of_reference, beers):
+    # True when every beer was rated by at least one ranked neighbor
+    rated = df[(df['username'] != user_of_reference) & df['nearest_neighbor_rank'].notna()]
+    return set(beers) <= set(rated['beer_name'])
+
+def rank_neighbors(df, user_of_reference, beers, neighbor_index=None):
+    # the top-K neighborhood gives the same answer as the exact ranking
+    # whenever one of those K neighbors rated each beer we need
+    if neighbor_index is not None and user_of_reference in neighbor_index:
+        ranked_df = COSINE_STEP(df, user_of_reference, neighbor_index=neighbor_index)
+        if neighborhood_covers(ranked_df, user_of_reference, beers):
+            return ranked_df
+    return COSINE_STEP(df, user_of_reference)
+
+def first_rating_per_beer(df):
+    # user_rating of each beer's first row, in frame order
+    codes, beers = pd.factorize(df['beer_name'])
+    groups, first = np.unique(codes, return_index=True)
+    keep = groups >= 0
+    return pd.Series(df['user_rating'].values[first[keep]], index=beers[groups[keep]])
+
+def closest_neighbor_ratings(df, user_of_reference, beers=None):
+    # prediction for each beer: the rating of the closest ranked neighbor who
+    # rated it. COSINE_STEP's frame is ordered by neighbor rank (unranked users
+    # last), so that is the first row per beer after dropping the user's own
+    ratings = first_rating_per_beer(df[df['username'] != user_of_reference])
+    if beers is not None:
+        ratings = ratings.reindex(beers)
+    return ratings
+
+def knn_scores(user_of_reference, ui_matrix, k=50, min_support=1, neighbor_index=None):
+    # predicted rating for every beer in the catalog: the user's mean rating
+    # plus the similarity-weighted average of how far the top K (positively
+    # similar) neighbors rated it from their own means. Beers rated by fewer
+    # than min_support of those neighbors get NaN
+    if user_of_reference not in ui_matrix.user_index:
+        raise ValueError("{} has no ratings".format(user_of_reference))
+    i = ui_matrix.user_index[user_of_reference]
+
+    if neighbor_index is not None and user_of_reference in neighbor_index and neighbor_index.k >= k:
+        sim_df = neighbor_index.neighborhood(user_of_reference)[:k]
+        rows = np.array([ui_matrix.user_index[user] for user in sim_df['username']], dtype=int)
+        weights = sim_df['sim_score'].values
+    else:
+        sim = cosine_similarities(ui_matrix, i)
+        sim[i] = -np.inf
+        k = min(k, len(sim) - 1)
+        rows = top_k_columns(sim[None, :], k)[0][0] if k > 0 else np.array([], dtype=int)
+        weights = sim[rows]
+    rows, weights = rows[weights > 0], weights[weights > 0]
+
+    ratings = ui_matrix.ratings
+    counts = np.diff(ratings.indptr)
+    means = np.asarray(ratings.sum(axis=1)).ravel() / np.maximum(counts, 1)
+
+    # centered neighbor ratings and a rated indicator side by side, so one
+    # sparse product gives the weighted sum, the weight total and the support
+    neighbors = ratings[rows]
+    centered = neighbors.copy()
+    centered.data = neighbors.data - np.repeat(means[rows], np.diff(neighbors.indptr))
+    rated = neighbors.copy()
+    rated.data = np.ones_like(neighbors.data)
+    totals = sparse.hstack([centered, rated]).T.dot(weights).reshape(2, -1)
+    support = rated.T.dot(np.ones(len(rows)))
+
+    scores = np.full(ratings.shape[1], np.nan)
+    supported = (support >= max(min_support, 1)) & (totals[1] > 0)
+    scores[supported] = means[i] + totals[0][supported] / totals[1][supported]
+
+    return pd.DataFrame({'beer_name': ui_matrix.beers, 'predicted_rating': scores,
+                         'support': support.astype(int)})
+
+
+# precomputed top-N similar beers for every beer
+item_neighbors_path = 'data/item-neighbors.npz'
+
+class ItemNeighbors:
+    """Top-N most similar beers for every beer.
+
+    `similarities` is a float32 CSR n_beers x n_beers matrix whose row b
+    holds the cosine similarities of b's N closest beers (positive ones
+    only, never b itself).
+    """
+
+    def __init__(self, beers, similarities, version=None):
+        self.beers = np.asarray(beers)
+        self.similarities = sparse.csr_matrix(similarities, dtype=np.float32)
+        self.version = version
+        self.beer_index = {beer: j for j, beer in enumerate(self.beers)}
+
+    @property
+    def n(self):
+        counts = np.diff(self.similarities.indptr)
+        return int(counts.max()) if len(counts) else 0
+
+    def nbytes(self):
+        s = self.similarities
+        return s.data.nbytes + s.indices.nbytes + s.indptr.nbytes
+
+    def score(self, user_ratings):
+        # user_ratings: the user's rating per beer_name. Each beer is scored by
+        # the similarity-weighted average of the user's ratings of its
+        # neighbors; a beer with no rated neighbor gets NaN
+        columns = np.array([self.beer_index.get(beer, -1) for beer in user_ratings.index], dtype=int)
+        known = columns >= 0
+        ratings = np.zeros((len(self.beers), 2))
+        ratings[columns[known], 0] = np.asarray(user_ratings, dtype=float)[known]
+        ratings[columns[known], 1] = 1.0
+        totals = self.similarities.dot(ratings)
+        scores = np.full(len(self.beers), np.nan)
+        scored = totals[:, 1] > 0
+        scores[scored] = totals[scored, 0] / totals[scored, 1]
+        return pd.Series(scores, index=self.beers)
+
+    def save(self, path=item_neighbors_path):
+        s = self.similarities
+        np.savez(path, beers=self.beers.astype(str), data=s.data, indices=s.indices, indptr=s.indptr,
+                 version=np.array(self.version or ''))
+
+    @classmethod
+    def load(cls, path=item_neighbors_path):
+        with np.load(path) as arrays:
+            n_beers = len(arrays['beers'])
+            similarities = sparse.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']),
+                                             shape=(n_beers, n_beers))
+            return cls(arrays['beers'], similarities, version=str(arrays['version']) or None)
+
+
+def build_item_neighbors(ui_matrix, n=50, chunk_size=None, max_block_bytes=128 * 1024**2,
+                         version=None, verbose=False):
+    # cosine similarity between beer columns of the (unfilled) ratings
+    ratings_t = ui_matrix.ratings.T.tocsr()
+    n_beers = ratings_t.shape[0]
+    n = max(0, min(n, n_beers - 1))
+    if chunk_size is None:
+        # each chunk is a dense chunk_size x n_beers block of float64 similarities
+        chunk_size = max(1, int(max_block_bytes // (8 * max(n_beers, 1))))
+
+    norms = np.sqrt(np.asarray(ratings_t.multiply(ratings_t).sum(axis=1)).ravel())
+    norms = np.where(norms == 0, 1.0, norms)
+    rows, cols, values = [], [], []
+
+    start_time = time.time()
+    for start in range(0, n_beers, chunk_size):
+        beers = np.arange(start, min(start + chunk_size, n_beers))
+        block = ratings_t[beers].dot(ui_matrix.ratings).toarray()
+        block /= norms[beers][:, None] * norms[None, :]
+        block[np.arange(len(beers)), beers] = 0  # a beer is not its own neighbor
+        if n > 0:
+            top, top_values = top_k_columns(block, n)
+            keep = top_values > 0
+            rows.append(np.repeat(beers, keep.sum(axis=1)))
+            cols.append(top[keep])
+            values.append(top_values[keep])
+        if verbose:
+            done = beers[-1] + 1
+            elapsed = time.time() - start_time
+            print("{:,d} / {:,d} beers, {:,.0f} beers/s".format(done, n_beers, done / max(elapsed, 1e-9)))
+
+    if rows:
+        rows, cols, values = np.concatenate(rows), np.concatenate(cols), np.concatenate(values)
+    similarities = sparse.csr_matrix((np.asarray(values, dtype=np.float32), (rows, cols)),
+                                     shape=(n_beers, n_beers))
+    return ItemNeighbors(ui_matrix.beers, similarities, version=version)
+
+
+_item_neighbors = {}
+
+def get_item_neighbors(path=item_neighbors_path, database_path=db_path, n=50):
+    # the saved table while it matches the data, otherwise one built in
+    # memory (and kept for this data version)
+    version = data_version(database_path)
+    item_neighbors = _item_neighbors.get(path)
+    if item_neighbors is None or item_neighbors.version != version:
+        if os.path.exists(path):
+            item_neighbors = ItemNeighbors.load(path)
+        if item_neighbors is None or item_neighbors.version != version:
+            print("No item neighbors for this data, building them (see build_neighbors.py --items)")
+            item_neighbors = build_item_neighbors(get_ui_matrix(database_path=database_path), n=n,
+                                                  version=version)
+        _item_neighbors[path] = item_neighbors
+    return item_neighbors
     
 ######################################################   
 ### 3. Scale / Standardize Data 
@@ -229,42 +1153,466 @@ def transform_features_target(df, features, target):
 ### Modeling
 ######################################################  
 ## feature selection
-def cat_encoding(df, encoding_col):
+# cat_encoding, count_vectorizer and tfidf_vectorizer return a DataFrame with
+# one dense column per category / term, as they always have; pass
+# sparse_output=True for a SparseFrame that keeps those columns sparse
+def cat_encoding(df, encoding_col, sparse_output=False):
 
-    dummies = pd.get_dummies(df[encoding_col], drop_first=True, prefix=encoding_col)
-    df = pd.merge(df, dummies, left_index=True, right_index=True)
+    features = DescriptionEncoder('cat-encoding').fit(df[encoding_col]).transform(df, encoding_col)
+    if sparse_output:
+        return features
+    frame = features.to_frame()
+    frame.index = df.index
+    return frame
 
-    df.drop(encoding_col, axis=1, inplace=True)
-    
-    return df
+class SparseFrame:
+    """A frame whose text features stay a scipy sparse matrix.
 
-def count_vectorizer(df, vectoring_col):
+    `frame` holds the ordinary columns and `X` one column per vocabulary
+    term (`terms`), row for row. It supports the frame operations the
+    feature pipelines need (column lookup, boolean row selection, drop,
+    duplicated, a per-group mean), and matrix() stacks the numeric columns
+    in front of the terms as one CSR matrix to fit or predict on.
+    """
 
-    from sklearn.feature_extraction.text import CountVectorizer
-    vect = CountVectorizer()
-    X = vect.fit_transform(df[vectoring_col])
-    count_df = pd.DataFrame(X.toarray(), columns=vect.get_feature_names())
-    df = pd.concat([df.reset_index(drop=True), count_df], axis=1)
-    
-    df.drop(vectoring_col, axis=1, inplace=True)
-    
-    return df
+    def __init__(self, frame, X, terms):
+        self.frame = frame
+        self.X = sparse.csr_matrix(X, dtype=float)
+        self.terms = list(terms)
 
-def tfidf_vectorizer(df, vectoring_col):
-    
-    from sklearn.feature_extraction.text import TfidfVectorizer
-    vect = TfidfVectorizer()
-    X = vect.fit_transform(df[vectoring_col])
-    tfidf_df = pd.DataFrame(X.toarray(), columns=vect.get_feature_names())
-    df = pd.concat([df.reset_index(drop=True), tfidf_df], axis=1)
-    
-    df.drop(vectoring_col, axis=1, inplace=True)
+    @property
+    def columns(self):
+        return pd.Index(list(self.frame.columns) + self.terms)
+
+    @property
+    def shape(self):
+        return (len(self.frame), len(self.frame.columns) + len(self.terms))
+
+    def __len__(self):
+        return len(self.frame)
+
+    def __getitem__(self, key):
+        # a column of frame by name, otherwise a boolean row mask
+        if isinstance(key, str):
+            return self.frame[key]
+        return self.take(np.flatnonzero(np.asarray(key)))
+
+    def __setitem__(self, key, value):
+        self.frame[key] = value
+
+    def take(self, rows):
+        rows = np.asarray(rows, dtype=int)
+        return SparseFrame(self.frame.take(rows), self.X[rows], self.terms)
+
+    def drop(self, columns, axis=1):
+        return SparseFrame(self.frame.drop(columns, axis=axis), self.X, self.terms)
+
+    def map_rows(self, func):
+        # func takes frame and returns a frame with its rows filtered or
+        # reordered (a merge, an outlier filter); X's rows follow along
+        frame = func(self.frame.assign(sparse_row=np.arange(len(self))))
+        rows = frame.pop('sparse_row').values
+        return SparseFrame(frame, self.X[rows.astype(int)], self.terms)
+
+    def duplicated(self):
+        X = self.X.copy()
+        X.sum_duplicates()
+        text = [X.indices[a:b].tobytes() + X.data[a:b].tobytes() for a, b in zip(X.indptr[:-1], X.indptr[1:])]
+        return self.frame.assign(sparse_text=text).duplicated()
+
+    def mean_by(self, column):
+        # frame.groupby(column).mean().reset_index(), text features included
+        codes, keys = pd.factorize(self.frame[column], sort=True)
+        rows = np.flatnonzero(codes >= 0)
+        groups = sparse.csr_matrix((np.ones(len(rows)), (codes[rows], rows)), shape=(len(keys), len(self)))
+        counts = np.asarray(groups.sum(axis=1)).ravel()
+        X = sparse.diags(1 / counts).dot(groups).dot(self.X)
+        return SparseFrame(self.frame.groupby(column).mean().reset_index(), X, self.terms)
+
+    def matrix(self, columns=None):
+        # the numeric columns named, then every term, as one CSR matrix
+        columns = list(self.columns if columns is None else columns)
+        dense = columns[:len(columns) - len(self.terms)]
+        if columns[len(dense):] != self.terms:
+            raise ValueError("text features must come last, in vocabulary order")
+        return sparse.hstack([sparse.csr_matrix(self.frame[dense].values.astype(float)), self.X], format='csr')
+
+    def to_frame(self):
+        # a dense copy, for small row selections
+        return pd.concat([self.frame, pd.DataFrame(self.X.toarray(), index=self.frame.index, columns=self.terms)],
+                         axis=1)
+
+def count_vectorizer(df, vectoring_col, sparse_output=False):
+
+    features = DescriptionEncoder('count-vect').fit(df[vectoring_col]).transform(df, vectoring_col)
+    return features if sparse_output else features.to_frame()
+
+def tfidf_vectorizer(df, vectoring_col, sparse_output=False):
     
-    return df
+    features = DescriptionEncoder('tfidf-vect').fit(df[vectoring_col]).transform(df, vectoring_col)
+    return features if sparse_output else features.to_frame()
+
+# the feature selections that encode beer_description
+description_feature_selections = ['cat-encoding', 'count-vect', 'tfidf-vect', 'hash-vect', 'svd-vect']
+# the ones whose encoder is fitted on the catalog rather than the training rows
+catalog_feature_selections = ['cat-encoding', 'hash-vect', 'svd-vect']
+# hash-vect: description tokens, and n-grams of up to hash_ngrams words,
+# hashed into hash_buckets columns with no vocabulary. With hash_idf the
+# counts are idf-weighted and l2-normalized, the idf taken from the catalog
+hash_buckets = int(os.environ.get('HASH_BUCKETS', 2**12))
+hash_ngrams = int(os.environ.get('HASH_NGRAMS', 1))
+hash_idf = os.environ.get('HASH_IDF', '0') == '1'
+# svd-vect: the catalog's tf-idf description vectors projected onto their
+# top svd_components singular vectors, a few dense columns per beer. The
+# basis is built offline once per data version (build_description_basis.py)
+svd_components = int(os.environ.get('SVD_COMPONENTS', 64))
+description_basis_path = 'data/description-basis.pkl'
+
+class DescriptionEncoder:
+    """The beer_description features of one feature selection.
+
+    fit() learns the schema: the description categories for cat-encoding
+    and the idf for hash-vect (get_catalog_encoder fits them once per data
+    version from the catalog), the fitted vectorizer (vocabulary, and idf
+    for tfidf) otherwise. hash-vect without idf fits nothing: its width is
+    fixed by its bucket count, not the catalog. svd-vect fits a tf-idf
+    vectorizer and a truncated SVD basis on the catalog, and encodes to
+    dense float32 embeddings. Every other option encodes to a sparse matrix;
+    cat-encoding maps each description's category code straight to its
+    one-hot column. The encoder is stored with the model, so scoring
+    transforms only the beers asked for into exactly the columns the model
+    was trained on; descriptions it never saw encode as all zeros.
+    """
+
+    def __init__(self, feature_selection, n_buckets=None, ngrams=None, idf=None, n_components=None):
+        if feature_selection not in description_feature_selections:
+            raise ValueError("Unknown feature selection {!r}".format(feature_selection))
+        self.feature_selection = feature_selection
+        if feature_selection == 'hash-vect':
+            from sklearn.feature_extraction.text import HashingVectorizer
+            self.vect = HashingVectorizer(n_features=hash_buckets if n_buckets is None else n_buckets,
+                                          ngram_range=(1, hash_ngrams if ngrams is None else ngrams),
+                                          alternate_sign=False, norm=None)
+            self.use_idf = hash_idf if idf is None else idf
+            self.idf = None
+        elif feature_selection == 'svd-vect':
+            self.n_components = svd_components if n_components is None else n_components
+
+    def fit(self, descriptions):
+        if self.feature_selection == 'cat-encoding':
+            # in get_dummies' order; the first category is dropped on transform
+            self.categories = sorted(descriptions.dropna().unique())
+        elif self.feature_selection == 'hash-vect':
+            if self.use_idf:
+                from sklearn.feature_extraction.text import TfidfTransformer
+                self.idf = TfidfTransformer().fit(self.vect.transform(descriptions))
+        elif self.feature_selection == 'svd-vect':
+            from sklearn.feature_extraction.text import TfidfVectorizer
+            from sklearn.decomposition import TruncatedSVD
+            self.vect = TfidfVectorizer().fit(descriptions)
+            X = self.vect.transform(descriptions)
+            # TruncatedSVD needs fewer components than terms, and the tf-idf
+            # matrix has no more directions than distinct descriptions
+            n_components = max(1, min(self.n_components, X.shape[1] - 1, len(set(descriptions))))
+            self.svd = TruncatedSVD(n_components=n_components, random_state=12).fit(X)
+        else:
+            from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+            vect = CountVectorizer() if self.feature_selection == 'count-vect' else TfidfVectorizer()
+            self.vect = vect.fit(descriptions)
+        return self
+
+    def columns(self):
+        if self.feature_selection == 'cat-encoding':
+            return ['beer_description_{}'.format(category) for category in self.categories[1:]]
+        if self.feature_selection == 'hash-vect':
+            return ['hash_{}'.format(bucket) for bucket in range(self.vect.n_features)]
+        if self.feature_selection == 'svd-vect':
+            return ['svd_{}'.format(component) for component in range(self.svd.n_components)]
+        return self.vect.get_feature_names()
+
+    def encode(self, descriptions):
+        # the encoded columns alone, as a CSR matrix (an array for svd-vect)
+        if self.feature_selection == 'cat-encoding':
+            # one 1 per row at its code's column; the first category (code 0,
+            # dropped as in get_dummies) and unseen descriptions (-1) are empty
+            codes = pd.Categorical(descriptions, categories=self.categories).codes.astype(np.int64) - 1
+            hit = codes >= 0
+            indptr = np.concatenate([[0], np.cumsum(hit)])
+            return sparse.csr_matrix((np.ones(int(hit.sum())), codes[hit], indptr),
+                                     shape=(len(codes), max(len(self.categories) - 1, 0)))
+        if self.feature_selection == 'hash-vect':
+            X = self.vect.transform(descriptions)
+            return X if self.idf is None else self.idf.transform(X)
+        if self.feature_selection == 'svd-vect':
+            return self.svd.transform(self.vect.transform(descriptions)).astype(np.float32)
+        return self.vect.transform(descriptions)
+
+    def transform(self, df, col='beer_description'):
+        # df with col replaced by the encoded columns: a SparseFrame, or a
+        # plain frame for svd-vect's dense embeddings
+        X = self.encode(df[col])
+        if not sparse.issparse(X):
+            embeddings = pd.DataFrame(X, index=df.index, columns=self.columns())
+            return pd.concat([df.drop(col, axis=1), embeddings], axis=1)
+        return SparseFrame(df.reset_index(drop=True).drop(col, axis=1), X, self.columns())
+
+    def schema_key(self):
+        # equal for encoders that produce the same columns, whichever
+        # training job fitted them; hashed once per encoder object
+        if getattr(self, '_schema_key', None) is None:
+            digest = hashlib.sha1(self.feature_selection.encode())
+            if self.feature_selection == 'cat-encoding':
+                digest.update(json.dumps(self.categories, default=str).encode())
+            elif self.feature_selection == 'hash-vect':
+                digest.update(json.dumps([self.vect.n_features, self.vect.ngram_range]).encode())
+                if self.idf is not None:
+                    digest.update(self.idf.idf_.tobytes())
+            elif self.feature_selection == 'svd-vect':
+                digest.update(self.svd.components_.tobytes())
+            else:
+                digest.update(json.dumps(sorted(self.vect.vocabulary_.items())).encode())
+                if hasattr(self.vect, 'idf_'):
+                    digest.update(self.vect.idf_.tobytes())
+            self._schema_key = digest.hexdigest()
+        return self._schema_key
+
+class BeerFeatures:
+    """One row of scoring features per beer, built once per data version.
+
+    `numeric` is a contiguous float32 n_beers x 3 matrix of each beer's mean
+    ABV, IBU and global_rating, `descriptions` the beer's description and
+    `beer_index` maps beer_name to its row. A model's description columns
+    are encoded for every beer the first time that encoder's schema is
+    asked for and kept (float32: CSR, or a dense array of svd-vect
+    embeddings), so scoring any set of beers is a row gather.
+    """
+
+    numeric_columns = ['ABV', 'IBU', 'global_rating']
+
+    def __init__(self, beers, numeric, descriptions, version=None, max_encodings=8):
+        self.beers = np.asarray(beers)
+        self.numeric = np.ascontiguousarray(numeric, dtype=np.float32)
+        self.descriptions = pd.Series(descriptions).reset_index(drop=True)
+        self.version = version
+        self.beer_index = {beer: i for i, beer in enumerate(self.beers)}
+        self.max_encodings = max_encodings
+        self._encodings = OrderedDict()  # encoder schema key -> encoded block
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_ratings(cls, df, version=None):
+        # df: rating rows with beer_name, beer_description and the numeric columns
+        means = df.groupby('beer_name', sort=True)[cls.numeric_columns].mean()
+        descriptions = df.drop_duplicates('beer_name').set_index('beer_name')['beer_description']
+        return cls(means.index, means.values, descriptions.reindex(means.index), version=version)
+
+    def __getstate__(self):
+        # pickled (to the pipeline cache) without the lock or encodings
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['_encodings'] = OrderedDict()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.beers)
+
+    def rows(self, beer_names=None):
+        # (names, rows) of the beers asked for, in that order, skipping beers
+        # with no ratings; None is every beer
+        if beer_names is None:
+            return self.beers, np.arange(len(self.beers))
+        found = [beer for beer in beer_names if beer in self.beer_index]
+        return np.asarray(found), np.array([self.beer_index[beer] for beer in found], dtype=np.int64)
+
+    def encoded(self, encoder):
+        key = encoder.schema_key()
+        with self._lock:
+            if key in self._encodings:
+                self._encodings.move_to_end(key)
+                return self._encodings[key]
+        block = encoder.encode(self.descriptions)
+        if sparse.issparse(block):
+            block = sparse.csr_matrix(block, dtype=np.float32)
+        else:
+            block = np.ascontiguousarray(block, dtype=np.float32)
+        with self._lock:
+            self._encodings[key] = block
+            while len(self._encodings) > self.max_encodings:
+                self._encodings.popitem(last=False)
+        return block
+
+    def matrix(self, rows, encoder=None):
+        # model input for rows: the numeric columns, then the encoder's
+        # description columns (CSR unless they are svd-vect embeddings)
+        numeric = self.numeric[rows]
+        if encoder is None:
+            return numeric
+        block = self.encoded(encoder)
+        if sparse.issparse(block):
+            return sparse.hstack([sparse.csr_matrix(numeric), block[rows]], format='csr')
+        return np.hstack([numeric, block[rows]])
+
+
+_beer_features = {}
+_beer_features_lock = threading.Lock()
+
+def get_beer_features(database_path=db_path):
+    version = data_version(database_path)
+    features = _beer_features.get(database_path)
+    if features is None or features.version != version:
+        with _beer_features_lock:
+            features = _beer_features.get(database_path)
+            if features is None or features.version != version:
+                # a fresh worker reads the table another one built from the disk cache
+                columns = ['beer_name', 'beer_description'] + BeerFeatures.numeric_columns
+                features = pipeline_func(columns, [
+                    Step('ratings', load_ratings, memoize=False, remove_dups=False, database_path=database_path),
+                    Step('beer features', BeerFeatures.from_ratings, version=version)],
+                    key=('beer features', version))
+                _beer_features[database_path] = features
+    return features
+
+def score_beers(model, encoder, beer_names=None, database_path=db_path):
+    # (names, predictions) for the beers asked for, every beer by default
+    features = get_beer_features(database_path)
+    names, rows = features.rows(beer_names)
+    if len(rows) == 0:
+        return names, np.array([])
+    return names, model.predict(features.matrix(rows, encoder))
+
+_catalog_encoders = {}
+
+def build_description_basis(database_path=db_path, n_components=None):
+    # svd-vect's encoder for the catalog as it is now
+    features = get_beer_features(database_path)
+    encoder = DescriptionEncoder('svd-vect', n_components=n_components).fit(features.descriptions)
+    encoder.version = features.version
+    return encoder
+
+def description_basis_mtime(path=description_basis_path):
+    return os.path.getmtime(path) if os.path.exists(path) else None
+
+def load_description_basis(path=description_basis_path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as file:
+        return pickle.load(file)
+
+def get_catalog_encoder(feature_selection, database_path=db_path):
+    # cat-encoding's categories, hash-vect's idf or svd-vect's basis, from
+    # the catalog's descriptions; one encoder per data version (and saved
+    # basis, for svd-vect), shared by every training job and model in this worker
+    features = get_beer_features(database_path)
+    key = (database_path, feature_selection)
+    encoder = _catalog_encoders.get(key)
+    basis_mtime = description_basis_mtime() if feature_selection == 'svd-vect' else None
+    if encoder is None or encoder.version != features.version or encoder.basis_mtime != basis_mtime:
+        if feature_selection == 'svd-vect':
+            # the saved basis while it matches the data, otherwise one built in memory
+            encoder = load_description_basis()
+            if encoder is None or encoder.version != features.version:
+                print("No description basis for this data, building it (see build_description_basis.py)")
+                encoder = build_description_basis(database_path)
+        else:
+            encoder = DescriptionEncoder(feature_selection).fit(features.descriptions)
+            encoder.version = features.version
+        encoder.basis_mtime = basis_mtime
+        _catalog_encoders[key] = encoder
+    return encoder
+
+def fit_description_encoder(feature_selection, descriptions, database_path=db_path):
+    # the catalog's encoder for cat-encoding, hash-vect and svd-vect;
+    # count-vect and tfidf-vect are fitted on the training rows' descriptions
+    if feature_selection in catalog_feature_selections:
+        return get_catalog_encoder(feature_selection, database_path)
+    return DescriptionEncoder(feature_selection).fit(descriptions)
 
 ## models
 # CBF 
-def cbf(user_df, algorithm, target, impute_na_mean=False, remove_all_outliers=False, rand_state=12):
+# how cbf picks its regularization: 'path' scores each fold's whole alpha grid
+# at once, 'grid' runs the exhaustive GridSearchCV. Both pick the same params
+cbf_search = 'path'
+
+def scaled_fold(X, y):
+    # the centered, unit-norm columns a normalize=True model is fitted on
+    x_mean, y_mean = X.mean(axis=0), y.mean()
+    X_scaled = X - x_mean
+    norms = np.sqrt((X_scaled**2).sum(axis=0))
+    norms[norms == 0] = 1
+    return X_scaled / norms, y - y_mean, x_mean, y_mean, norms
+
+def ridge_path(X_scaled, y_centered, alphas):
+    # Ridge coefficients for every alpha from one SVD: w = V diag(s / (s^2 + alpha)) U'y
+    U, s, Vt = np.linalg.svd(X_scaled, full_matrices=False)
+    shrink = s[:, None] / (s[:, None]**2 + alphas)
+    return Vt.T.dot(shrink * U.T.dot(y_centered)[:, None])
+
+def cbf_path_search(algorithm, X, y, param_space, cv=5):
+    """The params GridSearchCV(cv=5, scoring='neg_mean_absolute_error',
+    iid=True) would pick, without fitting every grid point separately.
+
+    Per fold, Ridge solves all alphas from one SVD, and Lasso / ElasticNet
+    run one coordinate-descent path per l1_ratio, warm-started from alpha to
+    alpha, on a Gram matrix computed once for the fold. Out-of-fold absolute
+    errors are summed, which is the fold-size-weighted mean iid=True ranks on,
+    and ties go to the first point in ParameterGrid's order, as in the grid.
+    """
+    from sklearn.linear_model import enet_path
+    from sklearn.model_selection import KFold
+    # one user's rows, so sparse text features are small enough to solve dense
+    X = X.toarray() if sparse.issparse(X) else np.asarray(X, dtype=float)
+    y = np.asarray(y, dtype=float)
+    alphas = np.asarray(param_space['alpha'], dtype=float)
+    l1_ratios = param_space.get('l1_ratio', [1.0])
+    # enet_path runs from the largest alpha down
+    order = np.argsort(alphas)[::-1]
+
+    abs_errors = np.zeros((len(alphas), len(l1_ratios)))
+    for train, test in KFold(cv).split(X):
+        X_scaled, y_centered, x_mean, y_mean, norms = scaled_fold(X[train], y[train])
+        if algorithm == 'Ridge':
+            paths = [ridge_path(X_scaled, y_centered, alphas)]
+        else:
+            X_scaled = np.asfortranarray(X_scaled)
+            gram, xy = X_scaled.T.dot(X_scaled), X_scaled.T.dot(y_centered)
+            paths = []
+            for l1_ratio in l1_ratios:
+                _, coef, _ = enet_path(X_scaled, y_centered, l1_ratio=l1_ratio, alphas=alphas[order],
+                                       precompute=gram, Xy=xy)
+                paths.append(np.empty_like(coef))
+                paths[-1][:, order] = coef
+        for j, coef in enumerate(paths):
+            coef = coef / norms[:, None]
+            preds = X[test].dot(coef) + (y_mean - x_mean.dot(coef))
+            abs_errors[:, j] += np.abs(preds - y[test][:, None]).sum(axis=0)
+
+    # ParameterGrid sorts the keys, so alpha varies slowest
+    i, j = np.unravel_index(np.argmin(abs_errors), abs_errors.shape)
+    best_params = {'alpha': param_space['alpha'][i]}
+    if 'l1_ratio' in param_space:
+        best_params['l1_ratio'] = param_space['l1_ratio'][j]
+    return best_params
+
+def used_columns(X):
+    # the columns with a nonzero entry. normalize=True Lasso, Ridge and
+    # ElasticNet give an all-zero column a coefficient of exactly 0, so they
+    # can be fitted without them (most of a hash-vect encoding, for one user)
+    if sparse.issparse(X):
+        return np.flatnonzero(np.diff(X.tocsc().indptr))
+    return np.flatnonzero(np.any(X != 0, axis=0))
+
+def widen_coef(model, columns, n_features):
+    # a model fitted on X[:, columns] as one fitted on all n_features columns
+    coef = np.zeros(n_features)
+    coef[columns] = model.coef_
+    model.coef_ = coef
+    return model
+
+def cbf(user_df, algorithm, target, impute_na_mean=False, remove_all_outliers=False, rand_state=12, search=None):
         
     features = list(user_df.columns[user_df.columns != target])
     print("LEN OF FEATURES", len(features))
@@ -278,14 +1626,23 @@ def cbf(user_df, algorithm, target, impute_na_mean=False, remove_all_outliers=Fa
     #     pass
     
     # remove outliers
-    if remove_all_outliers == True:
+    if remove_all_outliers == True and isinstance(user_df, SparseFrame):
+        user_df = user_df.map_rows(lambda frame: outlier_analysis(frame, [target], outlier_threshold=0.0))
+    elif remove_all_outliers == True:
         user_df = outlier_analysis(user_df, [target], outlier_threshold=0.0)
     else:
         pass
     
     # train test split
     from sklearn.model_selection import train_test_split
-    X_train, X_test, y_train, y_test = train_test_split(user_df[features], user_df[target], test_size=0.2, random_state=rand_state)
+    X = user_df.matrix(features) if isinstance(user_df, SparseFrame) else user_df[features]
+    # one user's rows over the columns they use are small enough to fit dense,
+    # and sklearn 0.21's Ridge(normalize=True) misfits the intercept on sparse input
+    columns = None
+    if sparse.issparse(X):
+        columns = used_columns(X)
+        X = X[:, columns].toarray()
+    X_train, X_test, y_train, y_test = train_test_split(X, user_df[target], test_size=0.2, random_state=rand_state)
     
     # setup alg and param space for grid search 
     if algorithm == 'Lasso':
@@ -307,13 +1664,25 @@ def cbf(user_df, algorithm, target, impute_na_mean=False, remove_all_outliers=Fa
     else:
         raise ValueError("Please input a correct algorithm")
         
-    # gridsearch CV 
-    from sklearn.model_selection import GridSearchCV
-    gscv = GridSearchCV(model, param_space, cv=5, scoring='neg_mean_absolute_error', iid=True, refit=True)
-    gscv.fit(X_train, y_train)
+    search = cbf_search if search is None else search
+    report_stage('fit')
+    if search == 'path':
+        # whole regularization paths per fold, then refit like GridSearchCV's refit=True
+        best_model = model.set_params(**cbf_path_search(algorithm, X_train, y_train, param_space, cv=5))
+        best_model.fit(X_train, y_train)
+
+    elif search == 'grid':
+        # gridsearch CV 
+        from sklearn.model_selection import GridSearchCV
+        gscv = GridSearchCV(model, param_space, cv=5, scoring='neg_mean_absolute_error', iid=True, refit=True)
+        gscv.fit(X_train, y_train)
     
-    # get best model 
-    best_model = gscv.best_estimator_
+        # get best model 
+        best_model = gscv.best_estimator_
+
+    else:
+        raise ValueError("search must be 'path' or 'grid', got {!r}".format(search))
+    report_stage('evaluate')
     preds = best_model.predict(X_test)
 
     # evaluate performance
@@ -328,7 +1697,9 @@ def cbf(user_df, algorithm, target, impute_na_mean=False, remove_all_outliers=Fa
     print("Errors within 0.50 = {:.2f} %".format(half_error_perc))
 
     # fit best model over all data 
-    best_model.fit(user_df[features], user_df[target])
+    best_model.fit(X, user_df[target])
+    if columns is not None:
+        widen_coef(best_model, columns, len(features))
     best_params = {}
     print(param_space)
     for key in param_space.keys():
@@ -339,24 +1710,25 @@ def cbf(user_df, algorithm, target, impute_na_mean=False, remove_all_outliers=Fa
 
 
 # semi-coldstart - collaborative filtering
-def collaborative_filtering(df, user_of_interest):
+def collaborative_filtering(df, user_of_interest, neighbor_index=None):
     try:
         df.drop('nearest_neighbor_rank', axis=1, inplace=True)
     except:
         pass
-    df = COSINE_STEP(df, user_of_interest)
     beer_list = list(df[df['username']==user_of_interest]['beer_name'])
-    estimated_rating_list = []
-    error_list = []
-    for beer in beer_list:
-        try:
-            estimated_rating = df[ (df.sort_values('nearest_neighbor_rank')['beer_name'] == beer) & (df['username']!=user_of_interest) ]['user_rating'].iloc[0]
-            estimated_rating_list.append(estimated_rating)
+    df = rank_neighbors(df, user_of_interest, beer_list, neighbor_index=neighbor_index)
 
-            user_rating = df[(df['username']==user_of_interest) & (df['beer_name']==beer)]['user_rating'].iloc[0].astype(float)
-            error_list.append(estimated_rating-user_rating)
-        except IndexError:
+    # one grouped pass for the neighbors' ratings and one for the user's own
+    neighbor_ratings = closest_neighbor_ratings(df, user_of_interest)
+    user_ratings = first_rating_per_beer(df[df['username'] == user_of_interest])
+    rated_beers = []
+    for beer in beer_list:
+        if beer in neighbor_ratings.index:
+            rated_beers.append(beer)
+        else:
             print("SKIPPING:", beer)
+    estimated_rating_list = neighbor_ratings.reindex(rated_beers).values
+    error_list = estimated_rating_list - user_ratings.reindex(rated_beers).values.astype(float)
     mse = np.mean(np.array(error_list)**2)
     mae = np.absolute(error_list).mean()
     quarter_error_perc = 100 * np.sum(np.absolute(error_list) < 0.25) / len(error_list)
@@ -369,8 +1741,564 @@ def collaborative_filtering(df, user_of_interest):
     
     return mae, quarter_error_perc, half_error_perc 
 
+# item-based collaborative filtering
+def item_collaborative_filtering(user_df, item_neighbors):
+    # scores each beer the user rated from their ratings of its neighbors
+    # (a beer is never its own neighbor, so this is leave-one-out)
+    user_ratings = user_df.groupby('beer_name')['user_rating'].mean()
+    scores = item_neighbors.score(user_ratings)
+    estimates = scores.reindex(user_ratings.index)
+    for beer in estimates.index[estimates.isna()]:
+        print("SKIPPING:", beer)
+    error_list = (estimates - user_ratings)[estimates.notna()].values
+    mse = np.mean(np.array(error_list)**2)
+    mae = np.absolute(error_list).mean()
+    quarter_error_perc = 100 * np.sum(np.absolute(error_list) < 0.25) / len(error_list)
+    half_error_perc = 100 * np.sum(np.absolute(error_list) < 0.50) / len(error_list)
+
+    print("MSE = {:.2f}".format(mse))
+    print("MAE = {:.2f}".format(mae))
+    print("Errors within 0.25 = {:.2f} %".format(quarter_error_perc))
+    print("Errors within 0.50 = {:.2f} %".format(half_error_perc))
+
+    return scores, mae, quarter_error_perc, half_error_perc
+
+# matrix factorization
+als_model_path = 'data/als-model.npz'
+
+class FactorModel:
+    """Ratings factorized as global_mean + user_factors . item_factors.
+
+    Factors are float32, so a prediction is one length-`rank` dot product
+    and scoring the whole catalog for a user is one matrix-vector product.
+    """
+
+    def __init__(self, users, beers, user_factors, item_factors, global_mean, reg=0.1, version=None):
+        self.users = np.asarray(users)
+        self.beers = np.asarray(beers)
+        self.user_factors = np.asarray(user_factors, dtype=np.float32)
+        self.item_factors = np.asarray(item_factors, dtype=np.float32)
+        self.global_mean = float(global_mean)
+        self.reg = reg
+        self.version = version
+        self.user_index = {user: i for i, user in enumerate(self.users)}
+        self.beer_index = {beer: j for j, beer in enumerate(self.beers)}
+
+    @property
+    def rank(self):
+        return self.item_factors.shape[1]
+
+    def __contains__(self, username):
+        return username in self.user_index
+
+    def nbytes(self):
+        return self.user_factors.nbytes + self.item_factors.nbytes
+
+    def fold_in(self, user_ratings):
+        # factor for a user from their ratings (beer_name -> rating) against the
+        # fixed item factors, with the same regularization as training
+        columns = np.array([self.beer_index.get(beer, -1) for beer in user_ratings.index], dtype=int)
+        known = columns >= 0
+        item_factors = self.item_factors[columns[known]].astype(float)
+        ratings = np.asarray(user_ratings, dtype=float)[known] - self.global_mean
+        A = item_factors.T.dot(item_factors) + self.reg * max(known.sum(), 1) * np.eye(self.rank)
+        return np.linalg.solve(A, item_factors.T.dot(ratings)).astype(np.float32)
+
+    def scores(self, username=None, user_factor=None):
+        if user_factor is None:
+            user_factor = self.user_factors[self.user_index[username]]
+        return pd.Series(self.global_mean + self.item_factors.dot(user_factor), index=self.beers)
+
+    def predict(self, username, beers):
+        user_factor = self.user_factors[self.user_index[username]]
+        columns = [self.beer_index[beer] for beer in beers]
+        return self.global_mean + self.item_factors[columns].dot(user_factor)
+
+    def save(self, path=als_model_path):
+        np.savez(path, users=self.users.astype(str), beers=self.beers.astype(str),
+                 user_factors=self.user_factors, item_factors=self.item_factors,
+                 global_mean=self.global_mean, reg=self.reg, version=np.array(self.version or ''))
+
+    @classmethod
+    def load(cls, path=als_model_path):
+        with np.load(path) as arrays:
+            return cls(arrays['users'], arrays['beers'], arrays['user_factors'], arrays['item_factors'],
+                       float(arrays['global_mean']), reg=float(arrays['reg']),
+                       version=str(arrays['version']) or None)
+
+
+def als_blocks(counts, rank, max_block_bytes):
+    # rows grouped by rating count, so padding each row of a block to the
+    # block's longest row wastes little
+    order = np.argsort(counts, kind='mergesort')
+    sorted_counts = np.maximum(counts[order], 1)
+    blocks, start = [], 0
+    while start < len(order):
+        # rows are sorted, so a block's padded size is its size times its last row's count
+        sizes = (np.arange(len(order) - start) + 1) * sorted_counts[start:] * rank * 8
+        end = start + max(1, np.searchsorted(sizes, max_block_bytes, side='right'))
+        blocks.append(order[start:end])
+        start = end
+    return blocks
+
+def als_solve(ratings, offset, fixed, reg, rows, out):
+    # regularized least squares for `rows` of `ratings` against the fixed
+    # factors, all rows of the block solved in one batched call
+    block = ratings[rows]
+    counts = np.diff(block.indptr)
+    entry_rows = np.repeat(np.arange(len(rows)), counts)
+    positions = np.arange(block.nnz) - np.repeat(block.indptr[:-1], counts)
+
+    padded = np.zeros((len(rows), max(counts.max(), 1), fixed.shape[1]))
+    values = np.zeros(padded.shape[:2])
+    padded[entry_rows, positions] = fixed[block.indices]
+    values[entry_rows, positions] = block.data - offset
+
+    padded_t = padded.transpose(0, 2, 1)
+    A = np.matmul(padded_t, padded) + (reg * np.maximum(counts, 1))[:, None, None] * np.eye(fixed.shape[1])
+    b = np.matmul(padded_t, values[:, :, None])
+    out[rows] = np.linalg.solve(A, b)[:, :, 0]
+
+def train_als(ui_matrix, rank=32, reg=0.1, iterations=10, n_jobs=None, seed=12,
+              max_block_bytes=16 * 1024**2, version=None, verbose=False):
+    # alternating least squares on the observed ratings, centered on their
+    # mean; reg is scaled by each row's rating count
+    ratings = ui_matrix.ratings.tocsr()
+    ratings_t = ratings.T.tocsr()
+    global_mean = ratings.data.mean() if ratings.nnz else 0.0
+    n_jobs = n_jobs or os.cpu_count() or 1
+
+    rs = np.random.RandomState(seed)
+    user_factors = np.zeros((ratings.shape[0], rank))
+    item_factors = rs.normal(scale=0.1, size=(ratings.shape[1], rank))
+    user_blocks = als_blocks(np.diff(ratings.indptr), rank, max_block_bytes)
+    item_blocks = als_blocks(np.diff(ratings_t.indptr), rank, max_block_bytes)
+
+    # numpy releases the GIL in matmul / solve, so threads share the factors
+    # without copying them to worker processes
+    with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+        for iteration in range(iterations):
+            start_time = time.time()
+            list(pool.map(lambda rows: als_solve(ratings, global_mean, item_factors, reg, rows, user_factors),
+                          user_blocks))
+            list(pool.map(lambda rows: als_solve(ratings_t, global_mean, user_factors, reg, rows, item_factors),
+                          item_blocks))
+            if verbose:
+                entry_rows = np.repeat(np.arange(ratings.shape[0]), np.diff(ratings.indptr))
+                errors = ratings.data - global_mean - np.einsum(
+                    'ij,ij->i', user_factors[entry_rows], item_factors[ratings.indices])
+                print("iteration {} / {}: train RMSE = {:.4f} ({:.2f}s)".format(
+                    iteration + 1, iterations, np.sqrt(np.mean(errors**2)), time.time() - start_time))
+
+    return FactorModel(ui_matrix.users, ui_matrix.beers, user_factors, item_factors, global_mean,
+                       reg=reg, version=version)
+
+
+_als_models = {}
+
+def get_als_model(path=als_model_path, database_path=db_path, **params):
+    # the saved model while it matches the data, otherwise one trained in
+    # memory (and kept for this data version)
+    version = data_version(database_path)
+    model = _als_models.get(path)
+    if model is None or model.version != version:
+        if os.path.exists(path):
+            model = FactorModel.load(path)
+        if model is None or model.version != version:
+            print("No ALS model for this data, training one (see train_als.py)")
+            model = train_als(get_ui_matrix(database_path=database_path), version=version, **params)
+        _als_models[path] = model
+    return model
+
+
+def matrix_factorization(user_df, user_of_interest, model, test_size=0.2, rand_state=12):
+    # hold out part of the user's ratings, fold the rest into a user factor
+    # and score the held-out beers with it (the item factors did see them)
+    from sklearn.model_selection import train_test_split
+    user_ratings = user_df.groupby('beer_name')['user_rating'].mean()
+    train, test = train_test_split(user_ratings, test_size=test_size, random_state=rand_state)
+    error_list = model.scores(user_factor=model.fold_in(train)).reindex(test.index) - test
+    error_list = error_list.dropna().values
+
+    mse = np.mean(np.array(error_list)**2)
+    mae = np.absolute(error_list).mean()
+    quarter_error_perc = 100 * np.sum(np.absolute(error_list) < 0.25) / len(error_list)
+    half_error_perc = 100 * np.sum(np.absolute(error_list) < 0.50) / len(error_list)
+
+    print("MSE = {:.2f}".format(mse))
+    print("MAE = {:.2f}".format(mae))
+    print("Errors within 0.25 = {:.2f} %".format(quarter_error_perc))
+    print("Errors within 0.50 = {:.2f} %".format(half_error_perc))
+
+    # the user's scores come from the factor trained on all of their ratings
+    if user_of_interest in model:
+        scores = model.scores(user_of_interest)
+    else:
+        scores = model.scores(user_factor=model.fold_in(user_ratings))
+    return scores, mae, quarter_error_perc, half_error_perc
+
 # hybrid
-def run_hybrid(df, user_of_interest, target):
+# worker processes for the (min_ppu, top_n) grid; 1 fits every cell in this process
+hybrid_jobs = int(os.environ.get('HYBRID_JOBS', 1))
+# ranked layouts kept for repeated builds (keyed by run_hybrid's cache_key)
+hybrid_layout_cache_size = 4
+# fit each min_ppu group's cells from running sums, warm-starting every top_n
+# from the one before it, instead of a fresh LassoCV per cell
+hybrid_warm_start = os.environ.get('HYBRID_WARM_START', '0') == '1'
+# the warm start keeps a features x features sum at every fold boundary and
+# eigendecomposes one per fold fit, so wider training sets fall back to the
+# per-cell LassoCV
+hybrid_warm_max_features = 256
+# 'grid' fits every (min_ppu, top_n) cell; 'halving' screens them on row
+# subsamples first and fully trains only the best. The budget (seconds, or
+# None) stops a halving search early with the best cells found so far
+hybrid_search = os.environ.get('HYBRID_SEARCH', 'grid')
+hybrid_budget = float(os.environ['HYBRID_BUDGET']) if os.environ.get('HYBRID_BUDGET') else None
+# each halving rung keeps 1 / eta of the cells and trains on eta times more rows
+hybrid_halving_eta = 3
+# cells with fewer subsampled rows than this are screened on all their rows
+hybrid_halving_min_rows = 100
+# sparse training sets up to this size are fitted dense: LassoCV only uses a
+# precomputed Gram on dense input, and that beats sparse coordinate descent
+# by far when there are few features
+hybrid_dense_cell_bytes = 256 * 1024**2
+
+class HybridLayout:
+    """run_hybrid's ranked frame as float arrays, rows sorted by
+    nearest_neighbor_rank with unranked rows last.
+
+    `users`, `offsets` and `counts` give each ranked user's block of rows in
+    rank order, so a top-N training set is a prefix of X, and min_ppu is a
+    mask over `user_counts` (every user's row count in the frame). X is a
+    CSR matrix when df is a SparseFrame, and holds only the `columns` of
+    features that are nonzero in some ranked row: the rest get a coefficient
+    of 0 in every cell, so models are fitted without them and widened after.
+    """
+
+    def __init__(self, df, user_of_interest, features, target):
+        ranks = df['nearest_neighbor_rank'].values.astype(float)
+        # stable, so rows keep the frame's order within a rank
+        order = np.argsort(np.where(np.isnan(ranks), np.inf, ranks), kind='mergesort')
+        if isinstance(df, SparseFrame):
+            self.X = df.matrix(features)[order]
+        else:
+            self.X = np.asarray(df[features], dtype=float)[order]
+        self.y = np.array(df[target]).reshape(len(df), )[order]
+
+        sorted_ranks = ranks[order]
+        usernames = df['username'].values[order]
+        n_ranked = int(np.count_nonzero(~np.isnan(sorted_ranks)))
+        self.n_features = self.X.shape[1]
+        self.columns = used_columns(self.X[:n_ranked])
+        self.X = self.X[:, self.columns]
+        starts = np.flatnonzero(np.diff(sorted_ranks[:n_ranked], prepend=np.nan) != 0)
+        self.offsets = starts
+        self.counts = np.diff(np.append(starts, n_ranked))
+        self.users = usernames[starts]
+        self.n_ranked = n_ranked
+        self.user_counts = df['username'].value_counts()
+
+        test = usernames == user_of_interest
+        self.X_test = self.X[test]
+        self.y_test = self.y[test]
+
+    def n_users(self, min_ppu):
+        return int(np.count_nonzero(self.user_counts.values > min_ppu))
+
+    def training_sets(self, min_ppu, top_ns):
+        # the ranked rows of users with more than min_ppu rows, in rank order,
+        # and the end of each top_n's training set within them. Without a
+        # min_ppu filter they are a view of X, otherwise one gathered copy
+        keep = self.user_counts.reindex(self.users).values > min_ppu
+        if keep.all():
+            X, y = self.X[:self.n_ranked], self.y[:self.n_ranked]
+        else:
+            counts = self.counts[keep]
+            rows = np.repeat(self.offsets[keep] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+            X, y = self.X[rows], self.y[rows]
+        ends = np.cumsum(self.counts[keep])
+        stops = [int(ends[min(top_n, len(ends)) - 1]) if len(ends) else 0 for top_n in top_ns]
+        return (X, y), stops
+
+
+_hybrid_layouts = OrderedDict()
+
+def get_hybrid_layout(df, user_of_interest, features, target, ann_index=None, n_probes=None, cache_key=None):
+    # cache_key identifies the data behind df (e.g. data version and feature
+    # selection); without one the layout is built fresh
+    ann_key = None if ann_index is None else (ann_index.n_tables, ann_index.n_bits, ann_index.version, n_probes)
+    key = None if cache_key is None else (cache_key, user_of_interest, tuple(features), target, ann_key)
+    if key is not None and key in _hybrid_layouts:
+        _hybrid_layouts.move_to_end(key)
+        return _hybrid_layouts[key]
+
+    df = COSINE_STEP(df, user_of_interest, ann_index=ann_index, n_probes=n_probes)
+    layout = HybridLayout(df, user_of_interest, features, target)
+    if key is not None:
+        _hybrid_layouts[key] = layout
+        while len(_hybrid_layouts) > hybrid_layout_cache_size:
+            _hybrid_layouts.popitem(last=False)
+    return layout
+
+def fit_hybrid_cell(X_train, y_train, X_test, y_test, cv=5, n_alphas=100):
+
+    if sparse.issparse(X_train) and 8 * X_train.shape[0] * X_train.shape[1] <= hybrid_dense_cell_bytes:
+        X_train = X_train.toarray()
+
+    # train
+    from sklearn.linear_model import LassoCV
+    model = LassoCV(fit_intercept=True, normalize=True, cv=cv, n_alphas=n_alphas, random_state=12)
+    model.fit(X_train, y_train)
+
+    # Evaluate model on user's data 
+    mae, quarter, half = score_hybrid_cell(model.predict(X_test), y_test)
+    return model, mae, quarter, half
+
+def score_hybrid_cell(preds, y_test):
+
+    # evaluate results; plain arrays, since a frame built from [preds, y_test]
+    # has a column per test row and costs more than a small fit
+    abs_error = np.abs(np.asarray(preds, dtype=float) - np.asarray(y_test, dtype=float))
+
+    # Performance Metrics 
+    mae = np.mean(abs_error)
+    quarter = 100*np.count_nonzero(abs_error<=0.25)/len(abs_error)
+    half = 100*np.count_nonzero(abs_error<=0.50)/len(abs_error)
+
+    return mae, quarter, half
+
+_hybrid_arrays = {}
+
+def fit_hybrid_cell_shared(args):
+    # runs in a worker process; the training arrays are memory-mapped from
+    # disk rather than pickled to every worker. X_path is a sparse group's
+    # (data, indices, indptr, shape), whose CSR matrix is rebuilt over the maps
+    X_path, y_path, stop, X_test, y_test, cv, n_alphas = args
+    if X_path not in _hybrid_arrays:
+        if isinstance(X_path, tuple):
+            *paths, shape = X_path
+            X = sparse.csr_matrix(tuple(np.load(path, mmap_mode='r') for path in paths), shape=shape)
+        else:
+            X = np.load(X_path, mmap_mode='r')
+        _hybrid_arrays[X_path] = (X, np.load(y_path, mmap_mode='r'))
+    X, y = _hybrid_arrays[X_path]
+    return fit_hybrid_cell(X[:stop], y[:stop], X_test, y_test, cv=cv, n_alphas=n_alphas)
+
+def fit_hybrid_cells(groups, cells, X_test, y_test, n_jobs=1, cv=5, n_alphas=100):
+    # cells are (group, stop): train on the first `stop` rows of groups[group].
+    # Every cell sees the same arrays and LassoCV's folds are fixed, so the
+    # results don't depend on n_jobs
+    if n_jobs <= 1 or len(cells) <= 1:
+        return [fit_hybrid_cell(groups[group][0][:stop], groups[group][1][:stop], X_test, y_test,
+                                cv=cv, n_alphas=n_alphas)
+                for group, stop in cells]
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        paths = []
+        for i, (X, y) in enumerate(groups):
+            if sparse.issparse(X):
+                X = X.tocsr()
+                X_path = tuple(os.path.join(tmp_dir, 'X{}.{}.npy'.format(i, part))
+                               for part in ['data', 'indices', 'indptr'])
+                for path, array in zip(X_path, [X.data, X.indices, X.indptr]):
+                    np.save(path, array)
+                X_path += (X.shape,)
+            else:
+                X_path = os.path.join(tmp_dir, 'X{}.npy'.format(i))
+                np.save(X_path, X)
+            paths.append((X_path, os.path.join(tmp_dir, 'y{}.npy'.format(i))))
+            np.save(paths[-1][1], y)
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            return list(pool.map(fit_hybrid_cell_shared,
+                                 [paths[group] + (stop, X_test, y_test, cv, n_alphas) for group, stop in cells]))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+def fit_hybrid_rung(groups, cells, step, cv, n_alphas, X_test, y_test, n_jobs=1):
+    # each cell trained on every step-th row of its training set, which keeps
+    # rows from every neighbor in the top N. X[::step][:ceil(stop / step)] is
+    # X[:stop:step], so the cells still share one array per group
+    keys, sub_groups, sub_cells = {}, [], []
+    for group, stop in cells:
+        cell_step = step if stop // step >= hybrid_halving_min_rows else 1
+        if (group, cell_step) not in keys:
+            keys[group, cell_step] = len(sub_groups)
+            sub_groups.append((groups[group][0][::cell_step], groups[group][1][::cell_step]))
+        sub_cells.append((keys[group, cell_step], -(-stop // cell_step)))
+    return fit_hybrid_cells(sub_groups, sub_cells, X_test, y_test, n_jobs=n_jobs, cv=cv, n_alphas=n_alphas)
+
+def search_hybrid_cells(groups, cells, X_test, y_test, n_jobs=1, budget=None, eta=None):
+    """Successive halving over run_hybrid's cells.
+
+    The first rungs train every surviving cell on 1 / eta^k of its rows with
+    3-fold CV over 20 alphas, and keep the 1 / eta with the lowest MAE; the
+    last rung is the grid's own full 5-fold fit. Returns a result per cell,
+    (0, 0, 0, 0) for cells that were screened out, so the best finalist is
+    the grid's pick whenever it survives. With a budget, stops once it is
+    spent; the first batch of the first rung always runs, so there is a
+    result to return. Survivors are fitted best first, and a rung cut short
+    returns its cells' results over the previous rung's for the rest.
+    """
+    eta = hybrid_halving_eta if eta is None else eta
+    deadline = None if budget is None else time.time() + budget
+    rungs = [(eta**2, 3, 20), (eta, 3, 20), (1, 5, 100)]
+    survivors = list(range(len(cells)))
+    reached = {}
+
+    for rung, (step, cv, n_alphas) in enumerate(rungs):
+        start = time.time()
+        fitted = {}
+        # one cell per worker at a time, so the budget is checked between fits
+        batch = max(n_jobs, 1) if deadline is not None else len(survivors)
+        for i in range(0, len(survivors), batch):
+            if deadline is not None and time.time() > deadline and (rung, i) != (0, 0):
+                break
+            chunk = survivors[i:i + batch]
+            fitted.update(zip(chunk, fit_hybrid_rung(groups, [cells[c] for c in chunk], step, cv, n_alphas,
+                                                     X_test, y_test, n_jobs=n_jobs)))
+        print("Rung {}: {} of {} cells on 1/{} of their rows, cv={}, {:.2f}s".format(
+            rung, len(fitted), len(survivors), step, cv, time.time() - start))
+        # survivors this rung didn't get to keep their result from the last one
+        reached = {c: fitted[c] if c in fitted else reached[c] for c in survivors if c in fitted or c in reached}
+        if len(fitted) < len(survivors) or rung == len(rungs) - 1:
+            break
+        # lowest MAE first, so a budget that runs out mid-rung cuts the weakest
+        survivors = sorted(fitted, key=lambda c: fitted[c][1])[:-(-len(survivors) // eta)]
+
+    if deadline is not None and time.time() > deadline:
+        print("Budget of {:g}s spent; returning {} cells".format(budget, len(reached)))
+    return [reached.get(c, (0, 0, 0, 0)) for c in range(len(cells))]
+
+class GramLasso:
+    """A Lasso fitted from a training set's sums rather than its rows.
+
+    Carries LassoCV's fitted attributes (alpha_, alphas_, mse_path_, coef_,
+    intercept_) and predict, so it stands in for run_hybrid's models.
+    """
+
+    def __init__(self, coef, intercept, alpha, alphas, mse_path):
+        self.coef_ = coef
+        self.intercept_ = intercept
+        self.alpha_ = alpha
+        self.alphas_ = alphas
+        self.mse_path_ = mse_path
+
+    def predict(self, X):
+        if sparse.issparse(X):
+            return X.dot(self.coef_) + self.intercept_
+        return np.asarray(X, dtype=float).dot(self.coef_) + self.intercept_
+
+def prefix_stats(X, y, stops):
+    # (n, sum x, sum y, XtX, Xty, sum y^2) over the first `stop` rows for every
+    # stop, in one pass: each row is added once, as it comes into the prefix.
+    # X may be sparse; the sums are always dense
+    n_features = X.shape[1]
+    total = (0, np.zeros(n_features), 0.0, np.zeros((n_features, n_features)), np.zeros(n_features), 0.0)
+    stats, start = {}, 0
+    for stop in sorted(set(stops)):
+        X_new, y_new = X[start:stop], y[start:stop]
+        xtx = X_new.T.dot(X_new)
+        total = (total[0] + len(y_new), total[1] + np.asarray(X_new.sum(axis=0)).ravel(), total[2] + y_new.sum(),
+                 total[3] + (xtx.toarray() if sparse.issparse(xtx) else xtx),
+                 total[4] + X_new.T.dot(y_new), total[5] + y_new.dot(y_new))
+        stats[stop], start = total, stop
+    return stats
+
+def diff_stats(stats, other):
+    return tuple(a - b for a, b in zip(stats, other))
+
+def kfold_bounds(n_samples, cv):
+    # KFold(cv) without shuffling: contiguous folds, the first n % cv one row longer
+    sizes = np.full(cv, n_samples // cv)
+    sizes[:n_samples % cv] += 1
+    return [0] + np.cumsum(sizes).tolist()
+
+def centered_gram(stats):
+    # XtX, Xty and yty of the centered, unit-norm columns LassoCV(normalize=True) fits
+    n, sum_x, sum_y, xtx, xty, sum_yy = stats
+    x_mean, y_mean = sum_x / n, sum_y / n
+    gram = xtx - n * np.outer(x_mean, x_mean)
+    xy = xty - n * x_mean * y_mean
+    yy = sum_yy - n * y_mean**2
+    norms = np.sqrt(np.clip(np.diag(gram), 0, None))
+    # constant columns (up to the rounding of the sums) stay out of the fit
+    constant = norms <= 1e-8 * np.sqrt(n) * (1 + np.abs(x_mean))
+    gram[constant], gram[:, constant], xy[constant], norms[constant] = 0, 0, 0, 1
+    return gram / np.outer(norms, norms), xy / norms, yy, norms, x_mean, y_mean
+
+def gram_rows(gram, xy, yy):
+    # a (features + 1)-row design with the same XtX, Xty and yty as the
+    # training set, so coordinate descent on it solves the same Lasso
+    eigvals, eigvecs = np.linalg.eigh(gram)
+    keep = eigvals > max(eigvals.max(), 0) * 1e-12
+    roots = np.sqrt(np.where(keep, eigvals, 0))
+    y_rows = np.where(keep, eigvecs.T.dot(xy) / np.where(keep, roots, 1), 0)
+    residual = np.sqrt(max(yy - y_rows.dot(y_rows), 0))
+    X_rows = np.vstack([roots[:, None] * eigvecs.T, np.zeros(len(xy))])
+    return np.asfortranarray(X_rows), np.append(y_rows, residual)
+
+def gram_lasso_fit(stats, alphas, coef_init):
+    # coefficients (features x alphas) and intercepts on the original scale;
+    # coef_init is on the original scale too, so it carries over between sets
+    from sklearn.linear_model import lasso_path
+    gram, xy, yy, norms, x_mean, y_mean = centered_gram(stats)
+    X_rows, y_rows = gram_rows(gram, xy, yy)
+    # lasso_path's penalty is per row, and it sees len(y_rows) rows, not n
+    _, coef, _ = lasso_path(X_rows, y_rows, alphas=alphas * stats[0] / len(y_rows), coef_init=coef_init * norms,
+                            precompute=False, check_input=False)
+    coef = coef / norms[:, None]
+    return coef, y_mean - x_mean.dot(coef)
+
+def stats_mse(stats, coef, intercept):
+    # mean squared error of every (coef, intercept) column over the rows behind stats
+    n, sum_x, sum_y, xtx, xty, sum_yy = stats
+    sse = (sum_yy - 2 * coef.T.dot(xty) - 2 * intercept * sum_y
+           + np.einsum('ia,ij,ja->a', coef, xtx, coef) + 2 * intercept * coef.T.dot(sum_x) + n * intercept**2)
+    return sse / n
+
+def fit_hybrid_group_warm(X, y, stops, X_test, y_test, coef=None, cv=5, n_alphas=100, eps=1e-3):
+    # every cell of one min_ppu group, as LassoCV(normalize=True, cv=5) would
+    # fit them, from sums kept at each fold boundary. Each path is warm-started
+    # along its alphas, and each cell's final fit from the previous cell's coef
+    bounds = [kfold_bounds(stop, cv) for stop in stops]
+    stats = prefix_stats(X, y, [bound for cell in bounds for bound in cell])
+    coef = np.zeros(X.shape[1]) if coef is None else coef
+
+    results = []
+    for stop, bound in zip(stops, bounds):
+        # LassoCV's alpha grid, from the whole training set
+        xy = centered_gram(stats[stop])[1]
+        alpha_max = max(np.abs(xy).max() / stop, np.finfo(float).resolution)
+        alphas = np.logspace(np.log10(alpha_max * eps), np.log10(alpha_max), n_alphas)[::-1]
+
+        mse_path = np.empty((n_alphas, cv))
+        for k in range(cv):
+            test = diff_stats(stats[bound[k + 1]], stats[bound[k]])
+            path, intercepts = gram_lasso_fit(diff_stats(stats[stop], test), alphas, np.zeros(X.shape[1]))
+            mse_path[:, k] = stats_mse(test, path, intercepts)
+
+        alpha = alphas[np.argmin(mse_path.mean(axis=1))]
+        coef, intercept = gram_lasso_fit(stats[stop], np.array([alpha]), coef)
+        coef, intercept = coef[:, 0], intercept[0]
+        model = GramLasso(coef, intercept, alpha, alphas, mse_path)
+        mae, quarter, half = score_hybrid_cell(model.predict(X_test), y_test)
+        results.append((model, mae, quarter, half))
+    return results
+
+def fit_hybrid_cells_warm(groups, cells, X_test, y_test):
+    # cells in the same (group, stop) order as fit_hybrid_cells; the warm
+    # start carries over from one group to the next too
+    results = []
+    for i, (X, y) in enumerate(groups):
+        stops = [stop for group, stop in cells if group == i]
+        if stops:
+            results += fit_hybrid_group_warm(X, y, stops, X_test, y_test,
+                                             coef=results[-1][0].coef_ if results else None)
+    return results
+
+def run_hybrid(df, user_of_interest, target, ann_index=None, n_probes=None, n_jobs=None, cache_key=None,
+               warm_start=None, search=None, budget=None):
     
     features = list(df.columns[df.columns != target])
     try:
@@ -389,7 +2317,9 @@ def run_hybrid(df, user_of_interest, target):
     print("LEN OF FEATURES", len(features))
     print("TOP FEATURES ", features[:10])
     print("TARGET ", target)
-    df = COSINE_STEP(df, user_of_interest)
+    report_stage('neighbors')
+    layout = get_hybrid_layout(df, user_of_interest, features, target, ann_index=ann_index,
+                               n_probes=n_probes, cache_key=cache_key)
 
     min_ppu_list = [0, 50, 100, 250, 500]
     n_users_list = [5, 10, 15, 20, 30, 40, 50]
@@ -399,52 +2329,467 @@ def run_hybrid(df, user_of_interest, target):
     half_abs_error_list = []
     model_list = []
 
-
+    # split data: one group of rows per min_ppu, each top_n a prefix of it
+    groups, cells = [], []
     for min_ppu in min_ppu_list:
+        n_users_list = [n_users for n_users in n_users_list if n_users < layout.n_users(min_ppu)]
+        group, stops = layout.training_sets(min_ppu, n_users_list)
+        groups.append(group)
+        cells += [(len(groups) - 1, stop) for stop in stops] + [None]
+
+    n_jobs = hybrid_jobs if n_jobs is None else n_jobs
+    warm_start = hybrid_warm_start if warm_start is None else warm_start
+    search = hybrid_search if search is None else search
+    budget = hybrid_budget if budget is None else budget
+    report_stage('fit')
+    if search == 'halving':
+        results = iter(search_hybrid_cells(groups, [cell for cell in cells if cell is not None],
+                                           layout.X_test, layout.y_test, n_jobs=n_jobs, budget=budget))
+    elif search != 'grid':
+        raise ValueError("search must be 'grid' or 'halving', got {!r}".format(search))
+    elif warm_start and layout.X.shape[1] <= hybrid_warm_max_features:
+        results = iter(fit_hybrid_cells_warm(groups, [cell for cell in cells if cell is not None],
+                                             layout.X_test, layout.y_test))
+    else:
+        results = iter(fit_hybrid_cells(groups, [cell for cell in cells if cell is not None],
+                                        layout.X_test, layout.y_test, n_jobs=n_jobs))
 
-        user_indices = df.username.value_counts()[df.username.value_counts() > min_ppu].index
-        sub_df = df[df['username'].isin(user_indices)]
-        n_users_list = [n_users for n_users in n_users_list if n_users < len(user_indices)]
-
-        for top_n in n_users_list:
-
-            # split data 
-            top_n_nn = list(sub_df['nearest_neighbor_rank'].unique())[:top_n]
-            df_top_n = df[df['nearest_neighbor_rank'].isin(top_n_nn)]
-            X_train = df_top_n[features]
-            y_train = df_top_n[target]
-            y_train = np.array(y_train).reshape(len(y_train), )
-
-            X_test = df[df['username'] == user_of_interest][features]
-            y_test = df[df['username'] == user_of_interest][target]
-            y_test = np.array(y_test).reshape(len(y_test), )
-
-            # train
-            from sklearn.linear_model import LassoCV
-            model = LassoCV(fit_intercept=True, normalize=True, cv=5, random_state=12)
-            model.fit(X_train, y_train)
-
-            # Evaluate model on user's data 
-            preds = model.predict(X_test)
-
-            # evaluate results
-            results_df = pd.DataFrame([preds, y_test]).transpose()
-            results_df.columns = ['predicted', 'actual']
-            results_df['error'] = results_df['predicted'] - results_df['actual']
-            results_df['abs_error'] = abs(results_df['error'])
-
-            # Performance Metrics 
-            mae = np.mean(results_df['abs_error'])
-
-            quarter_abs_error_list.append(100*len(results_df[results_df['abs_error']<=0.25])/len(results_df))
-            half_abs_error_list.append(100*len(results_df[results_df['abs_error']<=0.50])/len(results_df))
-            mae_list.append(mae)
-            model_list.append(model)
-
-        # add breaks
-        quarter_abs_error_list.append(0)
-        half_abs_error_list.append(0)
-        mae_list.append(0)
-        model_list.append(0)
+    for cell in cells:
+        if cell is None:
+            # add breaks
+            model, mae, quarter, half = 0, 0, 0, 0
+        else:
+            model, mae, quarter, half = next(results)
+            if hasattr(model, 'coef_'):
+                widen_coef(model, layout.columns, layout.n_features)
+        quarter_abs_error_list.append(quarter)
+        half_abs_error_list.append(half)
+        mae_list.append(mae)
+        model_list.append(model)
         
-    return model_list, mae_list, quarter_abs_error_list, half_abs_error_list
\ No newline at end of file
+    return model_list, mae_list, quarter_abs_error_list, half_abs_error_list
+
+
+######################################################   
+### Model store
+######################################################   
+# fitted per-user models, by data version
+model_store_path = 'data/models'
+# in-memory budget for recently used models, per worker
+model_cache_bytes = int(os.environ.get('MODEL_CACHE_MB', 256)) * 1024**2
+
+def atomic_write(path, data):
+    # write to a temporary file next to path, then rename it over path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+class ModelStore:
+    """Fitted models on disk, one pickle per (username, technique,
+    feature_selection, data version) key, under
+    root/<version>/<technique>/<feature_selection>/<username>.pkl.
+
+    Writes go to a temporary file in the same directory that is then renamed
+    over the target, so readers (and resumed batch runs) only ever see whole
+    models.
+
+    get() and put() go through an in-memory LRU bounded by max_bytes, sized
+    by each model's pickled size. Models bigger than the whole budget are
+    never cached. Cached models are checked against the file's mtime, so a
+    model rewritten by another process (a training job, train_cbf.py) is
+    read again.
+    """
+
+    def __init__(self, root=model_store_path, max_bytes=model_cache_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # key -> (record, nbytes, mtime)
+        self._bytes = 0
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def directory(self, technique, feature_selection, version):
+        return os.path.join(self.root, version, technique, feature_selection)
+
+    def path(self, key):
+        username, technique, feature_selection, version = key
+        return os.path.join(self.directory(technique, feature_selection, version),
+                            quote(username, safe='') + '.pkl')
+
+    def __contains__(self, key):
+        return os.path.exists(self.path(key))
+
+    def usernames(self, technique, feature_selection, version):
+        # everyone with a stored model under (technique, feature_selection, version)
+        directory = self.directory(technique, feature_selection, version)
+        if not os.path.isdir(directory):
+            return set()
+        return {unquote(name[:-len('.pkl')]) for name in os.listdir(directory) if name.endswith('.pkl')}
+
+    def save(self, key, record):
+        # returns the pickled size in bytes and the file's mtime
+        path = self.path(key)
+        data = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        atomic_write(path, data)
+        return len(data), os.stat(path).st_mtime_ns
+
+    def _read(self, key):
+        try:
+            with open(self.path(key), 'rb') as file:
+                data = file.read()
+                mtime = os.fstat(file.fileno()).st_mtime_ns
+        except FileNotFoundError:
+            return None, 0, None
+        return pickle.loads(data), len(data), mtime
+
+    def load(self, key):
+        # straight from disk, bypassing the cache
+        return self._read(key)[0]
+
+    def _remember(self, key, record, nbytes, mtime):
+        with self._lock:
+            if key in self._cache:
+                self._bytes -= self._cache.pop(key)[1]
+            if nbytes > self.max_bytes:
+                return
+            self._cache[key] = (record, nbytes, mtime)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                _, (_, evicted, _) = self._cache.popitem(last=False)
+                self._bytes -= evicted
+                self._stats['evictions'] += 1
+
+    def get(self, key):
+        # the model for key, or None if nothing has been stored under it
+        try:
+            mtime = os.stat(self.path(key)).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[2] == mtime:
+                self._cache.move_to_end(key)
+                self._stats['hits'] += 1
+                return entry[0]
+            self._stats['misses'] += 1
+        record, nbytes, mtime = self._read(key)
+        if record is not None:
+            self._remember(key, record, nbytes, mtime)
+        return record
+
+    def put(self, key, record):
+        self._remember(key, record, *self.save(key, record))
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._cache), bytes=self._bytes, max_bytes=self.max_bytes)
+
+
+_model_stores = {}
+
+def get_model_store(root=model_store_path):
+    # one store, and so one cache, per directory in this worker
+    if root not in _model_stores:
+        _model_stores[root] = ModelStore(root)
+    return _model_stores[root]
+
+def model_key(username, technique, feature_selection, database_path=db_path):
+    # item-cf and als have no feature selection; they are stored under their own name
+    if technique in ['item-cf', 'als']:
+        feature_selection = technique
+    return (username, technique, feature_selection, data_version(database_path))
+
+def feature_frame(columns, feature_selection, database_path=db_path):
+    # (features, encoder) for every user's rows of columns, memoized per data
+    # version, so each build with the same columns and feature selection
+    # (cbf, hybrid, train_cbf.py) encodes the ratings once. A catalog
+    # encoder's schema is part of the key, so changing the HASH_* or
+    # SVD_COMPONENTS settings, or rebuilding the basis, encodes them afresh
+    schema = None
+    if feature_selection in catalog_feature_selections:
+        schema = get_catalog_encoder(feature_selection, database_path).schema_key()
+    return pipeline_func(columns, [Step('ratings', load_ratings, memoize=False, database_path=database_path),
+                                   Step('features', encode_ratings, feature_selection=feature_selection,
+                                        database_path=database_path)],
+                         key=('ratings', data_version(database_path), list(columns), schema))
+
+def encode_ratings(df, feature_selection, database_path=db_path):
+    report_stage('features')
+    return cbf_features(df, feature_selection, database_path=database_path)
+
+def cbf_feature_frame(feature_selection, database_path=db_path):
+    # every user's rows with the columns build_model fits cbf on for this
+    # feature selection, plus username
+    return feature_frame(['username', 'beer_description', 'ABV', 'IBU', 'global_rating', 'user_rating'],
+                         feature_selection, database_path=database_path)
+
+def cbf_features(df, feature_selection, database_path=db_path):
+    # (features, encoder): the encoder is saved with the model so scoring can
+    # encode new rows the same way; simple has none
+    if feature_selection == 'simple':
+        return df.drop(['beer_description'], axis=1), None
+    encoder = fit_description_encoder(feature_selection, df['beer_description'], database_path=database_path)
+    return encoder.transform(df, 'beer_description'), encoder
+
+
+######################################################   
+### Training jobs
+######################################################   
+# build_model callbacks queue their training here instead of running it
+# inside the request; the tabs poll the job's status until it finishes
+training_workers = int(os.environ.get('TRAINING_WORKERS', 2))
+training_jobs_path = 'data/jobs'
+training_job_ttl = 24 * 3600
+training_stages = ['data load', 'features', 'neighbors', 'fit', 'evaluate']
+
+def job_path(job_id, root=training_jobs_path):
+    return os.path.join(root, job_id + '.json')
+
+def write_job(status, root=training_jobs_path):
+    # status files are what every worker polls, so they are written atomically
+    status['updated'] = time.time()
+    atomic_write(job_path(status['id'], root), json.dumps(status, default=float).encode())
+
+def read_job(job_id, root=training_jobs_path):
+    # job ids come from the browser; anything but a plain id is unknown
+    if not job_id or not job_id.isalnum():
+        return None
+    try:
+        with open(job_path(job_id, root)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+# the status of the job running in this process, if any
+_current_job = None
+
+def report_stage(stage):
+    # called from the training code as it moves through training_stages;
+    # outside a training job this does nothing
+    if _current_job is None:
+        return
+    status, root = _current_job
+    now = time.time()
+    if status['stages']:
+        status['stages'][-1]['seconds'] = now - status['stages'][-1]['started']
+    status['stage'] = stage
+    status['stages'].append({'stage': stage, 'started': now, 'seconds': None})
+    write_job(status, root)
+
+def hybrid_feature_frame(feature_selection, database_path=db_path):
+    # every user's rows with the columns run_hybrid is fit on for this
+    # feature selection, and the encoder, as cbf_features
+    return feature_frame(['username', 'user_rating', 'beer_name', 'beer_description', 'ABV', 'IBU', 'global_rating'],
+                         feature_selection, database_path=database_path)
+
+# one function per technique: (username, feature_selection, algorithm) ->
+# (record for the model store or None, results shown by the tab)
+def train_cbf_job(user_of_interest, feature_selection, alg):
+    report_stage('data load')
+    if feature_selection == 'simple':
+        df = load_ratings(['username', 'beer_description', 'ABV', 'IBU', 'global_rating', 'user_rating'],
+                          username=user_of_interest)
+        report_stage('features')
+        df, encoder = cbf_features(df, feature_selection)
+    else:
+        df, encoder = cbf_feature_frame(feature_selection)
+    user_df = df[df['username'] == user_of_interest].drop(['username'], axis=1)
+
+    model, best_params, mae, quarter, half = cbf(user_df, alg, 'user_rating', impute_na_mean=True, remove_all_outliers=True)
+    record = {'model': model, 'feature_selection': feature_selection, 'encoder': encoder}
+    return record, {'mae': mae, 'quarter': quarter, 'half': half, 'best_params': best_params}
+
+def train_hybrid_job(user_of_interest, feature_selection, alg=None):
+    report_stage('data load')
+    hybrid_df, encoder = hybrid_feature_frame(feature_selection)
+    model_list, mae_list, quarter_list, half_list = run_hybrid(hybrid_df, user_of_interest, 'user_rating',
+                                                               cache_key=(data_version(), feature_selection))
+    report_stage('evaluate')
+    fitted = [i for i, mae in enumerate(mae_list) if mae > 0]
+    if not fitted:
+        # no cell was fitted: none had a training set, or the search budget ran out
+        return None, {'message': "No model could be fitted for {} within the search budget".format(user_of_interest)}
+    ind = min(fitted, key=lambda i: mae_list[i])
+    record = {'model': model_list[ind], 'feature_selection': feature_selection, 'encoder': encoder}
+    return record, {'mae': mae_list[ind], 'quarter': quarter_list[ind], 'half': half_list[ind]}
+
+def train_collab_filt_job(user_of_interest, feature_selection=None, alg=None):
+    report_stage('data load')
+    df = load_ratings(['user_rating', 'beer_name', 'username'], remove_dups=False)
+    report_stage('neighbors')
+    neighbor_index = get_neighbor_index()
+    report_stage('evaluate')
+    mae, quarter, half = collaborative_filtering(df, user_of_interest, neighbor_index=neighbor_index)
+    return None, {'mae': mae, 'quarter': quarter, 'half': half}
+
+def train_item_cf_job(user_of_interest, feature_selection=None, alg=None):
+    report_stage('data load')
+    user_df = load_ratings(['beer_name', 'user_rating'], username=user_of_interest, remove_dups=False)
+    report_stage('neighbors')
+    item_neighbors = get_item_neighbors()
+    report_stage('evaluate')
+    scores, mae, quarter, half = item_collaborative_filtering(user_df, item_neighbors)
+    # the "model" is the user's score for every beer
+    return {'model': scores, 'feature_selection': 'item-cf', 'encoder': None}, {'mae': mae, 'quarter': quarter, 'half': half}
+
+def train_als_job(user_of_interest, feature_selection=None, alg=None):
+    report_stage('data load')
+    user_df = load_ratings(['beer_name', 'user_rating'], username=user_of_interest, remove_dups=False)
+    report_stage('fit')
+    als_model = get_als_model()
+    report_stage('evaluate')
+    scores, mae, quarter, half = matrix_factorization(user_df, user_of_interest, als_model)
+    return {'model': scores, 'feature_selection': 'als', 'encoder': None}, {'mae': mae, 'quarter': quarter, 'half': half}
+
+training_techniques = {'cbf': train_cbf_job,
+                       'hybrid': train_hybrid_job,
+                       'collab-filt': train_collab_filt_job,
+                       'item-cf': train_item_cf_job,
+                       'als': train_als_job}
+
+def run_training_job(args):
+    # runs in a pool process
+    global _current_job
+    status, root, store_root = args
+    status.update(state='running', started=time.time())
+    _current_job = (status, root)
+    try:
+        record, result = training_techniques[status['technique']](
+            status['username'], status['feature_selection'], status['algorithm'])
+        if record is not None:
+            ModelStore(store_root).save(tuple(status['key']), record)
+        status.update(state='done', result=result)
+    except Exception as e:
+        status.update(state='failed', error='{}: {}'.format(type(e).__name__, e))
+    finally:
+        _current_job = None
+        if status['stages']:
+            status['stages'][-1]['seconds'] = time.time() - status['stages'][-1]['started']
+        status['finished'] = time.time()
+        write_job(status, root)
+    return status['state']
+
+class TrainingQueue:
+    """Training jobs on a process pool of at most max_workers processes.
+
+    submit() returns a job id straight away. Jobs report their stage to a
+    JSON status file under root, which any worker can read, and finished
+    models are saved to the model store under the key they were submitted
+    with.
+    """
+
+    def __init__(self, max_workers=training_workers, root=training_jobs_path, store_root=model_store_path):
+        self.max_workers = max_workers
+        self.root = root
+        self.store_root = store_root
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+        self._in_flight = {}
+        self._stats = {'submitted': 0, 'done': 0, 'failed': 0}
+
+    def _get_pool(self, broken=None):
+        # a pool started before a fork (gunicorn --preload) belongs to the parent;
+        # a broken one is replaced and the jobs it still held are failed
+        with self._lock:
+            if broken is not None and self._pool is broken:
+                self._pool = None
+                lost = [status for pool, status in self._in_flight.values() if pool is broken]
+            else:
+                lost = []
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+                self._pid = os.getpid()
+            pool = self._pool
+        if lost:
+            broken.shutdown(wait=False)
+        for status in lost:
+            self._fail(status, "BrokenProcessPool: a training worker died")
+        return pool
+
+    def _prune(self):
+        # status files outlive their jobs by training_job_ttl
+        if not os.path.isdir(self.root):
+            return
+        cutoff = time.time() - training_job_ttl
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            try:
+                if name.endswith('.json') and os.stat(path).st_mtime < cutoff:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def submit(self, technique, username, feature_selection=None, algorithm=None):
+        if technique not in training_techniques:
+            raise ValueError("Unknown technique {!r}".format(technique))
+        self._prune()
+        status = {'id': uuid.uuid4().hex, 'technique': technique, 'username': username,
+                  'feature_selection': feature_selection, 'algorithm': algorithm,
+                  'key': model_key(username, technique, feature_selection),
+                  'state': 'queued', 'stage': None, 'stages': [], 'error': None, 'result': None,
+                  'submitted': time.time(), 'started': None, 'finished': None}
+        write_job(status, self.root)
+        pool = self._get_pool()
+        try:
+            future = pool.submit(run_training_job, (status, self.root, self.store_root))
+        except BrokenProcessPool:
+            # a worker died (e.g. OOM-killed) and took the pool with it
+            pool = self._get_pool(broken=pool)
+            future = pool.submit(run_training_job, (status, self.root, self.store_root))
+        with self._lock:
+            self._in_flight[status['id']] = (pool, status)
+            self._stats['submitted'] += 1
+        future.add_done_callback(lambda future: self._finished(future, status))
+        return status['id']
+
+    def _fail(self, status, error):
+        # the job never got to write its own status (e.g. the process died)
+        with self._lock:
+            if self._in_flight.pop(status['id'], None) is None:
+                return
+            self._stats['failed'] += 1
+        status.update(state='failed', error=error, finished=time.time())
+        write_job(status, self.root)
+
+    def _finished(self, future, status):
+        try:
+            state = future.result()
+        except Exception as e:
+            self._fail(status, '{}: {}'.format(type(e).__name__, e))
+            return
+        with self._lock:
+            if self._in_flight.pop(status['id'], None) is not None:
+                self._stats[state] += 1
+
+    def status(self, job_id):
+        return read_job(job_id, self.root)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, max_workers=self.max_workers)
+        stats['pending'] = stats['submitted'] - stats['done'] - stats['failed']
+        return stats
+
+
+_training_queue = None
+
+def get_training_queue():
+    global _training_queue
+    if _training_queue is None:
+        _training_queue = TrainingQueue()
+    return _training_queue
+
+def job_progress(status):
+    # one line for the tabs to show while a job is queued or running
+    if status['state'] == 'queued':
+        return "Queued, waiting for a free worker..."
+    stage = status['stage'] or training_stages[0]
+    return "Building your model: {} (step {} of {}, {:.0f}s so far)".format(
+        stage, training_stages.index(stage) + 1, len(training_stages), time.time() - status['started'])
\ No newline at end of file